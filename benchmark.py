@@ -0,0 +1,352 @@
+"""
+This file contains a benchmark harness that runs the importer end to end against a local fake Jama server, so the
+throughput of the importer can be measured without touching a real Jama instance.
+
+Generate the standard CSV fixtures:
+    python benchmark.py fixtures --output-dir ./benchmark_data
+
+Run a benchmark, the fixture is generated if it does not exist yet:
+    python benchmark.py run --rows 100000 --mode custom_field --latency 0.005 --prefetch --posts 8
+
+Measure the startup overhead of the importer command line on a small file:
+    python benchmark.py startup --rows 10 --latency 0.05
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+from py_jama_rest_client.client import JamaClient
+
+import fake_jama_server
+from csv_relationship_importer import CSVRelationshipImporter
+from jama_transport import JamaTransport
+from rate_control import AdaptiveRateController
+from run_metrics import RunMetrics
+
+benchmark_logger = logging.getLogger('benchmark')
+
+FIXTURE_SIZES = [1000, 100000, 1000000]
+FIXTURE_MODES = ['id', 'custom_field']
+FIXTURE_HEADERS = ['SourceID', 'TargetID', 'RelationshipType']
+
+
+def fixture_path(output_dir: str, mode: str, row_count: int):
+    """
+    :return: the path of a generated CSV fixture.
+    """
+    return os.path.join(output_dir, 'relationships_{}_{}.csv'.format(mode, row_count))
+
+
+def generate_fixture(csv_file: str, row_count: int, mode: str, item_count: int, seed: int = 0):
+    """
+    Write a CSV file of random relationships between the items of a fake Jama server.
+    :param csv_file: The path of the file to write
+    :param row_count: The number of relationships to write
+    :param mode: 'id' to write item API ID's and relationship type ID's, 'custom_field' to write legacy id values and
+    relationship type names
+    :param item_count: The number of items to pick source and target items from
+    :param seed: Random seed, so the same fixture is generated every time
+    :return: None
+    """
+    random_generator = random.Random(seed)
+    with open(csv_file, 'w', newline='', encoding='utf-8') as open_csv_file:
+        csv_writer = csv.writer(open_csv_file)
+        csv_writer.writerow(FIXTURE_HEADERS)
+        for _ in range(row_count):
+            source_id = random_generator.randint(1, item_count)
+            target_id = random_generator.randint(1, item_count)
+            relationship_type = random_generator.choice(fake_jama_server.RELATIONSHIP_TYPES)
+            if mode == 'id':
+                csv_writer.writerow([source_id, target_id, relationship_type['id']])
+            else:
+                csv_writer.writerow([fake_jama_server.legacy_id(source_id),
+                                     fake_jama_server.legacy_id(target_id),
+                                     relationship_type['name']])
+    benchmark_logger.info('Generated {} rows in {}'.format(row_count, csv_file))
+
+
+def _serve_fake_jama(port_pipe, item_count, latency, error_rate, max_requests_per_second):
+    """
+    Run a fake Jama server, this is the target of the server process.
+    :return: None
+    """
+    server = fake_jama_server.make_server(fake_jama_server.FakeJamaState(item_count=item_count,
+                                                                         latency=latency,
+                                                                         error_rate=error_rate,
+                                                                         max_requests_per_second=max_requests_per_second))
+    port_pipe.send(server.server_port)
+    server.serve_forever()
+
+
+def start_fake_server(item_count: int, latency: float, error_rate: float, max_requests_per_second: float):
+    """
+    Start a fake Jama server in its own process so it does not compete with the importer for the GIL.
+    :return: A tuple of (process, base_url)
+    """
+    parent_pipe, child_pipe = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve_fake_jama,
+                                      args=(child_pipe, item_count, latency, error_rate, max_requests_per_second),
+                                      daemon=True)
+    process.start()
+    port = parent_pipe.recv()
+    return process, 'http://127.0.0.1:{}'.format(port)
+
+
+def _import_fixture(csv_file: str, mode: str, args, base_url: str, shard_index: int = 0):
+    """
+    Import a CSV file, or one shard of it, into a fake Jama server.
+    :return: A tuple of (summary, phase_times, importer_metrics)
+    """
+    if args.pooled_transport:
+        j_client = JamaTransport(base_url, credentials=('benchmark', 'benchmark'), pool_size=max(args.posts, 1) + 1)
+    else:
+        j_client = JamaClient(base_url, credentials=('benchmark', 'benchmark'))
+    rate_controller = None
+    if args.rate_control:
+        rate_controller = AdaptiveRateController(max_concurrency=max(args.posts, 1))
+
+    phase_times = {}
+    start_time = time.perf_counter()
+    run_metrics = RunMetrics()
+    rel_creator = CSVRelationshipImporter(j_client, rate_controller, metrics=run_metrics,
+                                          post_max_retries=args.post_retries, post_retry_backoff_seconds=0.1,
+                                          shard_count=args.shards, shard_index=shard_index)
+    phase_times['startup'] = time.perf_counter() - start_time
+
+    csv_args = (csv_file, True, [], FIXTURE_HEADERS[0], FIXTURE_HEADERS[1], FIXTURE_HEADERS[2])
+    process_args = (mode == 'custom_field', [1], [1], fake_jama_server.LEGACY_ID_FIELD,
+                    fake_jama_server.LEGACY_ID_FIELD, fake_jama_server.RELATIONSHIP_TYPES[0]['id'],
+                    args.prefetch, False, args.batch_size, args.lookup_workers)
+
+    if args.streaming:
+        phase_start = time.perf_counter()
+        rel_creator.stream_relationships(*csv_args, *process_args, args.posts, args.queue_size)
+        phase_times['stream'] = time.perf_counter() - phase_start
+    else:
+        phase_start = time.perf_counter()
+        rel_creator.load_csv_data(*csv_args)
+        phase_times['load'] = time.perf_counter() - phase_start
+
+        phase_start = time.perf_counter()
+        rel_creator.process_relationships(*process_args)
+        phase_times['process'] = time.perf_counter() - phase_start
+
+        phase_start = time.perf_counter()
+        rel_creator.post_relationships(args.posts)
+        phase_times['post'] = time.perf_counter() - phase_start
+    return rel_creator.get_summary(), phase_times, run_metrics.report()
+
+
+def run_benchmark(csv_file: str, mode: str, args):
+    """
+    Import a CSV file into a fresh fake Jama server and measure the run.
+    :param csv_file: The CSV file to import
+    :param mode: 'id' or 'custom_field', the mode the CSV file was generated in
+    :param args: The parsed command line arguments
+    :return: A dictionary of results
+    """
+    server_process, base_url = start_fake_server(args.items, args.latency, args.error_rate, args.max_rps)
+    try:
+        start_time = time.perf_counter()
+        if args.shards > 1:
+            # Import each shard in its own process, as a sharded import would.
+            with multiprocessing.Pool(args.shards) as pool:
+                shard_results = pool.starmap(_import_fixture, [(csv_file, mode, args, base_url, shard_index)
+                                                               for shard_index in range(args.shards)])
+            summary = {}
+            for shard_summary, _, _ in shard_results:
+                for key, value in shard_summary.items():
+                    summary[key] = summary.get(key, 0) + value if isinstance(value, int) else value
+            phase_times = {'shards': time.perf_counter() - start_time}
+            importer_metrics = [shard_metrics for _, _, shard_metrics in shard_results]
+        else:
+            summary, phase_times, importer_metrics = _import_fixture(csv_file, mode, args, base_url)
+        total_time = time.perf_counter() - start_time
+
+        stats = requests.get(base_url + '/__stats__').json()
+    finally:
+        server_process.terminate()
+
+    row_count = summary['rows_read']
+    api_calls = sum(stats['calls'].values())
+    return {
+        'csv_file': csv_file,
+        'mode': mode,
+        'rows': row_count,
+        'shards': args.shards,
+        'seconds': round(total_time, 3),
+        'rows_per_second': round(row_count / total_time, 1) if total_time else None,
+        'api_calls': api_calls,
+        'api_calls_per_row': round(api_calls / row_count, 4) if row_count else None,
+        'api_calls_by_endpoint': stats['calls'],
+        'relationships_created': stats['relationships'],
+        'phase_seconds': {phase: round(seconds, 3) for phase, seconds in phase_times.items()},
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'summary': summary,
+        'importer_metrics': importer_metrics,
+    }
+
+
+# Runs the importer command line with some config.py settings replaced, the settings are passed as JSON.
+STARTUP_SCRIPT = '''
+import json, runpy, sys
+import config
+config.__dict__.update(json.loads(sys.argv[1]))
+sys.argv = ['csv_relationship_importer.py']
+runpy.run_path('csv_relationship_importer.py', run_name='__main__')
+'''
+
+
+def _time_process(command: list, runs: int):
+    """
+    Run a command several times, each in a new process.
+    :return: The median number of seconds a run took.
+    """
+    run_times = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        run_times.append(time.perf_counter() - start_time)
+    return statistics.median(run_times)
+
+
+def run_startup_benchmark(args):
+    """
+    Measure how long the importer command line takes to import a small CSV file into a fake Jama server, from starting
+    the interpreter to exiting, with and without the instance metadata cache.  Each run is a new process, as it would be
+    for each file dropped by a pipeline.
+    :param args: The parsed command line arguments
+    :return: A dictionary of results
+    """
+    os.makedirs(args.output_dir, exist_ok=True)
+    csv_file = os.path.abspath(os.path.join(args.output_dir, 'startup_{}.csv'.format(args.rows)))
+    generate_fixture(csv_file, args.rows, 'id', args.items)
+    metadata_cache_file = os.path.abspath(os.path.join(args.output_dir, 'startup_instance_metadata.json'))
+    settings = {
+        'base_url': None,
+        'username': 'benchmark',
+        'password': 'benchmark',
+        'oauth': False,
+        'csv_location': csv_file,
+        'csv_has_headers': True,
+        'csv_source_column': FIXTURE_HEADERS[0],
+        'csv_target_column': FIXTURE_HEADERS[1],
+        'csv_relationship_type_column': FIXTURE_HEADERS[2],
+        'match_on_custom_field': False,
+        'log_directory': os.path.abspath(args.output_dir),
+        'write_run_report': False,
+        'journal_file': None,
+        'dead_letter_directory': None,
+        'metadata_cache_file': None,
+    }
+
+    server_process, base_url = start_fake_server(args.items, args.latency, 0.0, 0)
+    settings['base_url'] = base_url
+    results = {
+        'rows': args.rows,
+        'runs': args.runs,
+        'latency': args.latency,
+        'interpreter_seconds': round(_time_process([sys.executable, '-c', 'pass'], args.runs), 3),
+        'module_import_seconds': round(_time_process([sys.executable, '-c', 'import csv_relationship_importer'],
+                                                     args.runs), 3),
+    }
+    try:
+        for label, use_metadata_cache in (('without_metadata_cache', False), ('with_metadata_cache', True)):
+            run_settings = dict(settings, metadata_cache_file=metadata_cache_file if use_metadata_cache else None)
+            command = [sys.executable, '-c', STARTUP_SCRIPT, json.dumps(run_settings)]
+            if use_metadata_cache:
+                # Fill the cache once, as the first run of a pipeline would.
+                if os.path.exists(metadata_cache_file):
+                    os.remove(metadata_cache_file)
+                _time_process(command, 1)
+            calls_before = sum(requests.get(base_url + '/__stats__').json()['calls'].values())
+            run_seconds = _time_process(command, args.runs)
+            calls_after = sum(requests.get(base_url + '/__stats__').json()['calls'].values())
+            results[label] = {'seconds': round(run_seconds, 3),
+                              'overhead_seconds': round(run_seconds - results['interpreter_seconds'], 3),
+                              'api_calls_per_run': round((calls_after - calls_before) / args.runs, 1)}
+    finally:
+        server_process.terminate()
+    return results
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark the CSV relationship importer against a local fake '
+                                                     'Jama server.')
+    sub_parsers = arg_parser.add_subparsers(dest='command', required=True)
+
+    fixtures_parser = sub_parsers.add_parser('fixtures', help='Generate the standard CSV fixtures.')
+    fixtures_parser.add_argument('--output-dir', default='./benchmark_data')
+    fixtures_parser.add_argument('--sizes', type=int, nargs='+', default=FIXTURE_SIZES)
+    fixtures_parser.add_argument('--items', type=int, default=10000, help='Number of items to link.')
+
+    run_parser = sub_parsers.add_parser('run', help='Run the importer end to end and report its throughput.')
+    run_parser.add_argument('--csv', help='CSV file to import, defaults to the generated fixture.')
+    run_parser.add_argument('--output-dir', default='./benchmark_data')
+    run_parser.add_argument('--rows', type=int, default=1000, help='Fixture size to import.')
+    run_parser.add_argument('--mode', choices=FIXTURE_MODES, default='id')
+    run_parser.add_argument('--items', type=int, default=10000, help='Number of items on the fake server.')
+    run_parser.add_argument('--latency', type=float, default=0.0, help='Seconds taken by the server per request.')
+    run_parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail with 500.')
+    run_parser.add_argument('--max-rps', type=float, default=0, help='Server requests per second before 429.')
+    run_parser.add_argument('--prefetch', action='store_true', help='Prefetch the custom field lookup index.')
+    run_parser.add_argument('--batch-size', type=int, default=0, help='Number of values per batched lookup.')
+    run_parser.add_argument('--lookup-workers', type=int, default=1, help='Number of lookup threads.')
+    run_parser.add_argument('--streaming', action='store_true', help='Use the streaming pipeline.')
+    run_parser.add_argument('--queue-size', type=int, default=1000, help='Streaming queue size.')
+    run_parser.add_argument('--posts', type=int, default=1, help='Maximum number of posts in flight.')
+    run_parser.add_argument('--post-retries', type=int, default=0, help='Number of retries of a failed post.')
+    run_parser.add_argument('--shards', type=int, default=1, help='Number of shard processes to import with.')
+    run_parser.add_argument('--rate-control', action='store_true', help='Use the adaptive rate controller.')
+    run_parser.add_argument('--pooled-transport', action='store_true', help='Use the pooled transport, not JamaClient.')
+    run_parser.add_argument('--report', help='Also write the results to this JSON file.')
+
+    startup_parser = sub_parsers.add_parser('startup', help='Measure the startup overhead of the importer command line.')
+    startup_parser.add_argument('--output-dir', default='./benchmark_data')
+    startup_parser.add_argument('--rows', type=int, default=10, help='Number of rows in the CSV file to import.')
+    startup_parser.add_argument('--items', type=int, default=1000, help='Number of items on the fake server.')
+    startup_parser.add_argument('--latency', type=float, default=0.05, help='Seconds taken by the server per request.')
+    startup_parser.add_argument('--runs', type=int, default=5, help='Number of runs to take the median of.')
+    startup_parser.add_argument('--report', help='Also write the results to this JSON file.')
+
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    benchmark_logger.setLevel(logging.INFO)
+
+    if args.command == 'fixtures':
+        os.makedirs(args.output_dir, exist_ok=True)
+        for fixture_size in args.sizes:
+            for fixture_mode in FIXTURE_MODES:
+                generate_fixture(fixture_path(args.output_dir, fixture_mode, fixture_size),
+                                 fixture_size, fixture_mode, args.items)
+    elif args.command == 'startup':
+        results = run_startup_benchmark(args)
+        print(json.dumps(results, indent=2))
+        if args.report:
+            with open(args.report, 'w') as report_file:
+                json.dump(results, report_file, indent=2)
+    else:
+        benchmark_csv = args.csv
+        if benchmark_csv is None:
+            benchmark_csv = fixture_path(args.output_dir, args.mode, args.rows)
+            if not os.path.exists(benchmark_csv):
+                os.makedirs(args.output_dir, exist_ok=True)
+                generate_fixture(benchmark_csv, args.rows, args.mode, args.items)
+
+        results = run_benchmark(benchmark_csv, args.mode, args)
+        print(json.dumps(results, indent=2))
+        if args.report:
+            with open(args.report, 'w') as report_file:
+                json.dump(results, report_file, indent=2)
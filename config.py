@@ -22,6 +22,25 @@ client_id = os.environ.get('JAMA_CLIENT_ID')
 # Client Secret
 client_secret = os.environ.get('JAMA_CLIENT_SECRET')
 
+# Set to True to make API calls through the importer's own pooled transport instead of the py_jama_rest_client.  It
+# keeps connections to Jama open and reuses them between calls and threads, asks for gzip compressed responses, pages
+# through lists 50 results at a time and shares one OAuth token between every thread.  Leave as False to use the
+# py_jama_rest_client.
+use_pooled_transport = False
+# The maximum number of connections kept open to Jama, should be at least the number of API calls made at the same time.
+transport_pool_size = 32
+# The number of seconds to wait for a connection to Jama, and for Jama to answer each call, before giving up.
+transport_connect_timeout_seconds = 10
+transport_read_timeout_seconds = 60
+
+# Optional: Path of a small file that remembers, for a short time, that Jama accepted these credentials and the
+# relationship types of the instance.  Runs started soon after each other (ex: many small csv files) then skip those
+# API calls at startup.  Passwords and client secrets are never written to it, ex: './logs/instance_metadata.json'.
+# Leave as None to always ask Jama.
+metadata_cache_file = None
+# The number of seconds the remembered credentials check and relationship types stay valid.
+metadata_cache_ttl_seconds = 15 * 60
+
 
 ###################################################################################################
 #    CSV settings
@@ -29,6 +48,8 @@ client_secret = os.environ.get('JAMA_CLIENT_SECRET')
 # csv_location can be set to a specific csv file or a directory of csv file to import multiple files at once.
 # NOTE: if using import by directory, all files will be imported with the same configuration.
 csv_location = './simple_csv_with_headers.csv'
+# The maximum number of files to import at the same time when csv_location is a directory.
+max_concurrent_files = 1
 
 # Set to True if the file has headers, False otherwise; If CSV file does not have headers,header names must be supplied.
 csv_has_headers = True
@@ -55,6 +76,44 @@ match_on_custom_field = False
 source_item_custom_field_name = 'ea_legacy_id'
 target_item_custom_field_name = 'ea_legacy_id'
 
+# Optional: Match items on several fields at once, such as item type plus legacy ID.  A list of (csv column, item field)
+# pairs, a row matches the item whose fields all equal the row's values in those columns.  Item fields can be custom
+# fields or item properties such as itemType (the API id of the item type) or documentKey.  These keys are resolved
+# from the prefetched lookup index, which is built even if prefetch_lookup_index is False.  Leave empty to match on
+# csv_source_column / csv_target_column and the custom field names above.
+# EX: [('SourceType', 'itemType'), ('SourceGuiID', 'ea_legacy_id')]
+source_match_key = []
+target_match_key = []
+# Setting this to True will match values that only differ in case or whitespace (ex: ' REQ-1 ' matches 'req-1').  These
+# are resolved from the prefetched lookup index as well.
+normalize_match_keys = False
+
+# Setting this to True will read every item in the source and target projects once and match custom field values
+# from an in memory index.  This is much faster for large files, leave as False to search for each value individually.
+prefetch_lookup_index = False
+
+# The number of custom field values to look up with a single search when the lookup index is not prefetched, ex: 50.
+# Values whose batch returned items that are not exactly equal to them are searched for again on their own.  Leave as
+# 1 to search for each value individually.
+lookup_batch_size = 1
+
+# The number of threads used to look up custom field values that are not prefetched.  With streaming_pipeline set to
+# True, rows are posted as soon as their values are found while later rows are still being looked up.  A value needed
+# by several rows at the same time is only searched for once.  Set to 1 to look up values on a single thread.
+lookup_workers = 1
+
+# The maximum number of custom field values to keep in memory when the lookup index is not prefetched.  When full, the
+# least recently used value is forgotten to make room.  Set to 0 for no limit.
+lookup_table_max_size = 1000000
+
+# Optional: Path to a local file used to cache item and relationship type lookups between runs and between files.
+# Set to None to disable the cache.  EX: './lookup_cache.sqlite'
+lookup_cache_file = None
+# The number of seconds a cached lookup stays valid.
+lookup_cache_ttl_seconds = 24 * 60 * 60
+# Set to True to clear all cached lookups for this Jama instance before importing.
+invalidate_lookup_cache = False
+
 # Items will only be matched against items in the projects in the following lists, leave empty to match all projects.
 source_project_list = [1279]
 target_project_list = [1279]
@@ -62,6 +121,95 @@ target_project_list = [1279]
 # Default relationship type
 default_relationship_type = 4
 
+# Setting this to True will download the relationships already in the source and target projects and skip any row
+# that would create one of them again.  This makes re-running an import after a partial failure cheap.
+skip_existing_relationships = False
+
+# The maximum number of relationships to post at the same time.  Set to 1 to post one relationship at a time.
+max_concurrent_posts = 1
+
+# The number of seconds each post is assumed to take when --plan estimates the runtime of an import, ex: 0.25.
+# Nothing is posted while planning, so leave as None to time a few calls to the relationship types endpoint instead.
+plan_post_latency_seconds = None
+
+# The number of times a relationship that failed to post with a server error, or because the server did not answer,
+# is put back on a retry queue and posted again.  Each retry waits twice as long as the last, with some random jitter.
+# Set to 0 to never retry.  Bad requests (ex: an item that does not exist) are not retried.  A post the server may
+# have received is only posted again if the relationship is not found on its source item.  Item searches that fail the
+# same way are retried with the same settings, a row whose items still can not be looked up is counted as unresolved.
+post_max_retries = 3
+# The number of seconds to wait before the first retry of a failed post.
+post_retry_backoff_seconds = 2.0
+# The wait before retrying a failed post will never be longer than this many seconds.
+post_retry_max_backoff_seconds = 60.0
+
+# Optional: Directory to write a dead-letter CSV of the rows of each file that could not be imported to.  Rows that
+# failed to post, or whose items could not be found, are written with the same columns plus a reason column, so the
+# file can be imported again once the cause is fixed, ex: './logs/dead_letter/'.  Leave as None to only log these rows.
+dead_letter_directory = None
+
+# Optional: Directory to keep a manifest of the rows imported from each CSV file in.  On the next run only rows that
+# were added to the file, or that failed last time, are imported; unchanged rows are skipped without any lookups or
+# posts.  Set to None to import every row on every run.  EX: './logs/manifests/'
+manifest_directory = None
+# Set to True to write the rows removed from a CSV file since the last run to a CSV file next to its manifest.
+manifest_report_removed = False
+
+# Setting this to True will drop rows whose source, target and relationship type values were already read, from the
+# same file or from another file imported during the same run, before any lookups or posts are made for them.  Leave
+# as False to post every row.
+deduplicate_rows = False
+# Optional: Path of a temporary file to remember the rows read in, instead of memory, for very large imports.  The file
+# is removed at the end of the run.  Set to None to remember the rows in memory.  EX: './logs/seen_rows.sqlite'
+deduplicate_store_file = None
+
+# Setting this to True will stream rows from the CSV file straight through lookup and posting instead of loading the
+# whole file into memory first.  Posting starts right away and memory use stays flat regardless of the file size.
+streaming_pipeline = False
+# The maximum number of rows waiting between two stages of the stream.
+streaming_queue_size = 1000
+
+
+###################################################################################################
+#    Watch settings: used when the script is run with --watch
+###################################################################################################
+# The number of seconds between each check of csv_location for new or changed csv files.  Each check only lists the
+# directory, so short intervals are cheap unless it holds a very large number of files.
+watch_poll_interval_seconds = 0.25
+# A csv file is only imported once its size and modification time have not changed for this many seconds, so files
+# that are still being written are not imported half way through.  A dropped file is imported after between this and
+# this plus watch_poll_interval_seconds.  Raise it if the program writing the files can pause for longer than this
+# while writing one (ex: copies over a slow network share).
+watch_stable_seconds = 0.5
+# Set to True to also import the csv files already in csv_location when the script starts.
+watch_import_existing_files = False
+# The number of seconds after which the lookup tables and relationship types are rebuilt from Jama, so items created
+# since they were built can be found.  Set to 0 to never rebuild them.
+watch_lookup_refresh_seconds = 60 * 60
+
+###################################################################################################
+#    Rate control settings
+###################################################################################################
+# Set to True to share an adaptive rate controller between all API calls.  The number of calls in flight grows while
+# the server is healthy and is cut back whenever the server responds with 429 / 503 or times out.
+rate_control_enabled = True
+
+# The number of API calls allowed in flight when the import starts.
+rate_control_initial_concurrency = 4
+# The number of API calls in flight will stay between these bounds.
+rate_control_min_concurrency = 1
+rate_control_max_concurrency = 32
+# The number of calls in flight is multiplied by this value each time the server throttles us.
+rate_control_decrease_factor = 0.5
+
+# The number of times a throttled API call is retried before it is counted as a failure.
+rate_control_max_retries = 5
+# The number of seconds to pause after a throttled call, this doubles with each retry.
+rate_control_backoff_seconds = 1.0
+
+# How often (in seconds) to log the current API call rate and concurrency.
+rate_control_log_interval_seconds = 30
+
 
 ###################################################################################################
 #    Logging settings
@@ -72,3 +220,14 @@ log_directory = './logs/'
 log_file_name_prefix = 'csv_relationship_importer'
 # Logging date time format
 log_date_time_format = "%Y-%m-%d %H_%M_%S"
+# Set to True to write a JSON report of each run to the logging directory, with the time spent in each phase, API call
+# counts and latency percentiles by endpoint, lookup table hit ratios and rows per second.
+write_run_report = False
+# Optional: Path of a Prometheus textfile (ex: '/var/lib/node_exporter/csv_importer.prom') to write the same metrics to.
+# Set to None to disable.
+prometheus_textfile = None
+# Optional: Path of the journal that records every posted relationship.  Run the script with --resume to skip the rows
+# recorded by the previous run, ex: './logs/import_journal.csv'.  Leave as None to disable the journal.
+journal_file = None
+# The number of posted relationships to record between each sync of the journal to disk.
+journal_fsync_batch_size = 100
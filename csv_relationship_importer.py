@@ -1,14 +1,87 @@
+import argparse
+import copy
 import datetime
+import json
 import os
 import sys
 import time
 import csv
+import itertools
 import logging
+import queue
+import signal
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 
-from py_jama_rest_client.client import JamaClient, APIException
 
 import config
+import jama_api
 import project_utils as utils
+import sharding
+from dead_letter import DeadLetterWriter
+from import_journal import ImportJournal
+from directory_watcher import DirectoryWatcher
+from duplicate_filter import DuplicateFilter
+from import_manifest import ImportManifest
+from instance_metadata import InstanceMetadataCache
+from lookup_cache import LookupCache, LRULookupTable
+from match_keys import MatchKey, get_field_value
+from rate_control import AdaptiveRateController
+from retry_queue import RetryQueue, backoff_delay, is_retryable, may_have_been_carried_out
+from run_metrics import RunMetrics
+
+
+# Returned by lookup table reads when the value is not in the table, as None is a valid entry.
+_NOT_FOUND = object()
+
+
+class RelationshipRow:
+    """
+    The relationship data read from one row of a CSV file.  Rows are stored with __slots__ and interned strings to keep
+    the memory used by large files down.
+    """
+
+    __slots__ = ('row_number', 'source_data', 'target_data', 'rel_type_data')
+
+    def __init__(self, row_number: int, source_data: str, target_data: str, rel_type_data: str = None):
+        self.row_number = row_number
+        self.source_data = source_data
+        self.target_data = target_data
+        self.rel_type_data = rel_type_data
+
+    def __repr__(self):
+        return 'row {}: source <{}> target <{}> type <{}>'.format(self.row_number,
+                                                                  RelationshipRow._display(self.source_data),
+                                                                  RelationshipRow._display(self.target_data),
+                                                                  self.rel_type_data)
+
+    @staticmethod
+    def _display(value):
+        """
+        :return: a value that may hold several match key columns, in a form fit for the log.
+        """
+        if value is None:
+            return None
+        return value.replace(MatchKey.separator, ' + ')
+
+
+class PreparedRelationship:
+    """
+    A relationship that is ready to be posted to Jama Connect, along with the CSV row it was read from.
+    """
+
+    __slots__ = ('row_number', 'from_item', 'to_item', 'relationship_type', 'source_row')
+
+    def __init__(self, row_number: int, from_item, to_item, relationship_type, source_row: RelationshipRow = None):
+        self.row_number = row_number
+        self.from_item = from_item
+        self.to_item = to_item
+        self.relationship_type = relationship_type
+        self.source_row = source_row  # The CSV row this relationship was prepared from
+
+    def __repr__(self):
+        return 'row {}: fromItem {} toItem {} relationshipType {}'.format(self.row_number, self.from_item, self.to_item,
+                                                                          self.relationship_type)
 
 
 class CSVRelationshipImporter:
@@ -18,20 +91,168 @@ class CSVRelationshipImporter:
 
     logger = logging.getLogger('CSVRelationshipImporter')
 
-    def __init__(self, j_client: JamaClient, ):
+    # The number of seconds a streaming stage waits on a queue before checking if the stream was stopped.
+    stage_poll_seconds = 0.1
+
+    def __init__(self,
+                 j_client: 'jama_api.JamaClient',
+                 rate_controller: AdaptiveRateController = None,
+                 lookup_cache: LookupCache = None,
+                 journal: ImportJournal = None,
+                 resume: bool = False,
+                 metrics: RunMetrics = None,
+                 post_max_retries: int = 0,
+                 post_retry_backoff_seconds: float = 1.0,
+                 post_retry_max_backoff_seconds: float = 60.0,
+                 dead_letter_directory: str = None,
+                 manifest: ImportManifest = None,
+                 lookup_table_max_size: int = 0,
+                 shard_count: int = 1,
+                 shard_index: int = 0,
+                 duplicate_filter: DuplicateFilter = None,
+                 source_match_key: MatchKey = None,
+                 target_match_key: MatchKey = None,
+                 metadata_cache: InstanceMetadataCache = None):
         """
         Initialize the CSV Relationships Importer
         :param j_client:
+        :param rate_controller: Optional rate controller shared by all API calls, None to call the API directly.
+        :param lookup_cache: Optional persistent cache for item and relationship type lookups.
+        :param journal: Optional journal to record each posted relationship in.
+        :param resume: When True, rows recorded in the journal by a previous run are skipped.
+        :param metrics: Optional run metrics to record timings and counts in, shared with spawned importers.
+        :param post_max_retries: The number of times a post that failed with an error that may be temporary is retried.
+        :param post_retry_backoff_seconds: The base wait before retrying a failed post, this doubles with each retry.
+        :param post_retry_max_backoff_seconds: The wait before retrying a failed post will never be longer than this.
+        :param dead_letter_directory: Optional directory to write a dead-letter CSV of the rows of each file that could
+        not be imported to, None to only log them.
+        :param manifest: Optional manifest of the rows imported by previous runs.  Rows that are in the manifest are
+        skipped, and the manifest is updated by save_manifest after each file is imported.
+        :param lookup_table_max_size: When greater than 0, the item lookup tables hold at most this many values and
+        evict the least recently used value to make room.  Prefetched lookup tables are never bounded.
+        :param shard_count: The number of shards the import is split into, 1 to import every row.
+        :param shard_index: The shard to import, only rows whose source value hashes to this shard are read.
+        :param duplicate_filter: Optional filter shared by every file, rows whose source, target and relationship type
+        values were already read during the run are dropped before any lookups or posts.
+        :param source_match_key: Optional key to match source items on several fields, or on normalized values.  The
+        source value of each row is read from the key's columns instead of the source item column, and items are
+        matched from a prefetched lookup index.
+        :param target_match_key: Optional key to match target items with, like source_match_key.
+        :param metadata_cache: Optional short lived cache of the relationship types of the Jama instance, checked
+        before the lookup cache and the API.
         """
         self.j_client = j_client
+        self.rate_controller = rate_controller
+        self.lookup_cache = lookup_cache
+        self.journal = journal
+        self.resume = resume
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.shard_count = shard_count
+        self.shard_index = shard_index
+        self.duplicate_filter = duplicate_filter
+        self.duplicate_count = 0  # Stores the number of rows dropped because they repeat an earlier row
+        self.source_match_key = source_match_key
+        self.target_match_key = target_match_key
+        self.metadata_cache = metadata_cache
+        self.post_max_retries = post_max_retries
+        self.post_retry_backoff_seconds = post_retry_backoff_seconds
+        self.post_retry_max_backoff_seconds = post_retry_max_backoff_seconds
+        self.dead_letter_directory = dead_letter_directory
+        self.dead_letter = None  # Stores the dead-letter writer of the CSV file being imported
+        self._run_stamp = time.strftime('%Y-%m-%d_%H_%M_%S')  # Keeps the dead-letter files of each run apart
+        self.manifest = manifest
+        self._previous_fingerprints = set()  # Stores the fingerprints of the rows imported from this file before
+        self._kept_fingerprints = set()  # Stores the fingerprints of unchanged rows still in the file
+        self._new_manifest_rows = {}  # Stores fingerprint -> row values of rows imported by this run
+        self.skipped_unchanged_count = 0  # Stores the number of rows skipped because they are in the manifest
+        self.removed_row_count = 0  # Stores the number of manifest rows that are no longer in the file
+        self.csv_file = None  # Stores the path of the CSV file being imported
+        self.skipped_journaled_count = 0  # Stores the number of rows skipped because they were posted by a prior run
         self.raw_relationship_data = []
         self.prepped_relationship_data = []
-        self.source_item_map = {}  # Stores custom field -> item id info
-        self.target_item_map = {}  # Stores custom field -> item id info
+        self.lookup_table_max_size = lookup_table_max_size
+        self.source_item_map = self._new_lookup_table()  # Stores custom field -> item id info
+        self.target_item_map = self._new_lookup_table()  # Stores custom field -> item id info
         self.relationship_map = {}  # Stores Relationship name -> relationship id
+        self.lookup_index_prefetched = False  # True once the item maps hold every item in the lookup projects
+        self._in_flight_lookups = {}  # Stores (lookup table id, field value) -> Future of searches in progress
+        self._lookup_lock = threading.Lock()
+        self.existing_relationships = None  # Stores (fromItem, toItem, relationshipType) of relationships in Jama
+        self.skipped_existing_count = 0  # Stores the number of rows skipped because the relationship already exists
+        self.unresolved_count = 0  # Stores the number of rows skipped because their items could not be found
+        self.ambiguous_count = 0  # Stores the number of unresolved rows that matched more than one item
+        self.posted_relationship_count = 0  # Stores the number of relationships posted successfully
+        self.failed_posts_count = 0  # Stores the number of relationships that failed to post
+        self.retried_posts_count = 0  # Stores the number of times a failed post was retried
         self._build_relationship_map()
         self._csv_line_count = 0  # Stores the number of lines read in from csv
 
+    def spawn(self):
+        """
+        Create an importer for another CSV file.  The new importer shares the client, rate controller, caches, journal,
+        relationship type map and item lookup maps of this importer, so no lookup has to be repeated between files.
+        :return: a new CSVRelationshipImporter
+        """
+        rel_creator = copy.copy(self)
+        rel_creator.raw_relationship_data = []
+        rel_creator.prepped_relationship_data = []
+        rel_creator.csv_file = None
+        rel_creator.skipped_journaled_count = 0
+        rel_creator.skipped_existing_count = 0
+        rel_creator.unresolved_count = 0
+        rel_creator.ambiguous_count = 0
+        rel_creator.posted_relationship_count = 0
+        rel_creator.failed_posts_count = 0
+        rel_creator.retried_posts_count = 0
+        rel_creator.dead_letter = None
+        rel_creator._run_stamp = time.strftime('%Y-%m-%d_%H_%M_%S')
+        rel_creator._previous_fingerprints = set()
+        rel_creator._kept_fingerprints = set()
+        rel_creator._new_manifest_rows = {}
+        rel_creator.skipped_unchanged_count = 0
+        rel_creator.removed_row_count = 0
+        rel_creator.duplicate_count = 0
+        rel_creator._csv_line_count = 0
+        return rel_creator
+
+    def get_summary(self):
+        """
+        :return: A dictionary of counts describing the import of the current CSV file.
+        """
+        return {
+            'csv_file': self.csv_file,
+            'rows_read': self._csv_line_count,
+            'posted': self.posted_relationship_count,
+            'failed': self.failed_posts_count,
+            'skipped_existing': self.skipped_existing_count,
+            'skipped_journaled': self.skipped_journaled_count,
+            'skipped_unchanged': self.skipped_unchanged_count,
+            'duplicates': self.duplicate_count,
+            'removed': self.removed_row_count,
+            'unresolved': self.unresolved_count,
+            'retried': self.retried_posts_count,
+            'dead_lettered': self.dead_letter.row_count if self.dead_letter is not None else 0,
+        }
+
+    def get_plan(self):
+        """
+        Describe what posting the relationships loaded and processed so far would do, without posting them.
+        :return: A dictionary of counts describing the current CSV file.
+        """
+        return {
+            'csv_file': self.csv_file,
+            'rows_read': self._csv_line_count,
+            'distinct_source_values': len({relationship.source_data for relationship in self.raw_relationship_data}),
+            'distinct_target_values': len({relationship.target_data for relationship in self.raw_relationship_data}),
+            'duplicates': self.duplicate_count,
+            'skipped_journaled': self.skipped_journaled_count,
+            'skipped_unchanged': self.skipped_unchanged_count,
+            'skipped_existing': self.skipped_existing_count,
+            'unresolved': self.unresolved_count - self.ambiguous_count,
+            'ambiguous': self.ambiguous_count,
+            'projected_posts': len(self.prepped_relationship_data),
+        }
+
     def load_csv_data(self,
                       csv_file: str,
                       has_headers: bool,
@@ -42,8 +263,8 @@ class CSVRelationshipImporter:
         """
         This method will load data from a CSV file into a list of relationships to be processed and posted.
 
-        By using a CSV Dict reader, we allow for the consumption of non standardized CSV files,  All we need is the
-        name of the relevant columns to perform our operations.
+        The indexes of the relevant columns are looked up once from the header, so we allow for the consumption of non
+        standardized CSV files,  All we need is the name of the relevant columns to perform our operations.
 
         :param csv_file: The path to the file to be read
         :param has_headers: A boolean that denotes if the CSV file has headers
@@ -52,57 +273,185 @@ class CSVRelationshipImporter:
         :param target_item_column: A string describing the column name that contains the target item data
         :param relationship_type_column: None or a str describing the column name with the relationship type item data
         :return: None
-        :raise ValueError: If one of the provided column names cannot be located in the CSV dictreader.fieldnames var
+        :raise ValueError: If one of the provided column names cannot be located in the CSV header
         """
-        # Create log entry about the loading of this file.
-        CSVRelationshipImporter.logger.info('Loading CSV Data from: {}'.format(csv_file))
-
         # Clear out any possible old data.
         self.raw_relationship_data.clear()
 
+        # Read every row from the file into a list for processing.
+        with self.metrics.phase('csv_parse'):
+            self.raw_relationship_data.extend(self.iter_csv_data(csv_file,
+                                                                 has_headers,
+                                                                 headers,
+                                                                 source_item_column,
+                                                                 target_item_column,
+                                                                 relationship_type_column))
+
+    def iter_csv_data(self,
+                      csv_file: str,
+                      has_headers: bool,
+                      headers: list,
+                      source_item_column: str,
+                      target_item_column: str,
+                      relationship_type_column: str):
+        """
+        This method will read relationship data from a CSV file one row at a time.  It takes the same parameters as
+        load_csv_data.
+        :return: A generator that yields a RelationshipRow for each row in the file.
+        :raise ValueError: If one of the provided column names cannot be located in the CSV header
+        """
+        # Create log entry about the loading of this file.
+        CSVRelationshipImporter.logger.info('Loading CSV Data from: {}'.format(csv_file))
+
         # Keep track of how many lines are read.
         csv_lines_read = 0
+        self._csv_line_count = 0
+        self.csv_file = csv_file
+
+        # When resuming, rows posted by the previous run are skipped before any lookups are made.
+        self.skipped_journaled_count = 0
+        journaled_rows = {}
+        if self.resume and self.journal is not None:
+            journaled_rows = self.journal.posted_rows(csv_file)
+
+        # Rows that were imported by a previous run and have not changed since are skipped as well.
+        self.skipped_unchanged_count = 0
+        self.duplicate_count = 0
+        self._kept_fingerprints = set()
+        self._new_manifest_rows = {}
+        if self.manifest is not None:
+            self._previous_fingerprints = self.manifest.load(csv_file)
+
+        # Formatting a debug message for every row is expensive, so only do it when debug logging is on.
+        log_rows = CSVRelationshipImporter.logger.isEnabledFor(logging.DEBUG)
 
         # Open the CSV file for reading, use the utf-8-sig encoding to deal with excel file type outputs.
         with open(csv_file, encoding='utf-8-sig') as open_csv_file:
-            # We need to get a dict reader, if the CSV file has headers, we dont need to supply them
+            csv_reader = csv.reader(open_csv_file)
+
+            # If the CSV file has headers, we dont need to supply them
             if has_headers:
-                csv_dict_reader = csv.DictReader(open_csv_file)
+                fieldnames = next(csv_reader, [])
             # If the CSV doesn't have headers, we must supply headers or the first row will be consumed as header names.
             else:
-                csv_dict_reader = csv.DictReader(open_csv_file, fieldnames=headers)
+                fieldnames = headers
+
+            # With a match key, the source or target value of a row is read from each of the key's columns.
+            source_columns = self.source_match_key.columns if self.source_match_key is not None \
+                else [source_item_column]
+            target_columns = self.target_match_key.columns if self.target_match_key is not None \
+                else [target_item_column]
 
             # Validate that our header values exist and are valid.
-            CSVRelationshipImporter._validate_header_values(csv_dict_reader,
-                                                            source_item_column,
-                                                            target_item_column,
+            CSVRelationshipImporter._validate_header_values(fieldnames,
+                                                            source_columns[0],
+                                                            target_columns[0],
                                                             relationship_type_column)
+            missing_columns = [column for column in source_columns + target_columns if column not in fieldnames]
+            if missing_columns:
+                missing_key_error_message = 'Please ensure the match key settings are configured correctly with ' \
+                                            'header names.  These columns were not found: {}'.format(missing_columns)
+                CSVRelationshipImporter.logger.critical(missing_key_error_message)
+                raise ValueError(missing_key_error_message)
+
+            # Look up the position of each column once, rather than building a dictionary for every row.
+            source_indexes = [fieldnames.index(column) for column in source_columns]
+            target_indexes = [fieldnames.index(column) for column in target_columns]
+            source_index = source_indexes[0]
+            target_index = target_indexes[0]
+            composite_keys = len(source_indexes) > 1 or len(target_indexes) > 1
+            rel_type_index = None
+            if relationship_type_column is not None and relationship_type_column in fieldnames:
+                rel_type_index = fieldnames.index(relationship_type_column)
+            row_length = max(source_indexes + target_indexes + [rel_type_index or 0]) + 1
+
+            # Rows of this file that cannot be imported go to a dead-letter file with the same columns.  Without a
+            # header row, columns are only known by their position, so rows are written back in the file's layout.
+            if self.dead_letter_directory is not None:
+                dead_letter_columns = source_columns + target_columns
+                dead_letter_positions = source_indexes + target_indexes
+                if rel_type_index is not None:
+                    dead_letter_columns.append(relationship_type_column)
+                    dead_letter_positions.append(rel_type_index)
+                self._open_dead_letter(csv_file, dead_letter_columns,
+                                       None if has_headers else dead_letter_positions, len(fieldnames))
+
+            # Begin processing the data in the CSV file, blank lines are skipped.
+            for row_number, row_data in enumerate(row for row in csv_reader if row):
+                # When the import is sharded, rows that belong to other shards are left to their own workers.
+                if self.shard_count > 1 and sharding.shard_of(row_data[source_index] if len(row_data) > source_index
+                                                              else None, self.shard_count) != self.shard_index:
+                    continue
 
-            # Begin processing the data in the CSV file.
-            for row_number, row_data in enumerate(csv_dict_reader):
-                # For each row in the CSV file we will append an object to a list for later processing.
+                # For each row in the CSV file we will yield an object for later processing.
                 # First get source and target data.  These are mandatory, a missing data point here is an error.
                 csv_lines_read += 1
-                current_row_rel_data = {
-                    'row_number': row_number,
-                    'source_data': row_data[source_item_column],
-                    'target_data': row_data[target_item_column],
-                }
+                self._csv_line_count = csv_lines_read
+
+                # Short rows are padded so missing values read as None.
+                if len(row_data) < row_length:
+                    row_data = row_data + [None] * (row_length - len(row_data))
+                if composite_keys:
+                    source_data = self._key_value(self.source_match_key, row_data, source_indexes)
+                    target_data = self._key_value(self.target_match_key, row_data, target_indexes)
+                else:
+                    source_data = row_data[source_index]
+                    target_data = row_data[target_index]
+                current_row_rel_data = RelationshipRow(row_number,
+                                                       CSVRelationshipImporter._intern(source_data),
+                                                       CSVRelationshipImporter._intern(target_data))
 
                 # Now get the relationship data string if it exists.
-                if relationship_type_column is not None:
-                    relationship_info = row_data.get(relationship_type_column)
-                    current_row_rel_data['rel_type_data'] = relationship_info
+                if rel_type_index is not None:
+                    current_row_rel_data.rel_type_data = CSVRelationshipImporter._intern(row_data[rel_type_index])
+
+                # Rows are identified by a fingerprint of their values for the manifest and duplicate checks.
+                row_fingerprint = None
+                if self._previous_fingerprints or self.duplicate_filter is not None or journaled_rows:
+                    row_fingerprint = ImportManifest.fingerprint(current_row_rel_data.source_data,
+                                                                 current_row_rel_data.target_data,
+                                                                 current_row_rel_data.rel_type_data)
+
+                # Skip rows that are unchanged since the last run.  They still count as read for the duplicate filter,
+                # so a copy of the row in another file is not posted again.
+                if self._previous_fingerprints and row_fingerprint in self._previous_fingerprints:
+                    self._kept_fingerprints.add(row_fingerprint)
+                    self.skipped_unchanged_count += 1
+                    if self.duplicate_filter is not None:
+                        self.duplicate_filter.add(row_fingerprint)
+                    continue
+
+                # Skip rows already read from this file, or from another file during this run.
+                if self.duplicate_filter is not None and not self.duplicate_filter.add(row_fingerprint):
+                    self.duplicate_count += 1
+                    continue
 
-                # Append the data from this row to a list for processing.
-                self.raw_relationship_data.append(current_row_rel_data)
+                # Skip rows that were posted by an earlier attempt at this run, unless the file was rewritten since and
+                # the row now holds other values.  Journals without fingerprints only have the row number to go on.
+                if row_number in journaled_rows and journaled_rows[row_number] in (None, row_fingerprint):
+                    self.skipped_journaled_count += 1
+                    self._record_imported(current_row_rel_data)
+                    continue
 
                 # Create a log entry about the row we just read.
-                CSVRelationshipImporter.logger.debug('Read row {}, data: {} '.format(row_number, current_row_rel_data))
+                if log_rows:
+                    CSVRelationshipImporter.logger.debug('Read row {}, data: {} '.format(row_number,
+                                                                                        current_row_rel_data))
+
+                # Hand the data from this row on for processing.
+                yield current_row_rel_data
 
             # Log number of lines read
             CSVRelationshipImporter.logger.info('Read {} lines from file'.format(csv_lines_read))
-            self._csv_line_count = csv_lines_read
+            if self.skipped_journaled_count:
+                CSVRelationshipImporter.logger.info('{} rows were posted by a previous run and were '
+                                                    'skipped.'.format(self.skipped_journaled_count))
+            if self.skipped_unchanged_count:
+                CSVRelationshipImporter.logger.info('{} rows are unchanged since the last import and were '
+                                                    'skipped.'.format(self.skipped_unchanged_count))
+            if self.duplicate_count:
+                CSVRelationshipImporter.logger.info('{} duplicate rows were collapsed into the rows they '
+                                                    'repeat.'.format(self.duplicate_count))
 
     def process_relationships(self,
                               using_custom_field: bool,
@@ -110,46 +459,121 @@ class CSVRelationshipImporter:
                               target_projects: list,
                               source_lookup_field_name: str,
                               target_lookup_field_name: str,
-                              default_relationship_type_id: int):
+                              default_relationship_type_id: int,
+                              prefetch_index: bool = False,
+                              skip_existing: bool = False,
+                              lookup_batch_size: int = 0,
+                              lookup_workers: int = 1):
         """
         This function will process the relationships after they have been loaded,  It will prepare each relationship for
         posting to Jama Connect.
 
+        :param prefetch_index: When True, page through every item in the source and target projects once and resolve
+        all custom field values from that in memory index instead of searching for each value.
+        :param skip_existing: When True, download the relationships already in the source and target projects and skip
+        any row that would create one of them again.
+        :param lookup_batch_size: When greater than 1, custom field values that are not prefetched are looked up this
+        many at a time with a single search.
+        :param lookup_workers: When greater than 1, custom field values that are not prefetched are looked up on this
+        many threads at the same time.  Relationships are then prepared in the order their lookups finish.
         :return: None
         """
+        # Clear our prepped data list.
+        self.prepped_relationship_data.clear()
+
+        # Prepare every loaded relationship.
+        with self.metrics.phase('lookup'):
+            self.prepped_relationship_data.extend(self.iter_prepared_relationships(self.raw_relationship_data,
+                                                                                   using_custom_field,
+                                                                                   source_projects,
+                                                                                   target_projects,
+                                                                                   source_lookup_field_name,
+                                                                                   target_lookup_field_name,
+                                                                                   default_relationship_type_id,
+                                                                                   prefetch_index,
+                                                                                   skip_existing,
+                                                                                   lookup_batch_size,
+                                                                                   lookup_workers))
+
+    def iter_prepared_relationships(self,
+                                    relationships,
+                                    using_custom_field: bool,
+                                    source_projects: list,
+                                    target_projects: list,
+                                    source_lookup_field_name: str,
+                                    target_lookup_field_name: str,
+                                    default_relationship_type_id: int,
+                                    prefetch_index: bool = False,
+                                    skip_existing: bool = False,
+                                    lookup_batch_size: int = 0,
+                                    lookup_workers: int = 1):
+        """
+        This method will prepare relationships for posting one at a time.  Apart from the iterable of relationship data
+        to prepare, it takes the same parameters as process_relationships.
+        :param relationships: An iterable of relationship data as read from the CSV file
+        :return: A generator that yields each prepared relationship, rows that could not be prepared are skipped.
+        """
         # Create a log entry that we are going to prepare the relationship data for posting.
         CSVRelationshipImporter.logger.info('Preparing relationship data for posting.')
 
-        # If source and target project lists are equal, we can use one lookup table to reduce the amount of network work
-        if set(source_projects) == set(target_projects):
-            self.target_item_map = self.source_item_map
+        # Build any lookup tables we need that are not already built.
+        self.prepare_lookups(using_custom_field,
+                             source_projects,
+                             target_projects,
+                             source_lookup_field_name,
+                             target_lookup_field_name,
+                             prefetch_index,
+                             skip_existing)
+        self.skipped_existing_count = 0
+        self.unresolved_count = 0
+        self.ambiguous_count = 0
 
-        # Clear our prepped data list.
-        self.prepped_relationship_data.clear()
+        # Look up custom field values on a pool of threads, or several rows at a time, if requested.
+        if using_custom_field and lookup_workers > 1 and not self.lookup_index_prefetched:
+            relationships = self._iter_with_pipelined_lookups(relationships,
+                                                              lookup_workers,
+                                                              max(lookup_batch_size, 1),
+                                                              source_projects,
+                                                              target_projects,
+                                                              source_lookup_field_name,
+                                                              target_lookup_field_name)
+        elif using_custom_field and lookup_batch_size > 1 and not self.lookup_index_prefetched:
+            relationships = self._iter_with_batched_lookups(relationships,
+                                                            lookup_batch_size,
+                                                            source_projects,
+                                                            target_projects,
+                                                            source_lookup_field_name,
+                                                            target_lookup_field_name)
 
         # Begin processing relationsihps
-        for relationship in self.raw_relationship_data:
-            prepared_relationship = {}
+        for relationship in relationships:
             # here we may need to do a lookup to get the Item ID if we are using custom field information.
             if using_custom_field:
                 # we must do a lookup to find the item ID of the matching item.
                 try:
                     # Lookup source item id
-                    source_item_id = self._get_item_id_by_custom_field(relationship.get('source_data'),
-                                                                       source_lookup_field_name,
-                                                                       self.source_item_map,
-                                                                       source_projects)
+                    source_item_id = self._get_item_id_by_custom_field(
+                        CSVRelationshipImporter._lookup_value(self.source_match_key, relationship.source_data),
+                        source_lookup_field_name,
+                        self.source_item_map,
+                        source_projects,
+                        'source_item_map')
                     # Lookup target item id
-                    target_item_id = self._get_item_id_by_custom_field(relationship.get('target_data'),
-                                                                       target_lookup_field_name,
-                                                                       self.target_item_map,
-                                                                       target_projects)
+                    target_item_id = self._get_item_id_by_custom_field(
+                        CSVRelationshipImporter._lookup_value(self.target_match_key, relationship.target_data),
+                        target_lookup_field_name,
+                        self.target_item_map,
+                        target_projects,
+                        'target_item_map')
                     if source_item_id is None or target_item_id is None:
                         CSVRelationshipImporter.logger.warning('Unable to find items for: {}'.format(relationship))
+                        self.unresolved_count += 1
+                        self._write_dead_letter(relationship, 'source item not found' if source_item_id is None
+                                                else 'target item not found')
                         continue
                     # Lookup Relationship item id
                     try:
-                        relationship_type_id = self.relationship_map.get(relationship.get('rel_type_data'))
+                        relationship_type_id = self.relationship_map.get(relationship.rel_type_data)
                         if relationship_type_id is None:
                             relationship_type_id = default_relationship_type_id
                     except KeyError:
@@ -158,64 +582,530 @@ class CSVRelationshipImporter:
                 except ValueError as ve:
                     CSVRelationshipImporter.logger.error("SKIPPING ROW: {}".format(relationship))
                     CSVRelationshipImporter.logger.error(ve)
+                    self.unresolved_count += 1
+                    self.ambiguous_count += 1
+                    self._write_dead_letter(relationship, str(ve))
+                    continue
+                # Jama rejecting the credentials is not a problem with this row, every other row would fail too.
+                except jama_api.UnauthorizedException:
+                    raise
+                # The lookup still failed after its retries, or failed unexpectedly.  Leave the row for the next run.
+                except Exception as e:
+                    if isinstance(e, jama_api.APIException):
+                        CSVRelationshipImporter.logger.error("SKIPPING ROW: {} lookup failed: {}".format(relationship,
+                                                                                                       e))
+                    else:
+                        CSVRelationshipImporter.logger.exception("SKIPPING ROW: {} lookup failed".format(relationship))
+                    self.unresolved_count += 1
+                    self._write_dead_letter(relationship, 'lookup failed: {}'.format(e))
                     continue
 
                 # Build up the prepared relationship object for posting.
-                prepared_relationship['fromItem'] = source_item_id
-                prepared_relationship['toItem'] = target_item_id
-                prepared_relationship['relationshipType'] = relationship_type_id
+                prepared_relationship = PreparedRelationship(relationship.row_number,
+                                                             source_item_id,
+                                                             target_item_id,
+                                                             relationship_type_id,
+                                                             relationship)
 
             else:
                 # Assume the field already contains the item ID's this is faster to process and minimizes network time
-                prepared_relationship['fromItem'] = relationship['source_data']
-                prepared_relationship['toItem'] = relationship['target_data']
-                try:
-                    prepared_relationship['relationshipType'] = relationship['rel_type_data']
-                except KeyError:
-                    prepared_relationship['relationshipType'] = default_relationship_type_id
-            # Append the prepared relationship to the list to be posted.
-            self.prepped_relationship_data.append(prepared_relationship)
+                relationship_type_id = relationship.rel_type_data
+                if relationship_type_id is None:
+                    relationship_type_id = default_relationship_type_id
+                prepared_relationship = PreparedRelationship(relationship.row_number,
+                                                             relationship.source_data,
+                                                             relationship.target_data,
+                                                             relationship_type_id,
+                                                             relationship)
+
+            # Skip relationships that are already in Jama.
+            if self.existing_relationships is not None and \
+                    CSVRelationshipImporter._relationship_key(prepared_relationship.from_item,
+                                                              prepared_relationship.to_item,
+                                                              prepared_relationship.relationship_type) \
+                    in self.existing_relationships:
+                CSVRelationshipImporter.logger.debug('Relationship already exists, skipping: {}'.format(relationship))
+                self.skipped_existing_count += 1
+                self._record_imported(relationship)
+                continue
+
+            # Hand the prepared relationship on to be posted.
+            yield prepared_relationship
+
+    def prepare_lookups(self,
+                        using_custom_field: bool,
+                        source_projects: list,
+                        target_projects: list,
+                        source_lookup_field_name: str,
+                        target_lookup_field_name: str,
+                        prefetch_index: bool = False,
+                        skip_existing: bool = False):
+        """
+        Build the lookup tables used to prepare relationships.  Tables that are already built are left alone, so this
+        can be called once on a shared importer before it is spawned for each file.  The parameters are the same as
+        those of process_relationships.
+        :return: None
+        """
+        # Match keys are only resolved against the prefetched index, a search can not match on several fields at once.
+        if using_custom_field and not prefetch_index and \
+                (self.source_match_key is not None or self.target_match_key is not None):
+            CSVRelationshipImporter.logger.info('Match keys are set, prefetching the lookup index.')
+            prefetch_index = True
+
+        # A prefetched index must hold every item, so it is never bounded.
+        if using_custom_field and prefetch_index and not self.lookup_index_prefetched:
+            if isinstance(self.source_item_map, LRULookupTable):
+                self.source_item_map = dict(self.source_item_map)
+            if isinstance(self.target_item_map, LRULookupTable):
+                self.target_item_map = dict(self.target_item_map)
+
+        # If source and target project lists and lookup fields are equal, we can use one lookup table to reduce the
+        # amount of network work
+        if set(source_projects) == set(target_projects) and source_lookup_field_name == target_lookup_field_name \
+                and self.source_match_key == self.target_match_key:
+            self.target_item_map = self.source_item_map
+
+        # Build the in memory lookup index up front if requested, this replaces one search per value with one paged
+        # read of each project.
+        if using_custom_field and prefetch_index and not self.lookup_index_prefetched:
+            self._build_custom_field_index(source_lookup_field_name, source_projects, self.source_item_map,
+                                           self.source_match_key)
+            if self.target_item_map is not self.source_item_map:
+                self._build_custom_field_index(target_lookup_field_name, target_projects, self.target_item_map,
+                                               self.target_match_key)
+            self.lookup_index_prefetched = True
+
+        # Download the relationships that already exist so we don't create them again.
+        if skip_existing and self.existing_relationships is None:
+            self._build_existing_relationship_index(source_projects, target_projects)
 
-    def post_relationships(self, ):
+    def reset_lookups(self):
+        """
+        Forget the item lookup tables, the index of existing relationships and the relationship types, so they are
+        built again from Jama the next time prepare_lookups is called.  Importers that were already spawned keep using
+        the old tables.
+        :return: None
+        """
+        CSVRelationshipImporter.logger.info('Refreshing lookup tables and relationship types.')
+        self.source_item_map = self._new_lookup_table()
+        self.target_item_map = self._new_lookup_table()
+        self.lookup_index_prefetched = False
+        self.existing_relationships = None
+        self.relationship_map = {}
+        self._build_relationship_map()
+
+    def post_relationships(self, max_in_flight: int = 1):
         """
         This Method will post each relationship and log the results.
-        :param default_relationship_type: The API ID of the default relationship type to use.
+        :param max_in_flight: The maximum number of post requests to have in flight at once.  1 posts sequentially.
+        :return: None
+        """
+        with self.metrics.phase('post'):
+            self._post_and_log_summary(self.prepped_relationship_data, max_in_flight)
+
+    def stream_relationships(self,
+                             csv_file: str,
+                             has_headers: bool,
+                             headers: list,
+                             source_item_column: str,
+                             target_item_column: str,
+                             relationship_type_column: str,
+                             using_custom_field: bool,
+                             source_projects: list,
+                             target_projects: list,
+                             source_lookup_field_name: str,
+                             target_lookup_field_name: str,
+                             default_relationship_type_id: int,
+                             prefetch_index: bool = False,
+                             skip_existing: bool = False,
+                             lookup_batch_size: int = 0,
+                             lookup_workers: int = 1,
+                             max_in_flight: int = 1,
+                             queue_size: int = 1000):
+        """
+        This method will load, process and post the relationships in a CSV file as a stream.  Each stage runs in its own
+        thread and hands rows to the next stage through a bounded queue, so posting starts as soon as the first row is
+        prepared and memory use does not grow with the size of the file.  The CSV parameters are the same as those of
+        load_csv_data, and the processing parameters are the same as those of process_relationships.
+
+        :param max_in_flight: The maximum number of post requests to have in flight at once.  1 posts sequentially.
+        :param queue_size: The maximum number of rows waiting between two stages.
+        :return: None
+        """
+        raw_queue = queue.Queue(maxsize=queue_size)
+        prepped_queue = queue.Queue(maxsize=queue_size)
+        stage_errors = []
+        # Set when any stage fails, so the other stages stop instead of waiting on a queue forever.
+        stop_event = threading.Event()
+
+        # Stage 1: read rows from the CSV file.
+        csv_rows = self.iter_csv_data(csv_file,
+                                      has_headers,
+                                      headers,
+                                      source_item_column,
+                                      target_item_column,
+                                      relationship_type_column)
+        reader = threading.Thread(target=CSVRelationshipImporter._run_stage,
+                                  args=(csv_rows, raw_queue, stage_errors, stop_event),
+                                  name='csv-reader',
+                                  daemon=True)
+
+        # Stage 2: prepare each row for posting.
+        prepared_rows = self.iter_prepared_relationships(CSVRelationshipImporter._iter_queue(raw_queue, stop_event),
+                                                         using_custom_field,
+                                                         source_projects,
+                                                         target_projects,
+                                                         source_lookup_field_name,
+                                                         target_lookup_field_name,
+                                                         default_relationship_type_id,
+                                                         prefetch_index,
+                                                         skip_existing,
+                                                         lookup_batch_size,
+                                                         lookup_workers)
+        resolver = threading.Thread(target=CSVRelationshipImporter._run_stage,
+                                    args=(prepared_rows, prepped_queue, stage_errors, stop_event),
+                                    name='relationship-resolver',
+                                    daemon=True)
+        # Stage 3: post the prepared relationships on this thread.  The stages overlap, so they are timed as one.
+        with self.metrics.phase('stream'):
+            reader.start()
+            resolver.start()
+            try:
+                self._post_and_log_summary(CSVRelationshipImporter._iter_queue(prepped_queue, stop_event),
+                                           max_in_flight)
+            except Exception as e:
+                CSVRelationshipImporter.logger.critical('Import stream stopped by error: {}'.format(e))
+                stage_errors.append(e)
+                stop_event.set()
+            reader.join()
+            resolver.join()
+
+        # Surface any errors that stopped one of the stages early.
+        if stage_errors:
+            raise stage_errors[0]
+
+    def _post_and_log_summary(self, relationships, max_in_flight: int):
+        """
+        Post every relationship in an iterable and log a summary of the results.
+        :param relationships: An iterable of prepared relationship objects
+        :param max_in_flight: The maximum number of post requests to have in flight at once.
         :return: None
         """
         # Log beggining of posting phase:
         CSVRelationshipImporter.logger.info("Beginning to post relationships")
         # Keep track of successful and failed posts
-        posted_relationship_count = 0
-        failed_posts_count = 0
-        # Post each prepared relationship
-        for relationship in self.prepped_relationship_data:
-            try:
-                created_rel_id = self.j_client.post_relationship(relationship['fromItem'],
-                                                                 relationship['toItem'],
-                                                                 relationship['relationshipType'])
-                CSVRelationshipImporter.logger.info('Posted NEW relationship {}'.format(created_rel_id))
-                posted_relationship_count += 1
-
-            # Handle any errors
-            except APIException as e:
-                CSVRelationshipImporter.logger.error('Error while posting relationship. {} : {}'.format(relationship,
-                                                                                                        e))
-                failed_posts_count += 1
+        self.posted_relationship_count = 0
+        self.failed_posts_count = 0
+        self.retried_posts_count = 0
+        # Post each prepared relationship, relationships that fail for good go to the dead-letter file.  The file is
+        # closed even if posting stops early, so the rows written so far are not lost.
+        try:
+            for relationship, error in self._post_all(relationships, max_in_flight):
+                if error is None:
+                    self.posted_relationship_count += 1
+                    self._record_imported(relationship.source_row)
+                    # Keep the index of existing relationships current for later files.
+                    if self.existing_relationships is not None:
+                        self.existing_relationships.add(
+                            CSVRelationshipImporter._relationship_key(relationship.from_item,
+                                                                      relationship.to_item,
+                                                                      relationship.relationship_type))
+                else:
+                    CSVRelationshipImporter.logger.error('Error while posting relationship. {} : '
+                                                         '{}'.format(relationship, error))
+                    self.failed_posts_count += 1
+                    self._write_dead_letter(relationship.source_row, 'post failed: {}'.format(error))
+        finally:
+            self.close_dead_letter()
 
         # Log a summary
         CSVRelationshipImporter.logger.info('{} relationship were read from CSV.  {} relationships posted successful.'
                                             ' {} Failed during post.'.format(self._csv_line_count,
-                                                                             posted_relationship_count,
-                                                                             failed_posts_count))
+                                                                             self.posted_relationship_count,
+                                                                             self.failed_posts_count))
+        if self.retried_posts_count:
+            CSVRelationshipImporter.logger.info('{} failed posts were retried.'.format(self.retried_posts_count))
+        if self.existing_relationships is not None:
+            CSVRelationshipImporter.logger.info('{} relationships already existed and were '
+                                                'skipped.'.format(self.skipped_existing_count))
+
+    def _post_all(self, relationships, max_in_flight: int):
+        """
+        Post every relationship in an iterable on a pool of worker threads.  Relationships are only pulled from the
+        iterable as workers become free, so no more than max_in_flight relationships are held by the pool at any time.
+
+        Posts that fail with an error that may be temporary (a server error, throttling or no response) are put on a
+        retry queue, and are posted again after an exponential backoff with jitter, up to post_max_retries times.
+        Retries that are due are posted ahead of new relationships.  A post that got no response may have created the
+        relationship anyway, so before it is posted again the relationships of its source item are checked for it.
+        :param relationships: An iterable of prepared relationship objects
+        :param max_in_flight: The maximum number of post requests to have in flight at once.  1 posts sequentially.
+        :return: A generator that yields a tuple of (relationship, error) for each relationship once it is posted or
+        has failed for good.  error is None if the relationship was created.
+        """
+        relationships = iter(relationships)
+        retry_queue = RetryQueue(self.post_retry_backoff_seconds, self.post_retry_max_backoff_seconds)
+        max_in_flight = max(1, max_in_flight)
+        relationships_exhausted = False
+
+        unconfirmed = set()  # Stores the relationships whose last post may have created them
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            in_flight = {}  # Stores future -> (relationship, attempt)
+            while True:
+                # Hand out work while workers are free, retries that are due go first.
+                while len(in_flight) < max_in_flight:
+                    due_retry = retry_queue.pop_due()
+                    if due_retry is not None:
+                        relationship, attempt = due_retry
+                    elif not relationships_exhausted:
+                        relationship = next(relationships, None)
+                        if relationship is None:
+                            relationships_exhausted = True
+                            continue
+                        attempt = 0
+                    else:
+                        break
+                    future = executor.submit(self._post_relationship, relationship, relationship in unconfirmed)
+                    in_flight[future] = (relationship, attempt)
+
+                # Nothing in flight, we are either done or waiting for the next retry to be due.
+                if not in_flight:
+                    if relationships_exhausted and not retry_queue:
+                        return
+                    time.sleep(retry_queue.seconds_until_due() or 0)
+                    continue
+
+                # Wait for a post to finish, or for the next retry to be due.
+                done, _ = wait(in_flight, timeout=retry_queue.seconds_until_due(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    relationship, attempt = in_flight.pop(future)
+                    error = future.result()
+                    unconfirmed.discard(relationship)
+                    if error is not None and attempt < self.post_max_retries and is_retryable(error):
+                        if may_have_been_carried_out(error):
+                            unconfirmed.add(relationship)
+                        delay = retry_queue.push(relationship, attempt + 1)
+                        self.retried_posts_count += 1
+                        CSVRelationshipImporter.logger.warning('Post of {} failed, retry {} of {} in {:.1f}s. '
+                                                               'Error: {}'.format(relationship, attempt + 1,
+                                                                                  self.post_max_retries, delay, error))
+                        continue
+                    yield relationship, error
+
+    def _post_relationship(self, relationship, check_existing: bool = False):
+        """
+        Post a single relationship.
+        :param relationship: A prepared relationship object
+        :param check_existing: When True, look for the relationship on its source item first and only post it if it is
+        not there.  Used when an earlier post of the relationship may have created it.
+        :return: None if the relationship was created, otherwise the APIException raised by the post.
+        """
+        try:
+            created_rel_id = None
+            if check_existing:
+                created_rel_id = self._find_downstream_relationship(relationship)
+            if created_rel_id is not None:
+                CSVRelationshipImporter.logger.info('Relationship {} was created by an earlier post of '
+                                                    '{}'.format(created_rel_id, relationship))
+            else:
+                # The rate controller must not repeat a post the server may have received, see _post_all.
+                created_rel_id = self._call_api(self.j_client.post_relationship,
+                                                relationship.from_item,
+                                                relationship.to_item,
+                                                relationship.relationship_type,
+                                                idempotent=False)
+                CSVRelationshipImporter.logger.info('Posted NEW relationship {}'.format(created_rel_id))
+            if self.journal is not None:
+                self.journal.record(self.csv_file, relationship.row_number, created_rel_id,
+                                    CSVRelationshipImporter._row_fingerprint(relationship.source_row))
+            return None
+
+        # Hand any errors back to be retried or reported.
+        except jama_api.APIException as e:
+            return e
+        # Without a rate controller timeouts and connection errors reach us as they are, report them the same way.
+        except jama_api.requests.exceptions.RequestException as e:
+            return CSVRelationshipImporter._api_exception(e)
+
+    def _find_downstream_relationship(self, relationship):
+        """
+        Look for a relationship among the relationships of its source item.
+        :param relationship: A prepared relationship object
+        :return: The ID of the relationship in Jama, or None if it does not exist.
+        """
+        relationship_key = CSVRelationshipImporter._relationship_key(relationship.from_item,
+                                                                     relationship.to_item,
+                                                                     relationship.relationship_type)
+        for downstream_relationship in self._call_api(self.j_client.get_items_downstream_relationships,
+                                                      relationship.from_item):
+            downstream_key = CSVRelationshipImporter._relationship_key(downstream_relationship.get('fromItem'),
+                                                                       downstream_relationship.get('toItem'),
+                                                                       downstream_relationship.get('relationshipType'))
+            # Without a type the relationship was posted with the default type, any type matches.
+            if downstream_key[:2] == relationship_key[:2] and \
+                    (relationship.relationship_type is None or downstream_key == relationship_key):
+                return downstream_relationship.get('id')
+        return None
+
+    def save_manifest(self):
+        """
+        Save the manifest of the CSV file just imported: the rows that were unchanged since the last run, plus the rows
+        this run posted or found already in Jama.  Rows that failed or could not be resolved are left out, so they are
+        tried again by the next run.
+        :return: None
+        """
+        if self.manifest is None or self.csv_file is None:
+            return
+        self.removed_row_count = self.manifest.save(self.csv_file, self._kept_fingerprints, self._new_manifest_rows)
+        if self.removed_row_count:
+            CSVRelationshipImporter.logger.info('{} rows imported by a previous run are no longer in '
+                                                '{}.'.format(self.removed_row_count, self.csv_file))
+
+    def _record_imported(self, relationship):
+        """
+        Record a row that has been imported, so it is added to the manifest.
+        :param relationship: The RelationshipRow read from the CSV file
+        :return: None
+        """
+        if self.manifest is None or relationship is None:
+            return
+        row_values = (relationship.source_data, relationship.target_data, relationship.rel_type_data)
+        self._new_manifest_rows[ImportManifest.fingerprint(*row_values)] = row_values
+
+    @staticmethod
+    def _row_fingerprint(relationship):
+        """
+        :param relationship: The RelationshipRow read from the CSV file, or None
+        :return: the fingerprint of the row's values, see ImportManifest.fingerprint, or None if there is no row.
+        """
+        if relationship is None:
+            return None
+        return ImportManifest.fingerprint(relationship.source_data, relationship.target_data,
+                                          relationship.rel_type_data)
+
+    def _open_dead_letter(self, csv_file, column_names, column_positions=None, row_length=None):
+        """
+        Create the dead-letter writer for a CSV file, the dead-letter file is named after the CSV file.
+        :param csv_file: The path of the CSV file being imported
+        :param column_names: The names of the columns the relationship data is read from
+        :param column_positions: For CSV files without a header row, the position of each of these columns
+        :param row_length: For CSV files without a header row, the number of columns in the file
+        :return: None
+        """
+        self.close_dead_letter()
+        file_stem = os.path.splitext(os.path.basename(csv_file))[0]
+        self.dead_letter = DeadLetterWriter(os.path.join(self.dead_letter_directory,
+                                                         '{}_{}_dead_letter.csv'.format(file_stem, self._run_stamp)),
+                                            column_names,
+                                            column_positions,
+                                            row_length)
+
+    def close_dead_letter(self):
+        """
+        Close the dead-letter file of the current CSV file, so every row written to it is on disk.  Safe to call when
+        there is no dead-letter file, or more than once.
+        :return: None
+        """
+        if self.dead_letter is not None:
+            self.dead_letter.close()
+
+    def _write_dead_letter(self, relationship, reason):
+        """
+        Write a row that could not be imported to the dead-letter file, if there is one.
+        :param relationship: The RelationshipRow read from the CSV file
+        :param reason: Why the row could not be imported
+        :return: None
+        """
+        if self.dead_letter is None or relationship is None:
+            return
+        row_values = self._key_columns(self.source_match_key, relationship.source_data) + \
+            self._key_columns(self.target_match_key, relationship.target_data)
+        if len(self.dead_letter.column_names) > len(row_values):
+            row_values.append(relationship.rel_type_data)
+        self.dead_letter.write(row_values, reason)
+
+    @staticmethod
+    def _key_value(match_key, row_data, column_indexes):
+        """
+        :return: the source or target value of a row, joined from each of the match key's columns if it has one.
+        """
+        if match_key is None:
+            return row_data[column_indexes[0]]
+        return match_key.row_value([row_data[column_index] for column_index in column_indexes])
 
     @staticmethod
-    def _validate_header_values(csv_dict_reader,
+    def _key_columns(match_key, row_value):
+        """
+        :return: the values of the CSV columns a source or target value was read from, as a list.
+        """
+        if match_key is None or row_value is None:
+            return [row_value]
+        return match_key.split_row_value(row_value)
+
+    @staticmethod
+    def _run_stage(rows, output_queue, stage_errors, stop_event):
+        """
+        Run one stage of the streaming pipeline, putting each row it produces on the output queue.  The end of the
+        stage is marked by putting a None on the queue.  If the stage fails it sets the stop event, and it gives up as
+        soon as the stop event is set by another stage.
+        :param rows: An iterable that produces the output of this stage
+        :param output_queue: The bounded queue feeding the next stage
+        :param stage_errors: A list to record any error that stops the stage
+        :param stop_event: The event that stops every stage of the stream
+        :return: None
+        """
+        try:
+            for row in rows:
+                if not CSVRelationshipImporter._put_until_stopped(output_queue, row, stop_event):
+                    return
+        except Exception as e:
+            CSVRelationshipImporter.logger.critical('Import stream stopped by error: {}'.format(e))
+            stage_errors.append(e)
+            stop_event.set()
+        finally:
+            CSVRelationshipImporter._put_until_stopped(output_queue, None, stop_event)
+
+    @staticmethod
+    def _put_until_stopped(output_queue, row, stop_event):
+        """
+        Put a row on a bounded queue, waiting for room unless the stream is stopped.
+        :return: True if the row was put on the queue, False if the stream was stopped first.
+        """
+        while not stop_event.is_set():
+            try:
+                output_queue.put(row, timeout=CSVRelationshipImporter.stage_poll_seconds)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _iter_queue(input_queue, stop_event):
+        """
+        Iterate over the rows put on a queue by a pipeline stage until the stage marks its end, or the stream is
+        stopped.
+        :param input_queue: The queue to read from
+        :param stop_event: The event that stops every stage of the stream
+        :return: A generator that yields each row from the queue.
+        """
+        while not stop_event.is_set():
+            try:
+                row = input_queue.get(timeout=CSVRelationshipImporter.stage_poll_seconds)
+            except queue.Empty:
+                continue
+            if row is None:
+                return
+            yield row
+
+    @staticmethod
+    def _validate_header_values(fieldnames,
                                 source_item_coloumn,
                                 target_item_coloumn,
                                 relationship_type_coloumn):
         """
         This helper method checks to ensure that the fields passed are in the CSV file fieldnames list.
-        :param csv_dict_reader: A instanciated CSV dictreader object
+        :param fieldnames: The list of column names in the CSV file
         :param source_item_coloumn: A string that contains the Source Column header name
         :param target_item_coloumn: A string that contains the Target Column header name
         :param relationship_type_coloumn: A string that contains the Relationship type info Column header name
@@ -223,8 +1113,8 @@ class CSVRelationshipImporter:
         """
 
         # We need to ensure the expected columns are present.
-        source_data_present = source_item_coloumn is not None and source_item_coloumn in csv_dict_reader.fieldnames
-        target_data_present = target_item_coloumn is not None and target_item_coloumn in csv_dict_reader.fieldnames
+        source_data_present = source_item_coloumn is not None and source_item_coloumn in fieldnames
+        target_data_present = target_item_coloumn is not None and target_item_coloumn in fieldnames
         if not source_data_present or not target_data_present:
             missing_header_error_message = 'Please ensure CSV file settings are configured correctly with header ' \
                                            'names.  These are the supplied header values.  source_item_column: {}' \
@@ -235,7 +1125,7 @@ class CSVRelationshipImporter:
 
             # Now determine if we are using relationship type fields and verify the field exists.
         if relationship_type_coloumn is not None:
-            relationship_data_present = relationship_type_coloumn in csv_dict_reader.fieldnames
+            relationship_data_present = relationship_type_coloumn in fieldnames
             if not relationship_data_present:
                 missing_relationship_header_message = 'You have specified a relationship type header but no ' \
                                                       'matching column was found. The ' \
@@ -245,89 +1135,987 @@ class CSVRelationshipImporter:
                 CSVRelationshipImporter.logger.warning(missing_relationship_header_message)
 
     @staticmethod
-    def _get_item_id_by_custom_field(field_value, field_name, lookup_table, project_list):
+    def _intern(value):
+        """
+        Intern a value read from the CSV file, so repeated values share a single string.
+        :return: the interned string, or None if the value is missing.
+        """
+        if value is None:
+            return None
+        return sys.intern(value)
+
+    @staticmethod
+    def _lookup_value(match_key, row_value):
+        """
+        :return: the key to look a source or target value up by, normalized if the match key asks for it.
+        """
+        if match_key is None:
+            return row_value
+        return match_key.lookup_value(row_value)
+
+    def _get_item_id_by_custom_field(self, field_value, field_name, lookup_table, project_list, table_name=None):
         """
         This method will take in a string from a custom field, and return the ID of the matching jama item.
+        :param table_name: The name the lookup is counted under in the run metrics (ex: 'source_item_map').  The source
+        and target lookups may share one table, so the caller says which one this is.  None to not count the lookup.
         :return: the ID of the matching jama item.
+        :raise ValueError: If more than one item matches the field value.
         """
-        # If we already know the ID then use it
-        if field_value in lookup_table:
-            return lookup_table[field_value]
-        # Otherwise we must look it up.
+        # If we already know the ID then use it.  Read the table once, a bounded table may evict the value at any time.
+        item_id = lookup_table.get(field_value, _NOT_FOUND)
+        table_hit = item_id is not _NOT_FOUND
+        if table_name is not None:
+            self.metrics.record_lookup(table_name, table_hit)
+        if table_hit:
+            # A list of ID's means the prefetched index found this value on more than one item.
+            if isinstance(item_id, list):
+                field_value = RelationshipRow._display(field_value)
+                CSVRelationshipImporter.logger.error("Found multiple items matching the "
+                                                     "lookup value: <{}>.".format(field_value))
+                raise ValueError("Too many matching items for {}".format(field_value))
+            return item_id
+        # If the lookup table was prefetched it already holds every item, so there is nothing left to search for.
+        if self.lookup_index_prefetched:
+            return None
+
+        # Then check if a previous run already looked it up.
+        if self.lookup_cache is not None:
+            found, item_id = self._get_cached_item_id(field_value, field_name, lookup_table, project_list)
+            if found:
+                return item_id
+
+        # Otherwise we must look it up.  If another thread is already looking up this value, wait for its result.
+        lookup, leader = self._begin_lookup(lookup_table, field_value)
+        if lookup is None:
+            return self._get_item_id_by_custom_field(field_value, field_name, lookup_table, project_list, table_name)
+        if not leader:
+            return lookup.result()
+        try:
+            item_id = self._search_item_id(field_value, field_name, lookup_table, project_list)
+        except Exception as e:
+            self._end_lookup(lookup_table, field_value, lookup, error=e)
+            raise e
+        self._end_lookup(lookup_table, field_value, lookup, item_id=item_id)
+        return item_id
+
+    def _search_item_id(self, field_value, field_name, lookup_table, project_list):
+        """
+        Search Jama for the item with a custom field value and store the result in the lookup table.
+        :return: the ID of the matching jama item, or None if no item matches.
+        :raise ValueError: If more than one item matches the field value.
+        """
+        # Build the lucene query
+        lucene_query = '"{}: "{}""'.format(field_name, field_value)
+
+        # Make call to Jama API
+        try:
+            with self.metrics.phase('item_search'):
+                items = self._call_api_with_retries(self.j_client.get_abstract_items, contains=lucene_query,
+                                                    project=project_list)
+        # Deal with any API Bananas
+        except jama_api.APIException as e:
+            self.metrics.record_search(1)
+            CSVRelationshipImporter.logger.error("Error trying to lookup item with custom field <{}> containing "
+                                                 "<{}> API Error message: {}".format(field_name, field_value, e))
+            raise e
+
+        # Validate we have one and only one result.  Ambiguous values are stored so they are not searched for again.
+        if len(items) > 1:
+            lookup_table[field_value] = [item.get('id') for item in items]
+            self.metrics.record_search(1)
+            CSVRelationshipImporter.logger.error("Found multiple items matching the "
+                                                 "lookup value: <{}>.".format(field_value))
+            raise ValueError("Too many matching items for {}".format(field_value))
+
+        # Get the result, store it, return it.  Misses are stored as well so they are not searched for again.
+        item_id = items[0].get('id') if items else None
+        lookup_table[field_value] = item_id
+        if self.lookup_cache is not None:
+            self.lookup_cache.put_item_id(field_name, project_list, field_value, item_id)
+        self.metrics.record_search(1, 1 if self.lookup_cache is not None else 0)
+        return item_id
+
+    def _begin_lookup(self, lookup_table, field_value):
+        """
+        Claim the lookup of a value, so that threads needing the same value share one search (single flight).
+        :return: A tuple of (lookup, leader).  lookup is None if the value is already in the lookup table.  If leader
+        is True the caller must search for the value and pass the result to _end_lookup, otherwise the caller can wait
+        for the result of the search another thread is making with lookup.result().
+        """
+        with self._lookup_lock:
+            if field_value in lookup_table:
+                return None, False
+            key = (id(lookup_table), field_value)
+            lookup = self._in_flight_lookups.get(key)
+            if lookup is not None:
+                return lookup, False
+            lookup = Future()
+            self._in_flight_lookups[key] = lookup
+            return lookup, True
+
+    def _end_lookup(self, lookup_table, field_value, lookup, item_id=None, error=None):
+        """
+        Publish the result of a lookup claimed with _begin_lookup to any threads waiting on it.
+        :return: None
+        """
+        with self._lookup_lock:
+            self._in_flight_lookups.pop((id(lookup_table), field_value), None)
+        if error is not None:
+            lookup.set_exception(error)
         else:
-            # Build the lucene query
-            lucene_query = '"{}: "{}""'.format(field_name, field_value)
+            lookup.set_result(item_id)
+
+    def _get_cached_item_id(self, field_value, field_name, lookup_table, project_list):
+        """
+        Check the persistent lookup cache for an item ID and copy it into the lookup table if found.
+        :return: A tuple of (found, item_id), found is True if the cache held a valid entry for this value.
+        """
+        found, item_id = self.lookup_cache.get_item_id(field_name, project_list, field_value)
+        self.metrics.record_lookup('lookup_cache', found)
+        if found:
+            lookup_table[field_value] = item_id
+        return found, item_id
+
+    def _iter_with_batched_lookups(self,
+                                   relationships,
+                                   batch_size,
+                                   source_projects,
+                                   target_projects,
+                                   source_lookup_field_name,
+                                   target_lookup_field_name):
+        """
+        Pull relationships from an iterable a batch at a time, and look up all of the source and target values in a
+        batch before handing its relationships on.  Only one batch of relationships is held at a time.
+        :param relationships: An iterable of relationship data as read from the CSV file
+        :param batch_size: The number of relationships in each batch
+        :return: A generator that yields each relationship once its values have been looked up.
+        """
+        relationships = iter(relationships)
+        while True:
+            batch = list(itertools.islice(relationships, batch_size))
+            if not batch:
+                return
+            # Values that fail to look up are left for the preparation step to look up again and report.
+            try:
+                self._resolve_values_batched({relationship.source_data for relationship in batch},
+                                             source_lookup_field_name,
+                                             self.source_item_map,
+                                             source_projects,
+                                             batch_size)
+                self._resolve_values_batched({relationship.target_data for relationship in batch},
+                                             target_lookup_field_name,
+                                             self.target_item_map,
+                                             target_projects,
+                                             batch_size)
+            except Exception:
+                pass
+            yield from batch
+
+    def _iter_with_pipelined_lookups(self,
+                                     relationships,
+                                     lookup_workers,
+                                     chunk_size,
+                                     source_projects,
+                                     target_projects,
+                                     source_lookup_field_name,
+                                     target_lookup_field_name):
+        """
+        Look up the source and target values of relationships on a pool of worker threads.  Relationships are pulled
+        from the iterable in chunks, and each chunk is handed on as soon as its values have been looked up while later
+        chunks are still being looked up, so posting can overlap with the lookups.  Values shared by several chunks are
+        only searched for once.
+        :param relationships: An iterable of relationship data as read from the CSV file
+        :param lookup_workers: The number of chunks to look up at the same time
+        :param chunk_size: The number of relationships in each chunk, chunks larger than one use batched searches
+        :return: A generator that yields each relationship once its values have been looked up, not in file order.
+        """
+        relationships = iter(relationships)
+        with ThreadPoolExecutor(max_workers=lookup_workers) as executor:
+            in_flight = {}  # Stores future -> chunk of relationships
+            while True:
+                chunk = list(itertools.islice(relationships, chunk_size))
+                if not chunk:
+                    break
+                # Keep a bounded number of chunks in flight, handing on finished chunks as we go.
+                while len(in_flight) >= lookup_workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                        yield from in_flight.pop(future)
+                in_flight[executor.submit(self._resolve_chunk,
+                                          chunk,
+                                          chunk_size,
+                                          source_projects,
+                                          target_projects,
+                                          source_lookup_field_name,
+                                          target_lookup_field_name)] = chunk
+
+            # Hand on the remaining chunks as they finish.
+            for future in as_completed(in_flight):
+                future.result()
+                yield from in_flight[future]
+
+    def _resolve_chunk(self,
+                       chunk,
+                       batch_size,
+                       source_projects,
+                       target_projects,
+                       source_lookup_field_name,
+                       target_lookup_field_name):
+        """
+        Look up the source and target values of a chunk of relationships so they are in the lookup tables when the
+        relationships are prepared.  Values that fail to look up are left for the preparation step to report.
+        :return: None
+        """
+        if batch_size > 1:
+            try:
+                self._resolve_values_batched({relationship.source_data for relationship in chunk},
+                                             source_lookup_field_name,
+                                             self.source_item_map,
+                                             source_projects,
+                                             batch_size)
+                self._resolve_values_batched({relationship.target_data for relationship in chunk},
+                                             target_lookup_field_name,
+                                             self.target_item_map,
+                                             target_projects,
+                                             batch_size)
+            except Exception:
+                pass
+            return
+
+        # These lookups only warm the tables, they are counted in the run metrics when the relationships are prepared.
+        for relationship in chunk:
+            try:
+                self._get_item_id_by_custom_field(relationship.source_data, source_lookup_field_name,
+                                                  self.source_item_map, source_projects)
+                self._get_item_id_by_custom_field(relationship.target_data, target_lookup_field_name,
+                                                  self.target_item_map, target_projects)
+            except Exception:
+                pass
+
+    def _resolve_values_batched(self, field_values, field_name, lookup_table, project_list, batch_size):
+        """
+        Look up many custom field values with as few searches as possible.  Values that are not already in the lookup
+        table are combined into lucene OR queries of batch_size values each.  Each returned item is mapped back to its
+        value by reading the field from the item, so the lookup table ends up with the item ID of each value, None for
+        values no item matched and a list of item ID's for values matched by more than one item.
+        :param field_values: The values to look up
+        :param field_name: The name of the field to match on
+        :param lookup_table: The dictionary of field value -> item id to fill in
+        :param project_list: The projects to search
+        :param batch_size: The maximum number of values in a single search
+        :return: None
+        """
+        # Only search for the values we don't already know about, or that another thread is not already searching for.
+        pending_values = []
+        pending_lookups = {}
+        other_lookups = []
+        for field_value in field_values:
+            if field_value in lookup_table:
+                continue
+            if self.lookup_cache is not None and self._get_cached_item_id(field_value, field_name, lookup_table,
+                                                                          project_list)[0]:
+                continue
+            lookup, leader = self._begin_lookup(lookup_table, field_value)
+            if leader:
+                pending_values.append(field_value)
+                pending_lookups[field_value] = lookup
+            elif lookup is not None:
+                other_lookups.append(lookup)
+
+        try:
+            results = self._search_values_batched(pending_values, field_name, lookup_table, project_list, batch_size)
+        except Exception as e:
+            for field_value, lookup in pending_lookups.items():
+                self._end_lookup(lookup_table, field_value, lookup, error=e)
+            raise e
+        for field_value, lookup in pending_lookups.items():
+            item_id = results.get(field_value)
+            if isinstance(item_id, list):
+                self._end_lookup(lookup_table, field_value, lookup,
+                                 error=ValueError("Too many matching items for {}".format(field_value)))
+            else:
+                self._end_lookup(lookup_table, field_value, lookup, item_id=item_id)
+
+        # Wait for the values other threads are looking up, if their search failed the rows will be looked up again
+        # individually.
+        for lookup in other_lookups:
+            try:
+                lookup.result()
+            except Exception:
+                pass
+
+    def _search_values_batched(self, field_values, field_name, lookup_table, project_list, batch_size):
+        """
+        Search for custom field values batch_size values at a time, and store the result of each value in the lookup
+        table.  The parameters are the same as those of _resolve_values_batched.
+        :return: A dictionary of field value -> item id, None or a list of item ids, for every value searched for.
+        """
+        results = {}
+        for batch_start in range(0, len(field_values), batch_size):
+            batch = field_values[batch_start:batch_start + batch_size]
 
-            # Make call to Jama API
+            # Build one lucene query that matches any of the values.
+            lucene_query = ' OR '.join('"{}: "{}""'.format(field_name, field_value) for field_value in batch)
+
+            # Make call to Jama API, the client pages through the results for us.
             try:
-                items = client.get_abstract_items(contains=lucene_query, project=project_list)
-            # Deal with any API Bananas
-            except APIException as e:
-                CSVRelationshipImporter.logger.error("Error trying to lookup item with custom field <{}> containing "
-                                                     "<{}> API Error message: {}".format(field_name, field_value, e))
+                with self.metrics.phase('item_search'):
+                    items = self._call_api_with_retries(self.j_client.get_abstract_items, contains=lucene_query,
+                                                        project=project_list)
+            except jama_api.APIException as e:
+                self.metrics.record_search(len(batch))
+                CSVRelationshipImporter.logger.error("Error trying to lookup {} items with custom field <{}>. "
+                                                     "API Error message: {}".format(len(batch), field_name, e))
                 raise e
 
-            # Validate we have one and only one result.
-            if items is None or len(items) == 0:
-                return None
-            if len(items) > 1:
-                CSVRelationshipImporter.logger.error("Found multiple items matching the "
-                                                     "lookup value: <{}>.".format(field_value))
-                raise ValueError("Too many matching items for {}".format(field_value))
+            # Map each returned item back to the value it matched.
+            matches = {field_value: [] for field_value in batch}
+            unmapped_count = 0
+            for item in items:
+                item_field_value = CSVRelationshipImporter._get_field_value(item, field_name)
+                if item_field_value in matches:
+                    matches[item_field_value].append(item.get('id'))
+                else:
+                    unmapped_count += 1
 
-            # Get the result, store it, return it.
-            item_id = items[0].get('id')
-            lookup_table[field_value] = item_id
-            return item_id
+            # Store the result of each value, misses and ambiguous matches included.
+            missing_count = 0
+            ambiguous_count = 0
+            searched_again_count = 0
+            cached_count = 0
+            for field_value, item_ids in matches.items():
+                if not item_ids and unmapped_count:
+                    searched_again_count += 1
+                    # Jama matched items that are not equal to any value of the batch (ex: the search ignores case),
+                    # so this value may still match one of them.  Search for it on its own rather than store a miss.
+                    try:
+                        results[field_value] = self._search_item_id(field_value, field_name, lookup_table,
+                                                                    project_list)
+                    except ValueError:
+                        ambiguous_count += 1
+                        results[field_value] = lookup_table[field_value]
+                        continue
+                    if results[field_value] is None:
+                        missing_count += 1
+                    continue
+                if len(item_ids) > 1:
+                    ambiguous_count += 1
+                    lookup_table[field_value] = results[field_value] = item_ids
+                    continue
+                item_id = item_ids[0] if item_ids else None
+                if item_id is None:
+                    missing_count += 1
+                lookup_table[field_value] = results[field_value] = item_id
+                if self.lookup_cache is not None:
+                    self.lookup_cache.put_item_id(field_name, project_list, field_value, item_id)
+                    cached_count += 1
+            # Values searched for again on their own are counted by _search_item_id.
+            self.metrics.record_search(len(batch) - searched_again_count, cached_count)
 
-    def _build_relationship_map(self):
+            CSVRelationshipImporter.logger.info('Looked up {} values of field <{}>, {} not found, {} '
+                                                'ambiguous.'.format(len(batch), field_name, missing_count,
+                                                                    ambiguous_count))
+        return results
+
+    def _build_custom_field_index(self, field_name, project_list, lookup_table, match_key=None):
         """
-        Pull relationship Data from the API and build a dictionary to lookup relationship ID's by name.
+        Page through every item in the given projects once and fill the lookup table with field value -> item id.
+        Values found on more than one item are stored as a list of item ID's so they can be reported as ambiguous.
+        :param field_name: The name of the field to index items by
+        :param project_list: The projects to index, an empty list will index items in all projects
+        :param lookup_table: The dictionary to fill with field value -> item id entries
+        :param match_key: Optional match key to index items by instead of the field
         :return: None
         """
-        # Get the relationship types from the PAI
+        if match_key is not None:
+            field_name = repr(match_key)
+        CSVRelationshipImporter.logger.info('Prefetching items to index by field <{}> '
+                                            'in projects: {}'.format(field_name, project_list))
+
+        # Pull every item in the lookup projects, the client pages through the results for us.
         try:
-            relationship_types = self.j_client.get_relationship_types()
-        except APIException as e:
-            CSVRelationshipImporter.logger.error("Error while fetching relationship type information. "
-                                                 "Message from API: {}".format(e))
+            items = self._call_api_with_retries(self.j_client.get_abstract_items,
+                                                project=project_list if project_list else None)
+        except jama_api.APIException as e:
+            CSVRelationshipImporter.logger.error("Error while prefetching items for field <{}>. "
+                                                 "Message from API: {}".format(field_name, e))
             raise e
 
+        # Index each item by the value of the lookup field.
+        duplicate_values = set()
+        for item in items:
+            if match_key is not None:
+                field_value = match_key.item_value(item)
+            else:
+                field_value = CSVRelationshipImporter._get_field_value(item, field_name)
+            if field_value is None:
+                continue
+            item_id = item.get('id')
+            if field_value not in lookup_table:
+                lookup_table[field_value] = item_id
+            elif isinstance(lookup_table[field_value], list):
+                lookup_table[field_value].append(item_id)
+            else:
+                lookup_table[field_value] = [lookup_table[field_value], item_id]
+                duplicate_values.add(field_value)
+
+        # Flag the duplicates up front, any row using one of these values will be skipped.
+        for field_value in duplicate_values:
+            CSVRelationshipImporter.logger.warning('Field <{}> value <{}> is shared by multiple items: '
+                                                   '{}'.format(field_name, RelationshipRow._display(field_value),
+                                                               lookup_table[field_value]))
+        CSVRelationshipImporter.logger.info('Indexed {} items by field <{}>, {} values are '
+                                            'ambiguous.'.format(len(items), field_name, len(duplicate_values)))
+
+    def _build_existing_relationship_index(self, source_projects, target_projects):
+        """
+        Download the relationships in the source and target projects and store the (fromItem, toItem,
+        relationshipType) key of each one so that existing relationships can be skipped.
+        :param source_projects: The source project list
+        :param target_projects: The target project list
+        :return: None
+        """
+        projects = set(source_projects) | set(target_projects)
+        if not projects:
+            CSVRelationshipImporter.logger.warning('Existing relationships can only be skipped when the source or '
+                                                   'target project list is set.  All rows will be posted.')
+            return
+
+        self.existing_relationships = set()
+        for project_id in sorted(projects):
+            CSVRelationshipImporter.logger.info('Downloading existing relationships in project {}'.format(project_id))
+            try:
+                relationships = self._call_api(self.j_client.get_relationships, project_id)
+            except jama_api.APIException as e:
+                CSVRelationshipImporter.logger.error("Error while fetching relationships in project {}. "
+                                                     "Message from API: {}".format(project_id, e))
+                raise e
+            for relationship in relationships:
+                self.existing_relationships.add(CSVRelationshipImporter._relationship_key(relationship.get('fromItem'),
+                                                                                          relationship.get('toItem'),
+                                                                                          relationship.get(
+                                                                                              'relationshipType')))
+
+        CSVRelationshipImporter.logger.info('Found {} existing relationships.'.format(len(self.existing_relationships)))
+
+    @staticmethod
+    def _relationship_key(from_item, to_item, relationship_type):
+        """
+        Build a key that identifies a relationship by its end points and type.  ID's read from a CSV file are strings,
+        so each part is converted to an integer where possible to match the ID's returned by the API.
+        :param from_item: The ID of the source item
+        :param to_item: The ID of the target item
+        :param relationship_type: The ID of the relationship type
+        :return: A tuple of (fromItem, toItem, relationshipType)
+        """
+        key = []
+        for part in (from_item, to_item, relationship_type):
+            try:
+                key.append(int(part))
+            except (TypeError, ValueError):
+                key.append(part)
+        return tuple(key)
+
+    @staticmethod
+    def _get_field_value(item, field_name):
+        """
+        Get the value of a field from an item payload, see match_keys.get_field_value.
+        :param item: An item object as returned by the API
+        :param field_name: The name of the field to read
+        :return: the field value as a string, or None if the item does not have this field.
+        """
+        return get_field_value(item, field_name)
+
+    def _call_api(self, function, *args, idempotent: bool = True, **kwargs):
+        """
+        Make a call to the Jama API, going through the rate controller if we have one.  Each call is counted and timed
+        in the run metrics.
+        :param function: The client function to call
+        :param idempotent: Set to False for calls that must not be repeated once the server may have received them
+        :return: whatever the client function returns.
+        """
+        function = self.metrics.timed_api_call(function)
+        try:
+            if self.rate_controller is None:
+                return function(*args, **kwargs)
+            return self.rate_controller.call(function, *args, idempotent=idempotent, **kwargs)
+        except jama_api.UnauthorizedException as e:
+            # The credentials were not checked at startup if they were accepted recently, make sure the next run does.
+            if self.metadata_cache is not None:
+                self.metadata_cache.forget_credentials()
+            raise e
+
+    def _call_api_with_retries(self, function, *args, **kwargs):
+        """
+        Make a call to the Jama API that is safe to repeat, such as a search.  Calls that fail with an error that may be
+        temporary (a server error, throttling or no response) are made again after an exponential backoff with jitter,
+        up to post_max_retries times, the same as posts.
+        :param function: The client function to call
+        :return: whatever the client function returns.
+        :raise APIException: If the call still fails after its retries, or fails with an error that is not temporary.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._call_api(function, *args, **kwargs)
+            except jama_api.APIException as e:
+                error = e
+            except jama_api.requests.exceptions.RequestException as e:
+                error = CSVRelationshipImporter._api_exception(e)
+            if attempt >= self.post_max_retries or not is_retryable(error):
+                raise error
+            attempt += 1
+            delay = backoff_delay(attempt, self.post_retry_backoff_seconds, self.post_retry_max_backoff_seconds)
+            CSVRelationshipImporter.logger.warning('Call to {} failed, retry {} of {} in {:.1f}s. '
+                                                   'Error: {}'.format(getattr(function, '__name__', function), attempt,
+                                                                      self.post_max_retries, delay, error))
+            time.sleep(delay)
+
+    @staticmethod
+    def _api_exception(error):
+        """
+        Wrap a timeout or connection error raised by requests in an APIException, so it is handled like any other failed
+        call.  The original error is kept as the cause.
+        :param error: The requests exception
+        :return: An APIException without a status code.
+        """
+        api_exception = jama_api.APIException(str(error))
+        api_exception.__cause__ = error
+        return api_exception
+
+    def _new_lookup_table(self):
+        """
+        :return: An empty item lookup table, bounded if lookup_table_max_size is set.
+        """
+        if self.lookup_table_max_size > 0:
+            return LRULookupTable(self.lookup_table_max_size)
+        return {}
+
+    def _build_relationship_map(self):
+        """
+        Pull relationship Data from the API and build a dictionary to lookup relationship ID's by name.
+        :return: None
+        """
+        # Use the relationship types from a previous run if we have them.
+        relationship_types = None
+        if self.metadata_cache is not None:
+            relationship_types = self.metadata_cache.get_relationship_types()
+        if relationship_types is None and self.lookup_cache is not None:
+            relationship_types = self.lookup_cache.get_relationship_types()
+
+        # Otherwise get the relationship types from the PAI
+        if relationship_types is None:
+            try:
+                with self.metrics.phase('relationship_type_fetch'):
+                    relationship_types = self._call_api(self.j_client.get_relationship_types)
+            except jama_api.APIException as e:
+                CSVRelationshipImporter.logger.error("Error while fetching relationship type information. "
+                                                     "Message from API: {}".format(e))
+                raise e
+            if self.lookup_cache is not None:
+                self.lookup_cache.put_relationship_types(relationship_types)
+            if self.metadata_cache is not None:
+                self.metadata_cache.put_relationship_types(relationship_types)
+
         # Add each type to the lookup table
         for relationship_type in relationship_types:
             self.relationship_map[relationship_type.get('name')] = relationship_type.get('id')
 
 
-def do_import(filename):
+def do_import(filename, shared_importer):
     """
     Run one iteration of the CSVRealationshipImporter
     :param filename:  the file to import
-    :return: None
+    :param shared_importer: An importer holding the client, caches and lookup maps shared by every file
+    :return: A dictionary summarizing the import of this file.
     """
     # Instantiate a new relationship importer
-    rel_creator = CSVRelationshipImporter(client)
+    rel_creator = shared_importer.spawn()
+
+    # Close the dead-letter file even if the import stops early, so the rows written to it so far are not lost.
+    try:
+        # Stream the rows straight through to posting if requested.
+        if config.streaming_pipeline:
+            rel_creator.stream_relationships(filename,
+                                             config.csv_has_headers,
+                                             config.csv_headers,
+                                             config.csv_source_column,
+                                             config.csv_target_column,
+                                             config.csv_relationship_type_column,
+                                             config.match_on_custom_field,
+                                             config.source_project_list,
+                                             config.target_project_list,
+                                             config.source_item_custom_field_name,
+                                             config.target_item_custom_field_name,
+                                             config.default_relationship_type,
+                                             config.prefetch_lookup_index,
+                                             config.skip_existing_relationships,
+                                             config.lookup_batch_size,
+                                             config.lookup_workers,
+                                             config.max_concurrent_posts,
+                                             config.streaming_queue_size)
+            rel_creator.save_manifest()
+            return rel_creator.get_summary()
+
+        # Load CSV from file into memory
+        rel_creator.load_csv_data(filename,
+                                  config.csv_has_headers,
+                                  config.csv_headers,
+                                  config.csv_source_column,
+                                  config.csv_target_column,
+                                  config.csv_relationship_type_column)
+
+        # Process the relationship data
+        rel_creator.process_relationships(config.match_on_custom_field,
+                                          config.source_project_list,
+                                          config.target_project_list,
+                                          config.source_item_custom_field_name,
+                                          config.target_item_custom_field_name,
+                                          config.default_relationship_type,
+                                          config.prefetch_lookup_index,
+                                          config.skip_existing_relationships,
+                                          config.lookup_batch_size,
+                                          config.lookup_workers)
 
-    # Load CSV from file into memory
+        # Post the relationships
+        rel_creator.post_relationships(config.max_concurrent_posts)
+
+        # Remember what was imported so the next run only imports the rows that changed.
+        rel_creator.save_manifest()
+        return rel_creator.get_summary()
+    finally:
+        rel_creator.close_dead_letter()
+
+def plan_import(filename, shared_importer):
+    """
+    Load and process a CSV file the same way do_import would, without posting anything.
+    :param filename:  the file to plan
+    :param shared_importer: An importer holding the client, caches and lookup maps shared by every file
+    :return: A dictionary describing what importing this file would do.
+    """
+    rel_creator = shared_importer.spawn()
     rel_creator.load_csv_data(filename,
                               config.csv_has_headers,
                               config.csv_headers,
                               config.csv_source_column,
                               config.csv_target_column,
                               config.csv_relationship_type_column)
-
-    # Process the relationship data
     rel_creator.process_relationships(config.match_on_custom_field,
                                       config.source_project_list,
                                       config.target_project_list,
                                       config.source_item_custom_field_name,
                                       config.target_item_custom_field_name,
-                                      config.default_relationship_type)
+                                      config.default_relationship_type,
+                                      config.prefetch_lookup_index,
+                                      config.skip_existing_relationships,
+                                      config.lookup_batch_size,
+                                      config.lookup_workers)
+    file_plan = rel_creator.get_plan()
+    logging.info('Plan for {}: {} rows read, {} distinct source and {} distinct target values, {} duplicates, {} '
+                 'already posted or unchanged, {} already existed, {} unresolved, {} ambiguous, {} relationships to '
+                 'post.'.format(file_plan['csv_file'],
+                                file_plan['rows_read'],
+                                file_plan['distinct_source_values'],
+                                file_plan['distinct_target_values'],
+                                file_plan['duplicates'],
+                                file_plan['skipped_journaled'] + file_plan['skipped_unchanged'],
+                                file_plan['skipped_existing'],
+                                file_plan['unresolved'],
+                                file_plan['ambiguous'],
+                                file_plan['projected_posts']))
+    return file_plan
+
+
+def estimate_run(file_plans, shared_importer):
+    """
+    Estimate the API calls and runtime of an import from the plans of its files.  Nothing is posted while planning, so
+    each post is assumed to take plan_post_latency_seconds, or if that is not set, as long as a call to the
+    relationship types endpoint.  Posts are assumed to run max_concurrent_posts at a time.  Lookups are assumed to take
+    as long as they did while planning, less the searches whose result the lookup cache now holds.
+    :param file_plans: A list of dictionaries as returned by plan_import
+    :param shared_importer: The importer the plans were made with
+    :return: A dictionary with the totals of the plans and the estimate.
+    """
+    metrics = shared_importer.metrics
+    estimate = aggregate_summaries(file_plans)
+    # Nothing was posted, drop the counts that only mean something after a real import.
+    for key in ('posted', 'failed', 'removed', 'retried', 'dead_lettered', 'failed_files'):
+        estimate.pop(key)
+    estimate['files'] = file_plans
+
+    # Use the configured post latency, or time a few calls to the cheapest endpoint that changes nothing.  The paged
+    # searches made while planning are no measure of a post, they return many items each.
+    post_latency = config.plan_post_latency_seconds
+    post_latency_source = 'plan_post_latency_seconds'
+    if post_latency is None:
+        for _ in range(3):
+            shared_importer._call_api(shared_importer.j_client.get_relationship_types)
+        post_latency = metrics.mean_latency('get_relationship_types')
+        post_latency_source = 'get_relationship_types'
+    report = metrics.report()
+
+    # Posts run max_concurrent_posts at a time, unless the rate controller allows fewer calls in flight.
+    concurrency = max(1, config.max_concurrent_posts)
+    if shared_importer.rate_controller is not None:
+        concurrency = min(concurrency, shared_importer.rate_controller.max_concurrency)
+
+    # Lookups will be made again by the real run, except the searches whose result is now in the lookup cache.  The
+    # prefetched index, existing relationships and ambiguous values are fetched again.  Searches made on several
+    # lookup_workers at once overlap, so only their share of the lookup phase is taken off.
+    lookup_seconds = report['phase_seconds'].get('lookup', 0.0)
+    searched_values, cached_search_results = metrics.search_counts()
+    if cached_search_results:
+        search_seconds = report['phase_seconds'].get('item_search', 0.0) / max(1, config.lookup_workers)
+        lookup_seconds -= min(search_seconds, lookup_seconds) * cached_search_results / searched_values
+    post_seconds = estimate['projected_posts'] * post_latency / concurrency
+    estimate.update({
+        'lookup_api_calls': metrics.api_call_count('get_abstract_items'),
+        'lookups': report['lookups'],
+        'searched_values': searched_values,
+        'cached_search_results': cached_search_results,
+        'post_latency_seconds': round(post_latency, 6),
+        'post_latency_source': post_latency_source,
+        'post_concurrency': concurrency,
+        'estimated_lookup_seconds': round(lookup_seconds, 2),
+        'estimated_post_seconds': round(post_seconds, 2),
+        'estimated_total_seconds': round(lookup_seconds + post_seconds, 2),
+    })
+    return estimate
+
+
+def import_directory(directory, shared_importer, max_workers):
+    """
+    Import every CSV file in a directory, several files at a time.  All files share one client, relationship type map
+    and set of lookup caches through the shared importer.
+    :param directory: The directory containing the CSV files
+    :param shared_importer: An importer holding the client, caches and lookup maps shared by every file
+    :param max_workers: The maximum number of files to import at the same time
+    :return: A list of dictionaries summarizing the import of each file.
+    """
+    csv_files = sorted(os.path.join(directory, file) for file in os.listdir(directory) if file.lower().endswith('.csv'))
+    logging.info('Importing {} csv files from {}, {} at a time.'.format(len(csv_files), directory, max_workers))
+    return import_files(csv_files, shared_importer, max_workers)
+
+
+def import_files(csv_files, shared_importer, max_workers):
+    """
+    Import a list of CSV files, several files at a time.
+    :param csv_files: The paths of the CSV files to import
+    :param shared_importer: An importer holding the client, caches and lookup maps shared by every file
+    :param max_workers: The maximum number of files to import at the same time
+    :return: A list of dictionaries summarizing the import of each file.
+    """
+    summaries = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(do_import, csv_file, shared_importer): csv_file for csv_file in csv_files}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                logging.error('Import of {} stopped by error: {}'.format(futures[future], e))
+                summary = {'csv_file': futures[future], 'error': str(e)}
+            summaries.append(summary)
+            log_summary(summary)
+    return summaries
+
+
+def prepare_shared_lookups(shared_importer):
+    """
+    Build the lookup tables of the shared importer from the config, before it is spawned for each file.
+    :param shared_importer: An importer holding the client, caches and lookup maps shared by every file
+    :return: None
+    """
+    with shared_importer.metrics.phase('lookup'):
+        shared_importer.prepare_lookups(config.match_on_custom_field,
+                                        config.source_project_list,
+                                        config.target_project_list,
+                                        config.source_item_custom_field_name,
+                                        config.target_item_custom_field_name,
+                                        config.prefetch_lookup_index,
+                                        config.skip_existing_relationships)
+
+
+def watch_location(csv_location, shared_importer, stop_event):
+    """
+    Import CSV files as they are dropped into a directory (or each time a single CSV file changes) until the stop
+    event is set.  Every file is imported with the same warm client, relationship type map and lookup tables, so a new
+    file starts importing right away.  The lookup tables are rebuilt every watch_lookup_refresh_seconds, so items
+    created in Jama since the tables were built are found.
+    :param csv_location: The directory or file to watch
+    :param shared_importer: An importer holding the client, caches and lookup maps shared by every file
+    :param stop_event: A threading.Event that is set to stop watching
+    :return: A list of dictionaries summarizing the import of each file.
+    """
+    watcher = DirectoryWatcher(csv_location, config.watch_stable_seconds, config.watch_import_existing_files)
+    logging.info('Watching {} for new csv files, stop with Ctrl+C.'.format(csv_location))
+    lookups_built_at = time.monotonic()
+    summaries = []
+    while not stop_event.is_set():
+        ready_files = watcher.poll()
+        if ready_files:
+            # Rebuild lookups that may have gone stale before importing more files.
+            if config.watch_lookup_refresh_seconds and \
+                    time.monotonic() - lookups_built_at >= config.watch_lookup_refresh_seconds:
+                shared_importer.reset_lookups()
+                prepare_shared_lookups(shared_importer)
+                lookups_built_at = time.monotonic()
+
+            summaries.extend(import_files(ready_files, shared_importer, config.max_concurrent_files))
+
+            # Files found later are checked for duplicates on their own, so a file that is rewritten is imported again.
+            if shared_importer.duplicate_filter is not None:
+                shared_importer.duplicate_filter.clear()
+
+            # Make sure what we posted and looked up is on disk between files.
+            if shared_importer.journal is not None:
+                shared_importer.journal.flush()
+            if shared_importer.lookup_cache is not None:
+                shared_importer.lookup_cache.flush()
+        stop_event.wait(config.watch_poll_interval_seconds)
+    logging.info('Stopped watching {}.'.format(csv_location))
+    return summaries
+
+
+def shard_report_file(shard_index, shard_count):
+    """
+    :return: The path of the run report written by a shard worker, where the coordinator looks for it.
+    """
+    return os.path.join(config.log_directory, '{}_shard_{}_of_{}_report.json'.format(config.log_file_name_prefix,
+                                                                                   shard_index, shard_count))
+
+
+def use_shard_config(shard_index, shard_count):
+    """
+    Point the files a shard worker writes (log, journal, lookup cache, manifests and dead-letter files) at files of its
+    own, so workers never write to the same file.
+    :param shard_index: The index of the shard this worker imports
+    :param shard_count: The number of shards
+    :return: None
+    """
+    for setting in ('journal_file', 'lookup_cache_file', 'manifest_directory', 'dead_letter_directory',
+                    'deduplicate_store_file'):
+        if getattr(config, setting):
+            setattr(config, setting, sharding.shard_path(getattr(config, setting), shard_index, shard_count))
+    config.log_file_name_prefix = '{}_shard_{}_of_{}'.format(config.log_file_name_prefix, shard_index, shard_count)
+    # The coordinator reports on the whole import.
+    config.prometheus_textfile = None
+
+
+def coordinate_shards(shard_count, run_workers, worker_args, current_date_time):
+    """
+    Run a sharded import: start one worker process per shard on this machine (or let workers on other machines that
+    share the log directory finish), then merge the shard run reports into one report and the shard journals into
+    journal_file.
+    :param shard_count: The number of shards
+    :param run_workers: When True, start the workers on this machine and wait for them.  When False, only merge.
+    :param worker_args: Extra command line arguments to pass to every worker
+    :param current_date_time: The formatted start time of the run, used to name the merged report
+    :return: 0 if every shard finished, 1 otherwise.
+    """
+    report_files = [shard_report_file(shard_index, shard_count) for shard_index in range(shard_count)]
+    exit_codes = []
+    if run_workers:
+        # Clear out the reports of an earlier run so they are not merged by mistake.
+        for report_file in report_files:
+            if os.path.exists(report_file):
+                os.remove(report_file)
+        exit_codes = sharding.run_shards(os.path.abspath(__file__), shard_count, worker_args)
+
+    merged_report = sharding.merge_shard_reports(report_files)
+    merged_report['shard_count'] = shard_count
+    merged_report_file = '{}/{}_{}_report.json'.format(config.log_directory, config.log_file_name_prefix,
+                                                       str(current_date_time))
+    with open(merged_report_file, 'w') as open_report_file:
+        json.dump(merged_report, open_report_file, indent=2)
+    logging.info('Merged report of {} shards written to {}'.format(shard_count, merged_report_file))
 
-    # Post the relationships
-    rel_creator.post_relationships()
+    if config.journal_file:
+        sharding.merge_shard_journals([sharding.shard_path(config.journal_file, shard_index, shard_count)
+                                       for shard_index in range(shard_count)], config.journal_file)
+    log_summary(aggregate_summaries(merged_report['files']))
+
+    if any(exit_codes) or merged_report.get('missing_shard_reports'):
+        return 1
+    return 0
+
+
+def log_summary(summary):
+    """
+    Log the summary of an import.
+    :param summary: A dictionary of counts as returned by do_import
+    :return: None
+    """
+    if 'error' in summary:
+        logging.info('Summary for {}: FAILED ({})'.format(summary['csv_file'], summary['error']))
+        return
+    logging.info('Summary for {}: {} rows read, {} posted, {} failed, {} already existed, {} already posted by a '
+                 'previous run, {} unchanged since the last import, {} duplicates, {} unresolved, {} written to the '
+                 'dead-letter file.'.format(summary['csv_file'],
+                                            summary['rows_read'],
+                                            summary['posted'],
+                                            summary['failed'],
+                                            summary['skipped_existing'],
+                                            summary['skipped_journaled'],
+                                            summary['skipped_unchanged'],
+                                            summary['duplicates'],
+                                            summary['unresolved'],
+                                            summary['dead_lettered']))
+    if summary['removed']:
+        logging.info('{} rows imported by a previous run are no longer in {}.'.format(summary['removed'],
+                                                                                      summary['csv_file']))
+
+
+def aggregate_summaries(summaries):
+    """
+    Add up the counts of several import summaries.
+    :param summaries: A list of dictionaries as returned by do_import
+    :return: A dictionary with the total of each count.
+    """
+    totals = {'csv_file': '{} files'.format(len(summaries))}
+    for summary in summaries:
+        for key, value in summary.items():
+            if isinstance(value, int):
+                totals[key] = totals.get(key, 0) + value
+    failed_files = [summary['csv_file'] for summary in summaries if 'error' in summary]
+    for key in ('rows_read', 'posted', 'failed', 'skipped_existing', 'skipped_journaled', 'skipped_unchanged',
+                'duplicates', 'removed', 'unresolved', 'retried', 'dead_lettered'):
+        totals.setdefault(key, 0)
+    totals['failed_files'] = len(failed_files)
+    return totals
 
 
 if __name__ == '__main__':
+    # PARSE COMMAND LINE ARGUMENTS
+    arg_parser = argparse.ArgumentParser(description='Import relationship data from CSV files to Jama Connect.')
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='Skip the rows recorded in the import journal by the previous run.')
+    arg_parser.add_argument('--plan', action='store_true',
+                            help='Load and resolve every row without posting, and report the expected API calls, '
+                                 'problem rows and runtime of the import.')
+    arg_parser.add_argument('--watch', action='store_true',
+                            help='Keep running and import csv files as they are added to csv_location.')
+    arg_parser.add_argument('--shards', type=int, default=1,
+                            help='Split the import into this many shards, each imported by its own worker process, '
+                                 'and merge their reports and journals when they finish.')
+    arg_parser.add_argument('--shard-count', type=int, default=1,
+                            help='Run as a worker that imports one shard of an import split into this many shards.')
+    arg_parser.add_argument('--shard-index', type=int, default=0,
+                            help='The shard to import when running as a worker, from 0 to shard-count - 1.')
+    arg_parser.add_argument('--merge-shards', type=int, default=0,
+                            help='Only merge the reports and journals of this many shards run by workers elsewhere.')
+    args = arg_parser.parse_args()
+    if args.shard_count > 1 and not 0 <= args.shard_index < args.shard_count:
+        arg_parser.error('--shard-index must be between 0 and {}'.format(args.shard_count - 1))
+    if args.plan and (args.shards > 1 or args.merge_shards > 1 or args.watch):
+        arg_parser.error('--plan can not be combined with --shards, --merge-shards or --watch')
+
+    # A shard worker writes its own files, and its report where the coordinator will look for it.
+    report_file = None
+    if args.shard_count > 1:
+        report_file = shard_report_file(args.shard_index, args.shard_count)
+        use_shard_config(args.shard_index, args.shard_count)
+
     # INIT LOGGING
     try:
         os.mkdir('logs')
@@ -341,25 +2129,179 @@ if __name__ == '__main__':
     # Keep track of execution time.
     start_time = time.perf_counter()
 
+    # The coordinator of a sharded import leaves the importing to the workers.
+    if args.shards > 1 or args.merge_shards > 1:
+        worker_args = [flag for flag, used in (('--resume', args.resume), ('--watch', args.watch)) if used]
+        sys.exit(coordinate_shards(max(args.shards, args.merge_shards), args.shards > 1, worker_args,
+                                   current_date_time))
+
+    # Credentials and relationship types checked by a run a moment ago are not fetched from Jama again.
+    metadata_cache = None
+    if config.metadata_cache_file:
+        metadata_cache = InstanceMetadataCache(config.metadata_cache_file, config.metadata_cache_ttl_seconds)
+
     # Get a Jama Client.
-    client = utils.init_jama_client()
+    client = utils.init_jama_client(metadata_cache)
 
-    # Keep track of the number of files processed.
-    file_count = 0
+    # One rate controller is shared by every API call the importer makes.
+    rate_controller = None
+    if config.rate_control_enabled:
+        rate_controller = AdaptiveRateController(config.rate_control_initial_concurrency,
+                                                 config.rate_control_min_concurrency,
+                                                 config.rate_control_max_concurrency,
+                                                 config.rate_control_decrease_factor,
+                                                 config.rate_control_max_retries,
+                                                 config.rate_control_backoff_seconds,
+                                                 config.rate_control_log_interval_seconds)
+
+    # Open the persistent lookup cache if one is configured.
+    lookup_cache = None
+    if config.lookup_cache_file:
+        lookup_cache = LookupCache(config.lookup_cache_file,
+                                   utils.validate_base_url(config.base_url),
+                                   config.lookup_cache_ttl_seconds)
+        if config.invalidate_lookup_cache:
+            lookup_cache.invalidate()
+
+    # Open the import journal if one is configured.  A plan only reads it, a new journal would wipe the last run's.
+    journal = None
+    if config.journal_file and (args.resume or not args.plan):
+        journal = ImportJournal(config.journal_file, config.journal_fsync_batch_size, args.resume)
+    elif args.resume:
+        logging.warning('--resume requires journal_file to be set in config.py.  All rows will be imported.')
+
+    # Open the manifest of previously imported rows if incremental imports are configured.
+    manifest = None
+    if config.manifest_directory:
+        manifest = ImportManifest(config.manifest_directory, config.manifest_report_removed)
+
+    # Duplicate rows are dropped across every file imported during the run.
+    duplicate_filter = None
+    if config.deduplicate_rows:
+        duplicate_filter = DuplicateFilter(config.deduplicate_store_file)
+
+    # Items can be matched on several fields at once, or on values that ignore case and spacing.
+    source_match_key = None
+    target_match_key = None
+    if config.match_on_custom_field and (config.source_match_key or config.normalize_match_keys):
+        source_match_key = MatchKey(config.source_match_key or [(config.csv_source_column,
+                                                                 config.source_item_custom_field_name)],
+                                    config.normalize_match_keys)
+    if config.match_on_custom_field and (config.target_match_key or config.normalize_match_keys):
+        target_match_key = MatchKey(config.target_match_key or [(config.csv_target_column,
+                                                                 config.target_item_custom_field_name)],
+                                    config.normalize_match_keys)
+
+    # Timings and counts for the run report.
+    run_metrics = RunMetrics()
+
+    # One importer holds the warm state shared by every file: the relationship type map and the lookup tables.
+    # Credentials that were accepted recently are not checked at startup.  If Jama rejects them once the importer starts
+    # using them, they are checked again and asked for like at startup.
+    shared_rel_creator = None
+    credentials_rechecked = False
+    while shared_rel_creator is None:
+        try:
+            shared_rel_creator = CSVRelationshipImporter(client,
+                                                         rate_controller,
+                                                         lookup_cache,
+                                                         journal,
+                                                         args.resume,
+                                                         run_metrics,
+                                                         config.post_max_retries,
+                                                         config.post_retry_backoff_seconds,
+                                                         config.post_retry_max_backoff_seconds,
+                                                         # A plan posts nothing, so there are no rows to retry later.
+                                                         None if args.plan else config.dead_letter_directory,
+                                                         manifest,
+                                                         config.lookup_table_max_size,
+                                                         args.shard_count,
+                                                         args.shard_index,
+                                                         duplicate_filter,
+                                                         source_match_key,
+                                                         target_match_key,
+                                                         metadata_cache)
+            prepare_shared_lookups(shared_rel_creator)
+        except jama_api.UnauthorizedException:
+            if metadata_cache is None or credentials_rechecked:
+                raise
+            shared_rel_creator = None
+            credentials_rechecked = True
+            client = utils.init_jama_client(metadata_cache)
 
     csv_location = config.csv_location
 
-    if os.path.isdir(csv_location):
+    if args.plan:
+        # Work out what the import would do, then stop without posting anything.
+        if os.path.isdir(csv_location):
+            csv_files = sorted(os.path.join(csv_location, file) for file in os.listdir(csv_location)
+                               if file.lower().endswith('.csv'))
+        else:
+            csv_files = [csv_location]
+        run_estimate = estimate_run([plan_import(csv_file, shared_rel_creator) for csv_file in csv_files],
+                                    shared_rel_creator)
+        plan_file = '{}/{}_{}_plan.json'.format(config.log_directory, config.log_file_name_prefix,
+                                                str(current_date_time))
+        with open(plan_file, 'w') as open_plan_file:
+            json.dump(run_estimate, open_plan_file, indent=2)
+        logging.info('Plan: {} rows in {} files, {} duplicates, {} unresolved, {} ambiguous, {} relationships to post '
+                     'with {} lookup calls.  Post latency {:.3f}s ({}), estimated runtime {:.0f} seconds ({:.0f} '
+                     'looking up, {:.0f} posting {} at a time).  Plan written to '
+                     '{}'.format(run_estimate['rows_read'], len(csv_files), run_estimate['duplicates'],
+                                 run_estimate['unresolved'], run_estimate['ambiguous'],
+                                 run_estimate['projected_posts'], run_estimate['lookup_api_calls'],
+                                 run_estimate['post_latency_seconds'], run_estimate['post_latency_source'],
+                                 run_estimate['estimated_total_seconds'],
+                                 run_estimate['estimated_lookup_seconds'], run_estimate['estimated_post_seconds'],
+                                 run_estimate['post_concurrency'], plan_file))
+        if lookup_cache is not None:
+            lookup_cache.close()
+        if journal is not None:
+            journal.close()
+        if duplicate_filter is not None:
+            duplicate_filter.close()
+        sys.exit(0)
+
+    if args.watch:
+        # Run until we are told to stop, finishing the files being imported first.
+        stop_watching = threading.Event()
+        signal.signal(signal.SIGINT, lambda signal_number, frame: stop_watching.set())
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: stop_watching.set())
+        file_summaries = watch_location(csv_location, shared_rel_creator, stop_watching)
+        log_summary(aggregate_summaries(file_summaries))
+    elif os.path.isdir(csv_location):
         # Process all the CSV files in this directory.
-        for file in filter(lambda x: x.lower().endswith('.csv'), os.listdir(csv_location)):
-            # Increment number of .csv files found.
-            file_count += 1
-            # Run the CSV importer
-            do_import(file)
+        file_summaries = import_directory(csv_location, shared_rel_creator, config.max_concurrent_files)
+        log_summary(aggregate_summaries(file_summaries))
     else:
         # We are just processing a single file.
-        file_count += 1
-        do_import(csv_location)
+        file_summaries = [do_import(csv_location, shared_rel_creator)]
+
+    # Keep track of the number of files processed.
+    file_count = len(file_summaries)
+
+    # Write the machine readable run report.
+    run_info = aggregate_summaries(file_summaries)
+    run_info['files'] = file_summaries
+    if rate_controller is not None:
+        run_info['rate_control'] = {'concurrency_limit': rate_controller.concurrency_limit,
+                                    'throttled_calls': rate_controller.throttled_call_count}
+    if config.write_run_report or report_file is not None:
+        if report_file is None:
+            report_file = '{}/{}_{}_report.json'.format(config.log_directory, config.log_file_name_prefix,
+                                                        str(current_date_time))
+        run_metrics.write_json_report(report_file, run_info)
+        logging.info('Run report written to {}'.format(report_file))
+    if config.prometheus_textfile:
+        run_metrics.write_prometheus_textfile(config.prometheus_textfile, run_info)
+
+    # Make sure everything we looked up is saved for the next run.
+    if lookup_cache is not None:
+        lookup_cache.close()
+    if journal is not None:
+        journal.close()
+    if duplicate_filter is not None:
+        duplicate_filter.close()
 
     # Measure execution time and print a log about it
     elapsed_time = '%.2f' % ((time.perf_counter() - start_time) / 60)
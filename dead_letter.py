@@ -0,0 +1,86 @@
+"""
+This file contains the writer for dead-letter CSV files, which collect the rows an import could not create.
+"""
+
+import csv
+import logging
+import os
+import threading
+
+dead_letter_logger = logging.getLogger('dead_letter')
+
+
+class DeadLetterWriter:
+    """
+    This class writes rows that could not be imported to a CSV file, with the same columns the rows were read from plus
+    a reason column.  The file can be fed straight back into the importer once the cause of the failures is fixed.
+    The file is only created when the first row is written, and it is safe to write to from several threads.  It can be
+    used as a context manager, which closes it on the way out.
+    """
+
+    reason_column = 'reason'
+
+    def __init__(self, dead_letter_file: str, column_names: list, column_positions: list = None,
+                 row_length: int = None):
+        """
+        Initialize a dead-letter writer
+        :param dead_letter_file: The path of the CSV file to write
+        :param column_names: The names of the source, target and (optionally) relationship type columns
+        :param column_positions: Only for source files without a header row, the position of each column in the source
+        file.  Rows are then written in the layout of the source file and without a header row, so the dead-letter file
+        can be read with the same csv_headers setting.  The reason is written after the last column.
+        :param row_length: The number of columns of the source file, used with column_positions
+        """
+        self.dead_letter_file = dead_letter_file
+        self.column_names = list(column_names)
+        self.column_positions = list(column_positions) if column_positions is not None else None
+        self.row_length = max(row_length or 0, max(self.column_positions) + 1) if self.column_positions else None
+        self.row_count = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, row_values: list, reason: str):
+        """
+        Write a row that could not be imported.
+        :param row_values: The values of the row, in the same order as the column names
+        :param reason: Why the row could not be imported
+        :return: None
+        """
+        row_values = [value if value is not None else '' for value in row_values]
+        if self.column_positions is not None:
+            positioned_values = [''] * self.row_length
+            for position, value in zip(self.column_positions, row_values):
+                positioned_values[position] = value
+            row_values = positioned_values
+
+        with self._lock:
+            if self._file is None:
+                # Rows written after the file was closed are added to it, the rows already written are kept.
+                first_open = self.row_count == 0
+                os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_file)), exist_ok=True)
+                self._file = open(self.dead_letter_file, 'w' if first_open else 'a', newline='', encoding='utf-8')
+                self._writer = csv.writer(self._file)
+                if first_open and self.column_positions is None:
+                    self._writer.writerow(self.column_names + [DeadLetterWriter.reason_column])
+            self._writer.writerow(row_values + [reason])
+            self.row_count += 1
+
+    def close(self):
+        """
+        Close the dead-letter file if any rows were written to it.  It is safe to call more than once.
+        :return: None
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        dead_letter_logger.warning('{} rows that could not be imported were written to '
+                                   '{}'.format(self.row_count, self.dead_letter_file))
@@ -0,0 +1,94 @@
+"""
+This file contains a polling watcher that finds CSV files as they are dropped into a directory.
+"""
+
+import logging
+import os
+import time
+
+directory_watcher_logger = logging.getLogger('directory_watcher')
+
+
+class DirectoryWatcher:
+    """
+    This class polls a directory (or a single file) for CSV files that are new or have changed since they were last
+    handed out.  A file is only handed out once its size and modification time have stayed the same for a while, so
+    files that are still being written are not imported half way through.
+    """
+
+    def __init__(self, csv_location: str, stable_seconds: float = 0.5, include_existing: bool = False):
+        """
+        Initialize the watcher
+        :param csv_location: The directory to watch, or a single CSV file to watch for changes
+        :param stable_seconds: The number of seconds a file must stay unchanged before it is handed out
+        :param include_existing: When True, files already present when the watcher starts are handed out as well.
+        When False only files that are added or changed later are.
+        """
+        self.csv_location = csv_location
+        self.stable_seconds = stable_seconds
+        self._handed_out = {}  # Stores path -> (size, modification time) of each file when it was handed out
+        self._changing = {}  # Stores path -> ((size, modification time), time first seen with that signature)
+        if not include_existing:
+            self._handed_out.update(self._scan())
+
+    def poll(self):
+        """
+        Check the watched location once.
+        :return: A sorted list of the paths of files that are ready to be imported.
+        """
+        now = time.monotonic()
+        ready_files = []
+        current_files = self._scan()
+        for path, signature in current_files.items():
+            if self._handed_out.get(path) == signature:
+                continue
+
+            # Start the clock on a new signature, and hand the file out once it has stayed the same long enough.
+            changing_signature, first_seen = self._changing.get(path, (None, None))
+            if changing_signature != signature:
+                self._changing[path] = (signature, now)
+                if self.stable_seconds > 0:
+                    continue
+            elif now - first_seen < self.stable_seconds:
+                continue
+
+            del self._changing[path]
+            self._handed_out[path] = signature
+            ready_files.append(path)
+
+        # Forget files that were deleted, so they are imported again if they come back.
+        for path in list(self._handed_out):
+            if path not in current_files:
+                del self._handed_out[path]
+        for path in list(self._changing):
+            if path not in current_files:
+                del self._changing[path]
+
+        if ready_files:
+            directory_watcher_logger.info('Found {} new or changed csv files in {}'.format(len(ready_files),
+                                                                                           self.csv_location))
+        return sorted(ready_files)
+
+    def _scan(self):
+        """
+        :return: A dictionary of path -> (size, modification time) for every CSV file in the watched location.
+        """
+        files = {}
+        if os.path.isdir(self.csv_location):
+            with os.scandir(self.csv_location) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith('.csv'):
+                        try:
+                            if entry.is_file():
+                                file_stat = entry.stat()
+                                files[entry.path] = (file_stat.st_size, file_stat.st_mtime_ns)
+                        # The file was removed while we were looking at it.
+                        except FileNotFoundError:
+                            pass
+        elif os.path.isfile(self.csv_location):
+            try:
+                file_stat = os.stat(self.csv_location)
+                files[self.csv_location] = (file_stat.st_size, file_stat.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return files
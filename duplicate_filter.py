@@ -0,0 +1,87 @@
+"""
+This file contains the filter used to drop rows that were already read during a run.
+"""
+
+import logging
+import os
+import threading
+
+duplicate_filter_logger = logging.getLogger('duplicate_filter')
+
+
+class DuplicateFilter:
+    """
+    This class remembers the fingerprint of every row read during a run, so repeated rows can be dropped before any
+    lookups or posts are made for them.  Fingerprints are kept in a set in memory, or in a SQLite file for imports too
+    large for memory.  The file only lives for the run and is removed when the filter is closed.  It is safe to share
+    between threads.
+    """
+
+    # Writes to the store file are committed in batches, this is the number of writes per batch.
+    commit_batch_size = 10000
+
+    def __init__(self, store_file: str = None):
+        """
+        Initialize the duplicate filter
+        :param store_file: Optional path of a SQLite file to keep the fingerprints in, None to keep them in memory.
+        """
+        self.store_file = store_file
+        self._lock = threading.Lock()
+        self._fingerprints = set()
+        self._connection = None
+        self._pending_writes = 0
+        if store_file is not None:
+            # sqlite3 is only imported when the fingerprints are kept on disk, most runs never need it.
+            import sqlite3
+            self._connection = sqlite3.connect(store_file, check_same_thread=False)
+            # The file is thrown away at the end of the run, so there is no need to make it crash safe.
+            self._connection.execute('PRAGMA journal_mode=OFF')
+            self._connection.execute('PRAGMA synchronous=OFF')
+            self._connection.execute('DROP TABLE IF EXISTS seen_rows')
+            self._connection.execute('CREATE TABLE seen_rows (fingerprint BLOB PRIMARY KEY) WITHOUT ROWID')
+
+    def add(self, fingerprint: bytes):
+        """
+        Remember a row.
+        :param fingerprint: The fingerprint of the row's values
+        :return: True if the row had not been seen before, False if it is a duplicate.
+        """
+        with self._lock:
+            if self._connection is None:
+                if fingerprint in self._fingerprints:
+                    return False
+                self._fingerprints.add(fingerprint)
+                return True
+
+            added = self._connection.execute('INSERT OR IGNORE INTO seen_rows VALUES (?)', (fingerprint,)).rowcount
+            self._pending_writes += 1
+            if self._pending_writes >= DuplicateFilter.commit_batch_size:
+                self._connection.commit()
+                self._pending_writes = 0
+            return added == 1
+
+    def clear(self):
+        """
+        Forget every row seen so far.
+        :return: None
+        """
+        with self._lock:
+            self._fingerprints.clear()
+            if self._connection is not None:
+                self._connection.execute('DELETE FROM seen_rows')
+                self._connection.commit()
+                self._pending_writes = 0
+
+    def close(self):
+        """
+        Forget every row and remove the store file, if there is one.
+        :return: None
+        """
+        with self._lock:
+            self._fingerprints.clear()
+            if self._connection is None:
+                return
+            self._connection.close()
+            self._connection = None
+        os.remove(self.store_file)
+        duplicate_filter_logger.debug('Removed duplicate filter store {}'.format(self.store_file))
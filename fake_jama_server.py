@@ -0,0 +1,313 @@
+"""
+This file contains a local stand-in for the Jama Connect REST API.  It emulates the endpoints used by the importer so
+import performance can be measured without touching a real Jama instance.
+
+Run it on its own with:  python fake_jama_server.py --port 8080 --items 100000 --latency 0.01
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+fake_server_logger = logging.getLogger('fake_jama_server')
+
+API_PREFIX = '/rest/v1/'
+
+# The custom field the fake items carry, match on this with source/target_item_custom_field_name.
+LEGACY_ID_FIELD = 'legacy_id'
+ITEM_TYPE_ID = 89
+
+RELATIONSHIP_TYPES = [
+    {'id': 4, 'name': 'Related to', 'isDefault': True},
+    {'id': 5, 'name': 'Derived from', 'isDefault': False},
+    {'id': 6, 'name': 'Verified by', 'isDefault': False},
+]
+
+# Matches each value in a lucene query built by the importer: "field: "value""
+LUCENE_VALUE_PATTERN = re.compile(r'"[^":]+: "(.*?)""')
+
+
+def legacy_id(item_id):
+    """
+    :return: the legacy id custom field value of a fake item.
+    """
+    return 'LEG-{}'.format(item_id)
+
+
+class FakeJamaState:
+    """
+    This class holds the data and behaviour settings of a fake Jama server.  Items are generated on demand from their
+    ID, so a server with millions of items costs no memory.
+    """
+
+    def __init__(self,
+                 item_count: int = 1000,
+                 project_count: int = 1,
+                 latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 max_requests_per_second: float = 0):
+        """
+        :param item_count: The number of items in each project
+        :param project_count: The number of projects, projects are numbered from 1
+        :param latency: The number of seconds each request takes to answer
+        :param error_rate: The fraction of requests (0 to 1) that fail with a 500 error
+        :param max_requests_per_second: Requests above this rate are rejected with a 429 error, 0 for no limit
+        """
+        self.item_count = item_count
+        self.project_count = project_count
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.relationships = []
+        self.call_counts = {}
+        self.lock = threading.Lock()
+
+        # Token bucket used to throttle requests.
+        self._tokens = max_requests_per_second
+        self._tokens_updated_at = time.monotonic()
+
+    def count_call(self, endpoint: str):
+        """
+        Count a call to an endpoint.
+        :return: None
+        """
+        with self.lock:
+            self.call_counts[endpoint] = self.call_counts.get(endpoint, 0) + 1
+
+    def throttled(self):
+        """
+        Take a token from the bucket.
+        :return: True if the request should be rejected with a 429 error.
+        """
+        if not self.max_requests_per_second:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_requests_per_second,
+                               self._tokens + (now - self._tokens_updated_at) * self.max_requests_per_second)
+            self._tokens_updated_at = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def get_item(self, project_id: int, item_number: int):
+        """
+        Build a fake item.  Item ID's are unique across projects.
+        :param project_id: The project the item belongs to
+        :param item_number: The number of the item within its project, from 1 to item_count
+        :return: an item object as returned by the API
+        """
+        item_id = (project_id - 1) * self.item_count + item_number
+        return {
+            'id': item_id,
+            'project': project_id,
+            'itemType': ITEM_TYPE_ID,
+            'fields': {
+                'name': 'Item {}'.format(item_id),
+                '{}${}'.format(LEGACY_ID_FIELD, ITEM_TYPE_ID): legacy_id(item_id),
+            },
+        }
+
+    def find_items(self, projects: list, contains: list):
+        """
+        Emulate the abstractitems search.  Each value in the lucene queries matches the item with that legacy id.
+        :param projects: The projects to search, an empty list searches all projects
+        :param contains: The lucene queries, an empty list matches every item
+        :return: a list of matching items
+        """
+        projects = projects or list(range(1, self.project_count + 1))
+        if not contains:
+            return _LazyItemList(self, projects)
+
+        items = []
+        for query in contains:
+            for value in LUCENE_VALUE_PATTERN.findall(query):
+                if not value.startswith('LEG-') or not value[4:].isdigit():
+                    continue
+                item_id = int(value[4:])
+                project_id = (item_id - 1) // self.item_count + 1
+                if project_id in projects:
+                    items.append(self.get_item(project_id, item_id - (project_id - 1) * self.item_count))
+        return items
+
+    def add_relationship(self, body: dict):
+        """
+        Store a new relationship.
+        :param body: The posted relationship
+        :return: the ID of the new relationship
+        """
+        with self.lock:
+            relationship_id = len(self.relationships) + 1
+            self.relationships.append((relationship_id, int(body['fromItem']), int(body['toItem']),
+                                       int(body.get('relationshipType') or RELATIONSHIP_TYPES[0]['id'])))
+        return relationship_id
+
+    def find_relationships(self, projects: list):
+        """
+        :param projects: The projects to list relationships for
+        :return: a list of relationship objects whose from item is in one of the projects
+        """
+        relationships = []
+        for relationship_id, from_item, to_item, relationship_type in self.relationships:
+            if (from_item - 1) // self.item_count + 1 in projects:
+                relationships.append({'id': relationship_id, 'fromItem': from_item, 'toItem': to_item,
+                                      'relationshipType': relationship_type})
+        return relationships
+
+
+class _LazyItemList:
+    """
+    A read only list of every item in a set of projects, items are only built when a page is requested.
+    """
+
+    def __init__(self, state: FakeJamaState, projects: list):
+        self.state = state
+        self.projects = projects
+
+    def __len__(self):
+        return len(self.projects) * self.state.item_count
+
+    def __getitem__(self, page: slice):
+        items = []
+        for index in range(*page.indices(len(self))):
+            project_id = self.projects[index // self.state.item_count]
+            items.append(self.state.get_item(project_id, index % self.state.item_count + 1))
+        return items
+
+
+class FakeJamaRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles requests to the fake Jama server.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state = None  # Set by make_server
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        resource = url.path[len(API_PREFIX):].strip('/') if url.path.startswith(API_PREFIX) else url.path
+
+        # Stats are not counted or throttled, they are read by the benchmark.
+        if resource == '/__stats__':
+            with self.state.lock:
+                self._send_json(200, {'calls': dict(self.state.call_counts),
+                                      'relationships': len(self.state.relationships)})
+            return
+
+        if not self._begin_call('GET ' + resource):
+            return
+
+        projects = [int(project) for project in query.get('project', [])]
+        if resource == '':
+            self._send_json(200, {'meta': {'status': 'OK'}, 'data': ['abstractitems', 'relationships',
+                                                                    'relationshiptypes']})
+        elif resource == 'abstractitems':
+            self._send_page(self.state.find_items(projects, query.get('contains', [])), query)
+        elif resource == 'relationshiptypes':
+            self._send_page(RELATIONSHIP_TYPES, query)
+        elif resource == 'relationships':
+            self._send_page(self.state.find_relationships(projects), query)
+        else:
+            self._send_json(404, {'meta': {'status': 'Not Found', 'message': 'Unknown resource'}})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        resource = url.path[len(API_PREFIX):].strip('/')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if not self._begin_call('POST ' + resource):
+            return
+
+        if resource == 'relationships':
+            try:
+                relationship_id = self.state.add_relationship(json.loads(body))
+            except (KeyError, TypeError, ValueError):
+                self._send_json(400, {'meta': {'status': 'Bad Request', 'message': 'Invalid relationship'}})
+                return
+            self._send_json(201, {'meta': {'status': 'Created', 'id': relationship_id}})
+        else:
+            self._send_json(404, {'meta': {'status': 'Not Found', 'message': 'Unknown resource'}})
+
+    def log_message(self, format, *args):
+        fake_server_logger.debug(format % args)
+
+    def _begin_call(self, endpoint: str):
+        """
+        Count the call and apply latency, throttling and random errors.
+        :return: True if the call should be answered normally.
+        """
+        self.state.count_call(endpoint)
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if self.state.throttled():
+            self._send_json(429, {'meta': {'status': 'Too Many Requests', 'message': 'Rate limit exceeded'}})
+            return False
+        if self.state.error_rate and random.random() < self.state.error_rate:
+            self._send_json(500, {'meta': {'status': 'Internal Server Error', 'message': 'Injected error'}})
+            return False
+        return True
+
+    def _send_page(self, results, query):
+        """
+        Send one page of results in the Jama paging format.
+        :param results: Every result of the request
+        :param query: The parsed query string, holding startAt and maxResults
+        :return: None
+        """
+        start_at = int(query.get('startAt', ['0'])[0])
+        max_results = min(int(query.get('maxResults', ['20'])[0]), 50)
+        page = results[start_at:start_at + max_results]
+        self._send_json(200, {'meta': {'status': 'OK',
+                                       'pageInfo': {'startIndex': start_at,
+                                                    'resultCount': len(page),
+                                                    'totalResults': len(results)}},
+                              'data': page})
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(state: FakeJamaState, host: str = '127.0.0.1', port: int = 0):
+    """
+    Create a fake Jama server.  Call serve_forever() on the result to start answering requests.
+    :param state: The data and behaviour settings of the server
+    :param host: The host to listen on
+    :param port: The port to listen on, 0 picks a free port
+    :return: a ThreadingHTTPServer, its base url is http://host:server.server_port
+    """
+    handler = type('BoundFakeJamaRequestHandler', (FakeJamaRequestHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Run a local stand-in for the Jama Connect REST API.')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8080)
+    arg_parser.add_argument('--items', type=int, default=1000, help='Number of items in each project.')
+    arg_parser.add_argument('--projects', type=int, default=1, help='Number of projects.')
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='Seconds taken to answer each request.')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail with 500.')
+    arg_parser.add_argument('--max-rps', type=float, default=0, help='Requests per second before answering 429.')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fake_server = make_server(FakeJamaState(args.items, args.projects, args.latency, args.error_rate, args.max_rps),
+                              args.host, args.port)
+    fake_server_logger.info('Fake Jama server listening on http://{}:{}'.format(args.host, fake_server.server_port))
+    fake_server.serve_forever()
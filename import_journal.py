@@ -0,0 +1,138 @@
+"""
+This file contains a crash safe journal of the relationships posted by the importer, used to resume long imports.
+"""
+
+import csv
+import logging
+import os
+import threading
+
+import_journal_logger = logging.getLogger('import_journal')
+
+
+class ImportJournal:
+    """
+    This class keeps an append only CSV journal with one line per posted relationship: the CSV file, the row number
+    in that file, the ID of the created relationship and the fingerprint of the row's values.  The fingerprint tells a
+    row that was posted apart from a different row at the same place in a file that was rewritten since.  The journal
+    is flushed and fsync'd to disk in batches, so after a crash at most one batch of posted rows is missing from it.
+    """
+
+    journal_headers = ['csv_file', 'row_number', 'relationship_id', 'row_fingerprint']
+
+    def __init__(self, journal_file: str, fsync_batch_size: int = 100, resume: bool = False):
+        """
+        Open an import journal
+        :param journal_file: The path of the journal file
+        :param fsync_batch_size: The number of rows to record between each fsync
+        :param resume: When True, read the rows recorded by the previous run and keep appending to the journal.
+        When False, start a new journal.
+        """
+        self.journal_file = journal_file
+        self.fsync_batch_size = max(1, fsync_batch_size)
+        self._posted_rows = {}  # Stores csv file -> journaled row number -> row fingerprint
+        self._lock = threading.Lock()
+        self._unsynced_count = 0
+
+        # Read back what was already posted if we are resuming.
+        if resume and os.path.exists(journal_file):
+            self._read_journal()
+
+        mode = 'a' if resume else 'w'
+        self._journal = open(journal_file, mode, newline='', encoding='utf-8')
+        self._writer = csv.writer(self._journal)
+        if self._journal.tell() == 0:
+            self._writer.writerow(ImportJournal.journal_headers)
+        elif not ImportJournal._ends_with_newline(journal_file):
+            # Finish off a line left partly written by a crash so new rows start on their own line.
+            self._journal.write('\r\n')
+
+    def posted_rows(self, csv_file: str):
+        """
+        Get the rows of a CSV file that were posted by the previous run.
+        :param csv_file: The path of the CSV file
+        :return: A dictionary of row number -> fingerprint of the row's values as bytes.  The fingerprint is None for
+        rows recorded by a journal written before fingerprints were recorded.
+        """
+        return self._posted_rows.get(ImportJournal._file_key(csv_file), {})
+
+    def record(self, csv_file: str, row_number: int, relationship_id, row_fingerprint: bytes = None):
+        """
+        Record a posted relationship.
+        :param csv_file: The path of the CSV file the relationship was read from
+        :param row_number: The row number of the relationship in the CSV file
+        :param relationship_id: The ID of the created relationship
+        :param row_fingerprint: The fingerprint of the row's values, see ImportManifest.fingerprint
+        :return: None
+        """
+        with self._lock:
+            self._writer.writerow([ImportJournal._file_key(csv_file), row_number, relationship_id,
+                                   row_fingerprint.hex() if row_fingerprint is not None else ''])
+            self._unsynced_count += 1
+            if self._unsynced_count >= self.fsync_batch_size:
+                self._sync()
+
+    def flush(self):
+        """
+        Sync every row recorded so far to disk.
+        :return: None
+        """
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        """
+        Sync any remaining rows to disk and close the journal.
+        :return: None
+        """
+        with self._lock:
+            self._sync()
+            self._journal.close()
+
+    def _sync(self):
+        """
+        Flush and fsync the journal.  Must be called while holding the lock.
+        :return: None
+        """
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._unsynced_count = 0
+
+    def _read_journal(self):
+        """
+        Read the rows recorded in an existing journal.  A partly written last line left by a crash is ignored.  Columns
+        are read by position, so journals written before the fingerprint column was added can still be read.
+        :return: None
+        """
+        row_count = 0
+        with open(self.journal_file, newline='', encoding='utf-8') as journal:
+            journal_reader = csv.reader(journal)
+            next(journal_reader, None)
+            for entry in journal_reader:
+                if len(entry) < 3 or not entry[2]:
+                    continue
+                try:
+                    row_number = int(entry[1])
+                    row_fingerprint = bytes.fromhex(entry[3]) if len(entry) > 3 and entry[3] else None
+                except ValueError:
+                    continue
+                self._posted_rows.setdefault(entry[0], {})[row_number] = row_fingerprint
+                row_count += 1
+        import_journal_logger.info('Resuming from journal <{}>, {} rows were already '
+                                   'posted.'.format(self.journal_file, row_count))
+
+    @staticmethod
+    def _ends_with_newline(journal_file: str):
+        """
+        :return: True if the last character in the journal file is a newline.
+        """
+        with open(journal_file, 'rb') as journal:
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) == b'\n'
+
+    @staticmethod
+    def _file_key(csv_file: str):
+        """
+        :return: The key used to identify a CSV file in the journal.
+        """
+        return os.path.abspath(csv_file)
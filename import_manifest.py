@@ -0,0 +1,132 @@
+"""
+This file contains the manifest of rows already imported from each CSV file, used to only import the rows that changed
+since the last run.
+"""
+
+import csv
+import hashlib
+import logging
+import os
+
+import_manifest_logger = logging.getLogger('import_manifest')
+
+
+class ImportManifest:
+    """
+    This class stores one manifest file per CSV file, listing a fingerprint (a short hash of the source, target and
+    relationship type values) of every row that has been imported from it, along with the row's values.  On the next
+    run, rows whose fingerprint is in the manifest are unchanged and can be skipped, and manifest rows that are no
+    longer in the CSV file have been removed from it.
+    """
+
+    manifest_headers = ['fingerprint', 'source', 'target', 'relationship_type']
+
+    # The number of bytes in each fingerprint.
+    fingerprint_size = 16
+
+    def __init__(self, manifest_directory: str, report_removed: bool = False):
+        """
+        Initialize the import manifest
+        :param manifest_directory: The directory to keep the manifest files in
+        :param report_removed: When True, the rows removed from a CSV file since the last run are written to a CSV
+        file next to its manifest each time the manifest is saved.
+        """
+        self.manifest_directory = manifest_directory
+        self.report_removed = report_removed
+        os.makedirs(manifest_directory, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(source_data, target_data, rel_type_data):
+        """
+        :return: The fingerprint of a row, as bytes.
+        """
+        row_key = '\x1f'.join(value if value is not None else '' for value in (source_data, target_data, rel_type_data))
+        return hashlib.blake2b(row_key.encode('utf-8'), digest_size=ImportManifest.fingerprint_size).digest()
+
+    def manifest_file(self, csv_file: str):
+        """
+        :return: The path of the manifest file of a CSV file.  The name includes a hash of the full path of the CSV
+        file, so files with the same name in different directories do not share a manifest.
+        """
+        path_hash = hashlib.blake2b(os.path.abspath(csv_file).encode('utf-8'), digest_size=6).hexdigest()
+        file_stem = os.path.splitext(os.path.basename(csv_file))[0]
+        return os.path.join(self.manifest_directory, '{}_{}_manifest.csv'.format(file_stem, path_hash))
+
+    def load(self, csv_file: str):
+        """
+        Read the fingerprints of the rows imported from a CSV file by previous runs.
+        :param csv_file: The path of the CSV file
+        :return: A set of fingerprints, empty if the file has not been imported before.
+        """
+        manifest_file = self.manifest_file(csv_file)
+        fingerprints = set()
+        if not os.path.exists(manifest_file):
+            return fingerprints
+        with open(manifest_file, newline='', encoding='utf-8') as open_manifest:
+            manifest_reader = csv.reader(open_manifest)
+            next(manifest_reader, None)
+            for manifest_row in manifest_reader:
+                if manifest_row:
+                    fingerprints.add(bytes.fromhex(manifest_row[0]))
+        import_manifest_logger.info('Loaded manifest {} with {} rows.'.format(manifest_file, len(fingerprints)))
+        return fingerprints
+
+    def save(self, csv_file: str, kept_fingerprints: set, new_rows: dict):
+        """
+        Replace the manifest of a CSV file.  The values of kept rows are copied over from the old manifest.
+        :param csv_file: The path of the CSV file
+        :param kept_fingerprints: The fingerprints of the rows in the old manifest that are still in the CSV file
+        :param new_rows: Stores fingerprint -> (source, target, relationship type) of rows imported by this run
+        :return: The number of rows in the old manifest that are no longer in the CSV file.
+        """
+        manifest_file = self.manifest_file(csv_file)
+        temporary_file = manifest_file + '.tmp'
+        removed_count = 0
+        removed_file = None
+        removed_writer = None
+
+        with open(temporary_file, 'w', newline='', encoding='utf-8') as open_manifest:
+            manifest_writer = csv.writer(open_manifest)
+            manifest_writer.writerow(ImportManifest.manifest_headers)
+
+            # Copy over the kept rows, anything else in the old manifest was removed from the CSV file.
+            if os.path.exists(manifest_file):
+                with open(manifest_file, newline='', encoding='utf-8') as old_manifest:
+                    manifest_reader = csv.reader(old_manifest)
+                    next(manifest_reader, None)
+                    for manifest_row in manifest_reader:
+                        if not manifest_row:
+                            continue
+                        if bytes.fromhex(manifest_row[0]) in kept_fingerprints:
+                            manifest_writer.writerow(manifest_row)
+                            continue
+                        removed_count += 1
+                        if self.report_removed:
+                            if removed_writer is None:
+                                removed_file = open(self._removed_file(manifest_file), 'w', newline='',
+                                                    encoding='utf-8')
+                                removed_writer = csv.writer(removed_file)
+                                removed_writer.writerow(ImportManifest.manifest_headers[1:])
+                            removed_writer.writerow(manifest_row[1:])
+
+            for row_fingerprint, row_values in new_rows.items():
+                if row_fingerprint not in kept_fingerprints:
+                    manifest_writer.writerow([row_fingerprint.hex()] + ['' if value is None else value
+                                                                        for value in row_values])
+        os.replace(temporary_file, manifest_file)
+
+        if self.report_removed and removed_file is None and os.path.exists(self._removed_file(manifest_file)):
+            # Don't leave the report of an earlier run lying around.
+            os.remove(self._removed_file(manifest_file))
+        if removed_file is not None:
+            removed_file.close()
+            import_manifest_logger.info('{} rows removed from {} since the last run were written to '
+                                        '{}'.format(removed_count, csv_file, self._removed_file(manifest_file)))
+        return removed_count
+
+    @staticmethod
+    def _removed_file(manifest_file: str):
+        """
+        :return: The path of the removed rows report of a manifest file.
+        """
+        return manifest_file[:-len('_manifest.csv')] + '_removed.csv'
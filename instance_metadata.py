@@ -0,0 +1,149 @@
+"""
+This file contains a small local cache of metadata about a Jama instance, used to skip API calls when the importer
+starts.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+instance_metadata_logger = logging.getLogger('instance_metadata')
+
+
+class InstanceMetadataCache:
+    """
+    This class remembers, for a short time, that a set of credentials was accepted by a Jama instance and the
+    relationship types of that instance, so that runs started one after the other do not have to ask Jama again.
+
+    Entries are stored in a JSON file under a salted hash of the instance URL, user name (or client ID) and password
+    (or client secret), so a changed password does not match the entries of the old one.  The salt is random and kept in
+    the file, passwords and client secrets are never stored.  Entries older than the time to live are ignored.
+    """
+
+    def __init__(self, cache_file: str, ttl_seconds: float):
+        """
+        Initialize the metadata cache
+        :param cache_file: The path of the JSON file to store the cache in
+        :param ttl_seconds: The number of seconds an entry stays valid
+        """
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._instance_key = None
+        self._salt = None  # The salt the instance key was made with
+
+    def use_instance(self, instance_url: str, user: str, secret: str):
+        """
+        Select the Jama instance and credentials the entries are read and written for.
+        :param instance_url: The URL of the Jama instance
+        :param user: The user name, or client ID when using OAuth
+        :param secret: The password, or client secret when using OAuth
+        :return: None
+        """
+        with self._lock:
+            self._salt = self._load()['salt']
+        self._instance_key = hashlib.blake2b('{}\n{}\n{}'.format(instance_url, user, secret).encode('utf-8'),
+                                             digest_size=16, salt=bytes.fromhex(self._salt)).hexdigest()
+
+    def credentials_recently_validated(self):
+        """
+        :return: True if Jama accepted the credentials of this instance and user less than ttl_seconds ago.
+        """
+        return self._get('credentials_validated') is not None
+
+    def record_credentials_validated(self):
+        """
+        Remember that Jama accepted the credentials of this instance and user.
+        :return: None
+        """
+        self._put('credentials_validated', True)
+
+    def forget_credentials(self):
+        """
+        Forget that the credentials of this instance and user were accepted, so they are checked on the next run.
+        :return: None
+        """
+        self._put('credentials_validated', None)
+
+    def get_relationship_types(self):
+        """
+        :return: The cached list of relationship type objects of this instance, or None if there is no valid entry.
+        """
+        return self._get('relationship_types')
+
+    def put_relationship_types(self, relationship_types: list):
+        """
+        Store the relationship types of this instance.
+        :param relationship_types: The list of relationship type objects as returned by the API
+        :return: None
+        """
+        self._put('relationship_types', relationship_types)
+
+    def _get(self, name):
+        """
+        :return: The value of an entry of the selected instance, or None if it is missing or expired.
+        """
+        if self._instance_key is None:
+            return None
+        with self._lock:
+            cache = self._load()
+        # The file was replaced with one using another salt, none of its entries are for this instance key.
+        if cache['salt'] != self._salt:
+            return None
+        entry = cache['instances'].get(self._instance_key, {}).get(name)
+        if entry is None or entry['cached_at'] < time.time() - self.ttl_seconds:
+            return None
+        return entry['value']
+
+    def _put(self, name, value):
+        """
+        Store (or remove, if value is None) an entry of the selected instance.  Expired entries are dropped as the file
+        is rewritten, and the file is replaced in one step so other processes never read it half written.
+        :return: None
+        """
+        if self._instance_key is None:
+            return
+        with self._lock:
+            cache = self._load()
+            if cache['salt'] != self._salt:
+                cache = {'salt': self._salt, 'instances': {}}
+            instances = cache['instances']
+            oldest_valid_time = time.time() - self.ttl_seconds
+            for instance_key in list(instances):
+                instances[instance_key] = {entry_name: entry for entry_name, entry in instances[instance_key].items()
+                                           if entry['cached_at'] >= oldest_valid_time}
+                if not instances[instance_key]:
+                    del instances[instance_key]
+            instance_entries = instances.setdefault(self._instance_key, {})
+            if value is None:
+                instance_entries.pop(name, None)
+            else:
+                instance_entries[name] = {'value': value, 'cached_at': time.time()}
+
+            cache_directory = os.path.dirname(self.cache_file)
+            if cache_directory:
+                os.makedirs(cache_directory, exist_ok=True)
+            temporary_file = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+            with open(temporary_file, 'w', encoding='utf-8') as open_cache_file:
+                json.dump(cache, open_cache_file)
+            os.replace(temporary_file, self.cache_file)
+
+    def _load(self):
+        """
+        Read the cache file.  Must be called while holding the lock.
+        :return: A dictionary holding the salt of the instance keys and a dictionary of instance key -> entry name ->
+        entry.  A new salt and no entries if there is no readable cache file.
+        """
+        try:
+            with open(self.cache_file, encoding='utf-8') as open_cache_file:
+                cache = json.load(open_cache_file)
+            if 'salt' in cache and 'instances' in cache:
+                return cache
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            instance_metadata_logger.warning('Ignoring unreadable metadata cache {}: {}'.format(self.cache_file, e))
+        return {'salt': os.urandom(hashlib.blake2b.SALT_SIZE).hex(), 'instances': {}}
@@ -0,0 +1,33 @@
+"""
+This file gives access to the py_jama_rest_client and requests packages without importing them up front.  They are
+only imported the first time one of the names below is used, ex: jama_api.APIException.  An import still pays for them
+as soon as it creates its client, this only helps the runs that never talk to Jama: --help, merging shard results and
+the shard coordinator.
+"""
+
+import importlib
+
+# Stores name -> (module, attribute) of each name that can be used, the attribute is None for the module itself.
+_LAZY_NAMES = {
+    'requests': ('requests', None),
+    'JamaClient': ('py_jama_rest_client.client', 'JamaClient'),
+    'APIException': ('py_jama_rest_client.client', 'APIException'),
+    'UnauthorizedException': ('py_jama_rest_client.client', 'UnauthorizedException'),
+}
+
+
+def __getattr__(name):
+    """
+    Import the module a name comes from the first time the name is used.
+    :param name: One of the names in _LAZY_NAMES
+    :return: The class or module.
+    """
+    if name not in _LAZY_NAMES:
+        raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+    module_name, attribute = _LAZY_NAMES[name]
+    value = importlib.import_module(module_name)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    # Later uses find the name directly, without calling this function again.
+    globals()[name] = value
+    return value
@@ -0,0 +1,276 @@
+"""
+This file contains a pooled HTTP transport for the Jama API calls made by the importer, used in place of the JamaClient.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from py_jama_rest_client.client import APIException, AlreadyExistsException, APIClientException, \
+    APIServerException, ResourceNotFoundException, TooManyRequestsException, UnauthorizedException
+
+jama_transport_logger = logging.getLogger('jama_transport')
+
+
+class JamaTransport:
+    """
+    This class makes the API calls the importer needs over one requests session, shared by every thread.  Connections
+    are kept alive in a pool and reused between calls, responses are gzip compressed, every call has a timeout, and
+    one OAuth token is shared by every thread and refreshed shortly before it expires.  The methods take the same
+    arguments, return the same data and raise the same exceptions as their JamaClient counterparts, so the transport can
+    be passed anywhere a JamaClient is expected by the importer.
+    """
+
+    # The Jama API will not return more than this many results per page.
+    max_results_per_page = 50
+
+    # OAuth tokens are refreshed when they have less than this many seconds left.
+    token_refresh_margin_seconds = 60
+
+    def __init__(self, host_domain,
+                 credentials=('username|clientID', 'password|clientSecret'),
+                 api_version='/rest/v1/',
+                 oauth=False,
+                 verify=True,
+                 pool_size: int = 32,
+                 connect_timeout_seconds: float = 10.0,
+                 read_timeout_seconds: float = 60.0,
+                 results_per_page: int = max_results_per_page):
+        """
+        Initialize the transport
+        :param host_domain: The domain associated with the Jama Connect host
+        :param credentials: the user name and password as a tuple or client id and client secret if using Oauth.
+        :param api_version: valid args are '/rest/[v1|latest|labs]/'
+        :param oauth: Set to True to authenticate with an OAuth token instead of basic auth
+        :param verify: Setting this to False will skip SSL Certificate verification
+        :param pool_size: The maximum number of connections kept open to the server.  Should be at least the number of
+        API calls made at the same time, or connections will be opened and closed again under load.
+        :param connect_timeout_seconds: The number of seconds to wait for a connection to the server
+        :param read_timeout_seconds: The number of seconds to wait for the server to answer each call
+        :param results_per_page: The number of results fetched by each call that pages through a list, at most 50
+        """
+        self.base_url = host_domain + api_version
+        self.timeout = (connect_timeout_seconds, read_timeout_seconds)
+        self.results_per_page = max(1, min(results_per_page, JamaTransport.max_results_per_page))
+        self.oauth = oauth
+        self.__credentials = credentials
+        self.__token = None
+        self.__token_expires_at = 0.0
+        self.__token_lock = threading.Lock()
+        self.__token_url = host_domain + '/rest/oauth/token'
+
+        # One pool of connections to the Jama host, retries are left to the rate controller and the retry queue.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.verify = verify
+        self.session.headers.update({'Accept': 'application/json',
+                                     'Accept-Encoding': 'gzip, deflate',
+                                     'Connection': 'keep-alive'})
+        if oauth:
+            self.__refresh_token()
+        else:
+            self.session.auth = credentials
+
+        jama_transport_logger.info('Created a new JamaTransport instance. Domain: {} Connecting via Oauth: {} '
+                                   'Connection pool size: {}'.format(host_domain, oauth, pool_size))
+
+    def get_available_endpoints(self):
+        """
+        :return: A list of all the available endpoints.
+        """
+        return self.__request('GET', '').json()['data']
+
+    def get_abstract_items(self,
+                           project=None,
+                           item_type=None,
+                           document_key=None,
+                           release=None,
+                           created_date=None,
+                           modified_date=None,
+                           last_activity_date=None,
+                           contains=None,
+                           sort_by=None):
+        """
+        Get every item that matches the query parameters, each parameter is a list of values or None.
+        :return: A list of item dictionaries.
+        """
+        params = {'project': project,
+                  'itemType': item_type,
+                  'documentKey': document_key,
+                  'release': release,
+                  'createdDate': created_date,
+                  'modifiedDate': modified_date,
+                  'lastActivityDate': last_activity_date,
+                  'contains': contains,
+                  'sortBy': sort_by}
+        return self.__get_all('abstractitems', {key: value for key, value in params.items() if value is not None})
+
+    def get_relationship_types(self):
+        """
+        :return: A list of every relationship type on the Jama Connect instance.
+        """
+        return self.__get_all('relationshiptypes/')
+
+    def get_relationships(self, project_id):
+        """
+        :param project_id: The API id of a project
+        :return: A list of every relationship in the project.
+        """
+        return self.__get_all('relationships', {'project': project_id})
+
+    def get_items_downstream_relationships(self, item_id):
+        """
+        :param item_id: The API id of an item
+        :return: A list of every relationship from the item.
+        """
+        return self.__get_all('items/{}/downstreamrelationships'.format(item_id))
+
+    def post_relationship(self, from_item: int, to_item: int, relationship_type=None):
+        """
+        Create a relationship
+        :param from_item: integer API id of the source item
+        :param to_item: integer API id of the target item
+        :param relationship_type: Optional integer API id of the relationship type to create
+        :return: The integer ID of the newly created relationship.
+        """
+        body = {'fromItem': from_item, 'toItem': to_item}
+        if relationship_type is not None:
+            body['relationshipType'] = relationship_type
+        return self.__request('POST', 'relationships/', json=body).json()['meta']['id']
+
+    def close(self):
+        """
+        Close every pooled connection.
+        :return: None
+        """
+        self.session.close()
+
+    def __get_all(self, resource, params=None):
+        """
+        Page through a list resource.
+        :param resource: The path of the resource, relative to the API base url
+        :param params: The query parameters of the request
+        :return: A list with the data of every page.
+        """
+        parameters = dict(params or {})
+        parameters['maxResults'] = self.results_per_page
+        data = []
+        total_results = None
+        while total_results is None or len(data) < total_results:
+            parameters['startAt'] = len(data)
+            page_json = self.__request('GET', resource, params=parameters).json()
+            page_data = page_json.get('data') or []
+            total_results = page_json['meta']['pageInfo'].get('totalResults', 0)
+            # Stop if the list shrank while we were paging through it.
+            if not page_data:
+                break
+            data.extend(page_data)
+        return data
+
+    def __request(self, method, resource, **kwargs):
+        """
+        Make a call to the API, raising the JamaClient exception that matches the response status if it fails.
+        Timeouts and connection errors are raised as they are, like they are by the JamaClient.
+        :param method: The HTTP method
+        :param resource: The path of the resource, relative to the API base url
+        :return: The response.
+        """
+        url = self.base_url + resource
+        if not self.oauth:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            JamaTransport.__raise_for_status(response)
+            return response
+
+        token = self.__current_token()
+        response = self.session.request(method, url, timeout=self.timeout,
+                                        headers={'Authorization': 'Bearer ' + token}, **kwargs)
+        # The token may have been revoked early, get a new one and try once more.
+        if response.status_code == 401:
+            token = self.__refresh_token(token)
+            response = self.session.request(method, url, timeout=self.timeout,
+                                            headers={'Authorization': 'Bearer ' + token}, **kwargs)
+        JamaTransport.__raise_for_status(response)
+        return response
+
+    def __current_token(self):
+        """
+        :return: The shared OAuth token, refreshed first if it is about to expire.
+        """
+        with self.__token_lock:
+            token = self.__token
+            expiring = time.time() > self.__token_expires_at - JamaTransport.token_refresh_margin_seconds
+        if expiring:
+            return self.__refresh_token(token)
+        return token
+
+    def __refresh_token(self, stale_token=None):
+        """
+        Fetch a new OAuth token.  When several threads find the token stale at once, only the first one fetches a new
+        token and the others use it.
+        :param stale_token: The token the caller found to be expired, None on the first call
+        :return: The new token.
+        """
+        with self.__token_lock:
+            if self.__token is not None and self.__token != stale_token:
+                return self.__token
+
+            # Take the time before asking for the token, so it is never used after it expires.
+            time_before_request = time.time()
+            response = self.session.post(self.__token_url, auth=self.__credentials,
+                                         data={'grant_type': 'client_credentials'}, timeout=self.timeout)
+            if response.status_code not in (200, 201):
+                raise UnauthorizedException('Unable to fetch token: {} {}'.format(response.status_code,
+                                                                                  response.reason),
+                                            status_code=response.status_code,
+                                            reason=response.reason)
+            response_json = response.json()
+            self.__token = response_json['access_token']
+            self.__token_expires_at = time_before_request + response_json['expires_in']
+            jama_transport_logger.debug('Fetched a new OAuth token, it expires in {} '
+                                        'seconds'.format(response_json['expires_in']))
+            return self.__token
+
+    @staticmethod
+    def __raise_for_status(response):
+        """
+        Raise the same exception the JamaClient would for a response that is not in the 200 range.
+        :param response: The response to check
+        :return: None
+        """
+        status = response.status_code
+        if 200 <= status < 300:
+            return
+
+        if 400 <= status < 500:
+            response_message = 'No Response'
+            try:
+                response_message = response.json().get('meta').get('message')
+            except (ValueError, AttributeError):
+                pass
+            jama_transport_logger.error('API Client Error. Status: {} Message: {}'.format(status, response_message))
+
+            if response_message is not None and 'already exists' in response_message:
+                raise AlreadyExistsException('Entity already exists.', status_code=status, reason=response_message)
+            if status == 401:
+                raise UnauthorizedException('Unauthorized: check credentials and permissions.  API response message '
+                                            '{}'.format(response_message), status_code=status, reason=response_message)
+            if status == 404:
+                raise ResourceNotFoundException('Resource not found. check host url.', status_code=status,
+                                                reason=response_message)
+            if status == 429:
+                raise TooManyRequestsException('Too many requests.  API throttling limit reached, or system under '
+                                               'maintenance.', status_code=status, reason=response_message)
+            raise APIClientException('{} {} Client Error.  Bad Request.  API response message: '
+                                     '{}'.format(status, response.reason, response_message),
+                                     status_code=status, reason=response_message)
+
+        if 500 <= status < 600:
+            jama_transport_logger.error('API Server Error. Status: {} Reason: {}'.format(status, response.reason))
+            raise APIServerException('{} {} Server Error.'.format(status, response.reason), status_code=status,
+                                     reason=response.reason)
+
+        raise APIException('{} Unexpected response.'.format(status), status_code=status, reason=response.reason)
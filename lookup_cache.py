@@ -0,0 +1,209 @@
+"""
+This file contains a persistent lookup cache that lets item and relationship type lookups be shared across runs and
+across CSV files.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+lookup_cache_logger = logging.getLogger('lookup_cache')
+
+
+class LookupCache:
+    """
+    This class stores field value -> item id and relationship type lookups in a local SQLite file.
+
+    Entries are keyed by the Jama instance URL, the list of projects searched and the field name, so a cache file can
+    safely be shared between configurations.  Lookups that found no item are cached as well so they are not searched
+    for again.  Entries older than the time to live are ignored.
+    """
+
+    # Writes are committed in batches, this is the number of writes per batch.
+    commit_batch_size = 500
+
+    def __init__(self, cache_file: str, instance_url: str, ttl_seconds: float):
+        """
+        Open (or create) a lookup cache
+        :param cache_file: The path of the SQLite file to store the cache in
+        :param instance_url: The URL of the Jama instance the cached ID's belong to
+        :param ttl_seconds: The number of seconds a cache entry stays valid
+        """
+        self.cache_file = cache_file
+        self.instance_url = instance_url
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        # sqlite3 is only imported once a cache is opened, most runs never need it.
+        import sqlite3
+        self._connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS item_lookup ('
+                                 'instance_url TEXT NOT NULL, '
+                                 'projects TEXT NOT NULL, '
+                                 'field_name TEXT NOT NULL, '
+                                 'field_value TEXT NOT NULL, '
+                                 'item_id INTEGER, '
+                                 'cached_at REAL NOT NULL, '
+                                 'PRIMARY KEY (instance_url, projects, field_name, field_value))')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS relationship_types ('
+                                 'instance_url TEXT PRIMARY KEY, '
+                                 'relationship_types TEXT NOT NULL, '
+                                 'cached_at REAL NOT NULL)')
+        self._connection.commit()
+
+    def get_item_id(self, field_name: str, project_list: list, field_value: str):
+        """
+        Look up a cached item id.
+        :param field_name: The name of the field that was searched
+        :param project_list: The projects that were searched
+        :param field_value: The value that was searched for
+        :return: A tuple of (found, item_id).  found is False if there is no valid cache entry, item_id is None if the
+        cache entry records that no item matched the value.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT item_id FROM item_lookup WHERE instance_url = ? AND projects = ? '
+                                           'AND field_name = ? AND field_value = ? AND cached_at >= ?',
+                                           (self.instance_url, LookupCache._projects_key(project_list), field_name,
+                                            field_value, self._oldest_valid_time())).fetchone()
+        if row is None:
+            return False, None
+        return True, row[0]
+
+    def put_item_id(self, field_name: str, project_list: list, field_value: str, item_id):
+        """
+        Store the result of an item lookup.
+        :param field_name: The name of the field that was searched
+        :param project_list: The projects that were searched
+        :param field_value: The value that was searched for
+        :param item_id: The ID of the matching item, or None if no item matched
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO item_lookup VALUES (?, ?, ?, ?, ?, ?)',
+                                     (self.instance_url, LookupCache._projects_key(project_list), field_name,
+                                      field_value, item_id, time.time()))
+            self._record_write()
+
+    def get_relationship_types(self):
+        """
+        Get the cached relationship types for this instance.
+        :return: The list of relationship type objects, or None if there is no valid cache entry.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT relationship_types FROM relationship_types '
+                                           'WHERE instance_url = ? AND cached_at >= ?',
+                                           (self.instance_url, self._oldest_valid_time())).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put_relationship_types(self, relationship_types: list):
+        """
+        Store the relationship types for this instance.
+        :param relationship_types: The list of relationship type objects as returned by the API
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO relationship_types VALUES (?, ?, ?)',
+                                     (self.instance_url, json.dumps(relationship_types), time.time()))
+            self._record_write()
+
+    def invalidate(self):
+        """
+        Remove every cache entry for this instance.
+        :return: None
+        """
+        with self._lock:
+            item_count = self._connection.execute('DELETE FROM item_lookup WHERE instance_url = ?',
+                                                  (self.instance_url,)).rowcount
+            self._connection.execute('DELETE FROM relationship_types WHERE instance_url = ?', (self.instance_url,))
+            self._connection.commit()
+            self._pending_writes = 0
+        lookup_cache_logger.info('Invalidated lookup cache <{}>, removed {} item lookups.'.format(self.cache_file,
+                                                                                                  item_count))
+
+    def flush(self):
+        """
+        Commit any pending writes to disk.
+        :return: None
+        """
+        with self._lock:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def close(self):
+        """
+        Commit any pending writes and close the cache file.
+        :return: None
+        """
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def _record_write(self):
+        """
+        Count a write and commit if the batch is full.  Must be called while holding the lock.
+        :return: None
+        """
+        self._pending_writes += 1
+        if self._pending_writes >= LookupCache.commit_batch_size:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def _oldest_valid_time(self):
+        """
+        :return: The timestamp of the oldest cache entry that is still valid.
+        """
+        return time.time() - self.ttl_seconds
+
+    @staticmethod
+    def _projects_key(project_list):
+        """
+        Build a key for a list of projects that does not depend on the order of the list.
+        :param project_list: A list of project ID's
+        :return: A string key
+        """
+        if not project_list:
+            return '*'
+        return ','.join(sorted(str(project) for project in project_list))
+
+
+class LRULookupTable(OrderedDict):
+    """
+    An in memory lookup table that holds at most max_size entries.  When a new entry would make the table too big, the
+    least recently used entry is evicted, so a long running import keeps the values it uses most without growing
+    forever.  It is safe to share between threads.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        Initialize the lookup table
+        :param max_size: The maximum number of entries to hold
+        """
+        super().__init__()
+        self.max_size = max(1, max_size)
+        self.eviction_count = 0
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = super().__getitem__(key)
+            self.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while len(self) > self.max_size:
+                self.popitem(last=False)
+                self.eviction_count += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self:
+                return self[key]
+            return default
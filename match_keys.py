@@ -0,0 +1,113 @@
+"""
+This file contains the match keys used to match CSV rows to items on more than one field, or on normalized values.
+"""
+
+import logging
+
+match_keys_logger = logging.getLogger('match_keys')
+
+
+def get_field_value(item, field_name):
+    """
+    Get the value of a field from an item payload.  Custom fields are returned by the API with the item type appended to
+    the field name (ex: legacy_id$89), so these are matched on the part before the '$'.  Fields that are not in the
+    item's fields, such as itemType or project, are read from the item itself.
+    :param item: An item object as returned by the API
+    :param field_name: The name of the field to read
+    :return: the field value as a string, or None if the item does not have this field.
+    """
+    fields = item.get('fields', {})
+    field_value = fields.get(field_name)
+    if field_value is None:
+        for key, value in fields.items():
+            if key.split('$')[0] == field_name:
+                field_value = value
+                break
+    if field_value is None:
+        field_value = item.get(field_name)
+    if field_value is None:
+        return None
+    return str(field_value)
+
+
+class MatchKey:
+    """
+    This class describes how the rows of a CSV file are matched to items: the CSV columns that are read, the item field
+    each column is compared to, and whether values are normalized first.  A row matches the item whose fields all equal
+    the row's values.  Rows hold the raw values of their key columns joined by the separator, so they can be written
+    back out unchanged, and are only normalized when they are looked up.
+    """
+
+    # Joins the values of the key columns of a row, this character does not appear in CSV text.
+    separator = '\x1f'
+
+    def __init__(self, fields: list, normalize: bool = False):
+        """
+        Initialize the match key
+        :param fields: A list of (csv column, item field) pairs
+        :param normalize: When True, values are compared without surrounding or repeated whitespace and ignoring case.
+        """
+        if not fields:
+            raise ValueError('A match key needs at least one (csv column, item field) pair.')
+        self.columns = [column for column, _ in fields]
+        self.field_names = [field_name for _, field_name in fields]
+        self.normalize = normalize
+
+    def __eq__(self, other):
+        return isinstance(other, MatchKey) and self.field_names == other.field_names and \
+            self.normalize == other.normalize
+
+    def __hash__(self):
+        return hash((tuple(self.field_names), self.normalize))
+
+    def __repr__(self):
+        return ' + '.join(self.field_names) + (' (normalized)' if self.normalize else '')
+
+    def row_value(self, column_values):
+        """
+        :param column_values: The values of the key columns of a row, in order
+        :return: the values joined into one string, as stored on the row.
+        """
+        if len(column_values) == 1:
+            return column_values[0]
+        return MatchKey.separator.join('' if value is None else value for value in column_values)
+
+    def split_row_value(self, row_value):
+        """
+        :return: the values of the key columns of a row, as passed to row_value.
+        """
+        if len(self.columns) == 1:
+            return [row_value]
+        return row_value.split(MatchKey.separator)
+
+    def lookup_value(self, row_value):
+        """
+        :return: the value of a row to look up in a lookup index built with item_value, or None if it has no value.
+        """
+        if row_value is None:
+            return None
+        if not self.normalize:
+            return row_value
+        return MatchKey.separator.join(MatchKey.normalize_value(value)
+                                       for value in row_value.split(MatchKey.separator))
+
+    def item_value(self, item):
+        """
+        :param item: An item object as returned by the API
+        :return: the key of the item to store in a lookup index, or None if the item is missing one of the fields.
+        """
+        field_values = []
+        for field_name in self.field_names:
+            field_value = get_field_value(item, field_name)
+            if field_value is None:
+                return None
+            field_values.append(MatchKey.normalize_value(field_value) if self.normalize else field_value)
+        return MatchKey.separator.join(field_values)
+
+    @staticmethod
+    def normalize_value(value):
+        """
+        :return: the value with surrounding whitespace removed, runs of whitespace collapsed to one space and case
+        folded, so values that only differ in case or spacing are equal.
+        """
+        return ' '.join(value.split()).casefold()
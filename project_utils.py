@@ -6,7 +6,7 @@ import getpass
 import sys
 import config
 import logging
-from py_jama_rest_client.client import JamaClient, APIException
+import jama_api
 
 util_logger = logging.getLogger('util_logger')
 
@@ -88,7 +88,7 @@ def validate_base_url(base_url):
         instance_url = instance_url[:-1]
 
     # user forget to put the "https://" bit?
-    if not instance_url.startswith('https://') or instance_url.startswith('http://'):
+    if not instance_url.startswith(('https://', 'http://')):
         # if forgotten then ASSuME that this is an https server.
         instance_url = 'https://' + instance_url
 
@@ -98,7 +98,14 @@ def validate_base_url(base_url):
     return instance_url
 
 
-def init_jama_client():
+def init_jama_client(metadata_cache=None):
+    """
+    Create a Jama client from the credentials in config.py, prompting for new credentials if they do not work.
+    :param metadata_cache: Optional InstanceMetadataCache.  If it holds a recent record that Jama accepted these
+    credentials, they are not checked again, otherwise the record is written once they are checked.  The record is
+    dropped if Jama rejects the credentials later on, so calling this again checks them.
+    :return: The Jama client.
+    """
     while True:
         # See if this set of credentials works.
         try:
@@ -111,12 +118,30 @@ def init_jama_client():
                 username = config.client_id
                 password = config.client_secret
 
-            # Try to make the client
-            jama_client = JamaClient(instance_url, credentials=(username, password), oauth=oauth)
+            # Try to make the client, the client packages are only imported now.
+            if config.use_pooled_transport:
+                from jama_transport import JamaTransport
+                jama_client = JamaTransport(instance_url,
+                                            credentials=(username, password),
+                                            oauth=oauth,
+                                            pool_size=config.transport_pool_size,
+                                            connect_timeout_seconds=config.transport_connect_timeout_seconds,
+                                            read_timeout_seconds=config.transport_read_timeout_seconds)
+            else:
+                jama_client = jama_api.JamaClient(instance_url, credentials=(username, password), oauth=oauth)
+
+            # Skip the check if these credentials were accepted a moment ago.
+            if metadata_cache is not None:
+                metadata_cache.use_instance(instance_url, username, password)
+                if metadata_cache.credentials_recently_validated():
+                    util_logger.info('Credentials were checked recently, skipping the check.')
+                    return jama_client
             jama_client.get_available_endpoints()
+            if metadata_cache is not None:
+                metadata_cache.record_credentials_validated()
             return jama_client
         # Catch any exception from the API
-        except APIException as e:
+        except jama_api.APIException as e:
             # we cant do things without the API so lets kick out of the execution.
             util_logger.warning('Error: invalid Jama credentials, check they are valid in the config.py file.')
 
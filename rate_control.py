@@ -0,0 +1,154 @@
+"""
+This file contains an adaptive rate controller that is shared by every call the importer makes to the Jama API.
+"""
+
+import logging
+import threading
+import time
+
+import jama_api
+
+rate_control_logger = logging.getLogger('rate_control')
+
+# Responses with these status codes mean the server is asking us to slow down.
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class AdaptiveRateController:
+    """
+    This class limits the number of API calls in flight using additive increase / multiplicative decrease (AIMD).
+
+    While the server is healthy the concurrency limit grows by roughly one call per round of successful calls.  When
+    the server throttles us (429 / 503) or a call times out, the limit is cut by the decrease factor, every caller
+    pauses for a backoff period and the throttled call is retried.  This lets the importer run close to the real
+    capacity of the server instead of at a hand tuned fixed value.
+    """
+
+    def __init__(self,
+                 initial_concurrency: int = 4,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 32,
+                 decrease_factor: float = 0.5,
+                 max_retries: int = 5,
+                 backoff_seconds: float = 1.0,
+                 log_interval_seconds: float = 30):
+        """
+        Initialize the rate controller
+        :param initial_concurrency: The number of calls allowed in flight to start with
+        :param min_concurrency: The concurrency limit will never drop below this value
+        :param max_concurrency: The concurrency limit will never grow above this value
+        :param decrease_factor: The concurrency limit is multiplied by this value each time we are throttled
+        :param max_retries: The number of times a throttled call is retried before giving up
+        :param backoff_seconds: The pause after the first throttled call, this doubles with each retry of a call
+        :param log_interval_seconds: How often to log the current rate and concurrency
+        """
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.log_interval_seconds = log_interval_seconds
+
+        self._limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self._in_flight = 0
+        self._pause_until = 0.0  # No call may start before this time.
+        self._condition = threading.Condition()
+
+        # Used to measure and periodically log the call rate.
+        self._window_started_at = time.monotonic()
+        self._window_call_count = 0
+        self._current_rate = 0.0
+        self.throttled_call_count = 0
+
+    @property
+    def concurrency_limit(self):
+        """The number of calls currently allowed in flight."""
+        return int(self._limit)
+
+    @property
+    def current_rate(self):
+        """The number of calls per second completed during the last log interval."""
+        return self._current_rate
+
+    def call(self, function, *args, idempotent: bool = True, **kwargs):
+        """
+        Call an API function under rate control, retrying it if the server throttles us.
+        :param function: The API function to call
+        :param idempotent: Set to False for calls that must not be made twice, such as creating a relationship.  These
+        are not retried after a timeout or connection error that may have happened once the server had the request,
+        only when they are throttled or the connection could not be made.
+        :return: whatever the API function returns.
+        :raise APIException: If the call fails, or is still throttled after max_retries attempts.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                result = function(*args, **kwargs)
+            except jama_api.APIException as e:
+                throttled = e.status_code in THROTTLE_STATUS_CODES
+                self._release(throttled)
+                if not throttled or attempt >= self.max_retries:
+                    raise e
+                error = e
+            except (jama_api.requests.exceptions.Timeout, jama_api.requests.exceptions.ConnectionError) as e:
+                self._release(True)
+                sent = not isinstance(e, jama_api.requests.exceptions.ConnectTimeout)
+                if attempt >= self.max_retries or (sent and not idempotent):
+                    raise jama_api.APIException(str(e)) from e
+                error = e
+            else:
+                self._release(False)
+                return result
+
+            # We were throttled, back off before trying again.
+            attempt += 1
+            backoff = self.backoff_seconds * 2 ** (attempt - 1)
+            rate_control_logger.warning('Throttled by server, retry {} of {} in {:.1f}s.  Concurrency limit is now {}. '
+                                        'Error: {}'.format(attempt, self.max_retries, backoff,
+                                                           self.concurrency_limit, error))
+            with self._condition:
+                self._pause_until = max(self._pause_until, time.monotonic() + backoff)
+
+    def _acquire(self):
+        """
+        Block until a call may be started.
+        :return: None
+        """
+        with self._condition:
+            while True:
+                pause_remaining = self._pause_until - time.monotonic()
+                if pause_remaining > 0:
+                    self._condition.wait(pause_remaining)
+                elif self._in_flight >= int(self._limit):
+                    self._condition.wait()
+                else:
+                    break
+            self._in_flight += 1
+
+    def _release(self, throttled: bool):
+        """
+        Record the end of a call and adjust the concurrency limit.
+        :param throttled: True if the server throttled the call.
+        :return: None
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.throttled_call_count += 1
+                self._limit = max(self.min_concurrency, self._limit * self.decrease_factor)
+            else:
+                self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+            self._window_call_count += 1
+            self._condition.notify_all()
+
+            # Periodically log the rate we are running at.
+            now = time.monotonic()
+            elapsed = now - self._window_started_at
+            if elapsed >= self.log_interval_seconds:
+                self._current_rate = self._window_call_count / elapsed
+                self._window_started_at = now
+                self._window_call_count = 0
+                rate_control_logger.info('API rate: {:.1f} calls/s, concurrency limit: {}, in flight: {}, '
+                                         'throttled calls: {}'.format(self._current_rate, self.concurrency_limit,
+                                                                      self._in_flight, self.throttled_call_count))
@@ -0,0 +1,102 @@
+"""
+This file contains the queue that holds failed API work until it is due to be tried again.
+"""
+
+import heapq
+import itertools
+import random
+import time
+
+import jama_api
+
+# Responses with these status codes, or no response at all, mean a failed call may succeed if it is tried again.
+RETRYABLE_STATUS_CODES = (429,)
+
+
+def is_retryable(error):
+    """
+    Decide if a failed API call is worth trying again.  Server errors, throttling and calls that never got a response
+    are retried, client errors such as a bad request are not.
+    :param error: The APIException raised by the call
+    :return: True if the call may succeed if it is tried again.
+    """
+    status_code = getattr(error, 'status_code', None)
+    return status_code is None or status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+
+
+def may_have_been_carried_out(error):
+    """
+    Decide if a failed API call may have been carried out by the server anyway.  This is the case when no response
+    was received, unless the connection to the server could not even be made.
+    :param error: The APIException raised by the call
+    :return: True if the server may have carried out the call.
+    """
+    if getattr(error, 'status_code', None) is not None:
+        return False
+    return not isinstance(error.__cause__, jama_api.requests.exceptions.ConnectTimeout)
+
+
+def backoff_delay(attempt: int, backoff_seconds: float, max_backoff_seconds: float):
+    """
+    Work out how long to wait before a retry.  Each retry waits twice as long as the last, up to a maximum, with random
+    jitter so that calls which failed together are not all retried at the same moment.
+    :param attempt: The number of the retry, starting at 1
+    :param backoff_seconds: The base wait before the first retry
+    :param max_backoff_seconds: The wait will never be longer than this
+    :return: the number of seconds to wait.
+    """
+    backoff = min(max_backoff_seconds, backoff_seconds * 2 ** (attempt - 1))
+    # Equal jitter: wait at least half the backoff, plus a random part of the other half.
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+class RetryQueue:
+    """
+    This class holds items waiting to be retried, ordered by the time they are due.  Each retry of an item waits
+    exponentially longer than the last, with random jitter so that items which failed together are not all retried at
+    the same moment.  It is meant to be used by a single thread.
+    """
+
+    def __init__(self, backoff_seconds: float = 1.0, max_backoff_seconds: float = 60.0):
+        """
+        Initialize the retry queue
+        :param backoff_seconds: The base wait before the first retry of an item, this doubles with each retry
+        :param max_backoff_seconds: The wait before a retry will never be longer than this
+        """
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._heap = []  # Stores (due time, sequence, item, attempt)
+        self._sequence = itertools.count()  # Breaks ties between items due at the same time
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item, attempt: int):
+        """
+        Put an item on the queue to be retried.
+        :param item: The item to retry
+        :param attempt: The number of the retry, starting at 1
+        :return: the number of seconds until the item is due.
+        """
+        delay = backoff_delay(attempt, self.backoff_seconds, self.max_backoff_seconds)
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), item, attempt))
+        return delay
+
+    def pop_due(self):
+        """
+        Take the next item that is due off the queue.
+        :return: A tuple of (item, attempt), or None if no item is due yet.
+        """
+        if not self._heap or self._heap[0][0] > time.monotonic():
+            return None
+        _, _, item, attempt = heapq.heappop(self._heap)
+        return item, attempt
+
+    def seconds_until_due(self):
+        """
+        :return: the number of seconds until the next item is due, 0 if one is already due, or None if the queue is
+        empty.
+        """
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
@@ -0,0 +1,226 @@
+"""
+This file contains the instrumentation used to measure where the time of an import run goes.
+"""
+
+import json
+import os
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+# The latency percentiles reported for each API endpoint.
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+class RunMetrics:
+    """
+    This class collects timings and counts for one run of the importer: the time spent in each phase, the number,
+    errors and latency of API calls by endpoint, and the hit / miss counts of each lookup table.  It is safe to share
+    between threads.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self._phase_seconds = {}  # Stores phase name -> seconds
+        self._api_latencies = {}  # Stores endpoint -> array of call latencies in seconds
+        self._api_errors = {}  # Stores endpoint -> number of calls that raised an error
+        self._lookup_hits = {}  # Stores lookup table name -> number of hits
+        self._lookup_misses = {}  # Stores lookup table name -> number of misses
+        self._searched_values = 0  # Stores the number of field values searched for with the API
+        self._cached_search_results = 0  # Stores the number of searched values whose result was put in the lookup cache
+
+    @contextmanager
+    def phase(self, phase_name: str):
+        """
+        Time a phase of the import, time spent in the same phase more than once is added up.
+        :param phase_name: The name of the phase
+        """
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - phase_start
+            with self._lock:
+                self._phase_seconds[phase_name] = self._phase_seconds.get(phase_name, 0.0) + elapsed
+
+    def timed_api_call(self, function):
+        """
+        Wrap an API function so that each call to it is counted and timed.
+        :param function: The client function to wrap
+        :return: the wrapped function.
+        """
+        endpoint = function.__name__
+
+        def timed_function(*args, **kwargs):
+            call_start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self._api_errors[endpoint] = self._api_errors.get(endpoint, 0) + 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - call_start
+                with self._lock:
+                    self._api_latencies.setdefault(endpoint, array('d')).append(elapsed)
+
+        return timed_function
+
+    def record_lookup(self, table_name: str, hit: bool, count: int = 1):
+        """
+        Count lookups in a lookup table.
+        :param table_name: The name of the lookup table
+        :param hit: True if the lookup table already held the value
+        :param count: The number of lookups
+        :return: None
+        """
+        counts = self._lookup_hits if hit else self._lookup_misses
+        with self._lock:
+            counts[table_name] = counts.get(table_name, 0) + count
+
+    def record_search(self, value_count: int, cached_count: int = 0):
+        """
+        Count field values searched for with the API.
+        :param value_count: The number of values searched for
+        :param cached_count: The number of those values whose result was stored in the persistent lookup cache
+        :return: None
+        """
+        with self._lock:
+            self._searched_values += value_count
+            self._cached_search_results += cached_count
+
+    def search_counts(self):
+        """
+        :return: A tuple of (searched, cached), the number of values searched for with the API and the number of those
+        values whose result was stored in the persistent lookup cache.
+        """
+        with self._lock:
+            return self._searched_values, self._cached_search_results
+
+    def api_call_count(self, endpoint: str = None):
+        """
+        :param endpoint: The endpoint to count calls to, None to count calls to all endpoints
+        :return: the number of API calls made.
+        """
+        with self._lock:
+            if endpoint is not None:
+                return len(self._api_latencies.get(endpoint, ()))
+            return sum(len(latencies) for latencies in self._api_latencies.values())
+
+    def mean_latency(self, endpoint: str):
+        """
+        :return: the mean latency in seconds of calls to an endpoint, or None if no calls were made.
+        """
+        with self._lock:
+            latencies = self._api_latencies.get(endpoint)
+            if not latencies:
+                return None
+            return sum(latencies) / len(latencies)
+
+    def report(self, run_info: dict = None):
+        """
+        Build a report of everything measured so far.
+        :param run_info: Extra information about the run to include in the report, such as row counts
+        :return: A dictionary that can be written as JSON.
+        """
+        elapsed = time.perf_counter() - self._start_time
+        run_info = dict(run_info or {})
+        with self._lock:
+            api_calls = {}
+            for endpoint, latencies in self._api_latencies.items():
+                sorted_latencies = sorted(latencies)
+                endpoint_report = {
+                    'calls': len(sorted_latencies),
+                    'errors': self._api_errors.get(endpoint, 0),
+                    'mean_seconds': round(sum(sorted_latencies) / len(sorted_latencies), 6),
+                }
+                for percentile in LATENCY_PERCENTILES:
+                    endpoint_report['p{}_seconds'.format(percentile)] = round(
+                        RunMetrics._percentile(sorted_latencies, percentile), 6)
+                api_calls[endpoint] = endpoint_report
+
+            lookups = {}
+            for table_name in set(self._lookup_hits) | set(self._lookup_misses):
+                hits = self._lookup_hits.get(table_name, 0)
+                misses = self._lookup_misses.get(table_name, 0)
+                lookups[table_name] = {'hits': hits,
+                                       'misses': misses,
+                                       'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None}
+
+            phases = {phase_name: round(seconds, 3) for phase_name, seconds in self._phase_seconds.items()}
+
+        rows_read = run_info.get('rows_read')
+        run_info.update({
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(rows_read / elapsed, 1) if rows_read and elapsed else None,
+            'phase_seconds': phases,
+            'api_calls': api_calls,
+            'lookups': lookups,
+        })
+        return run_info
+
+    def write_json_report(self, report_file: str, run_info: dict = None):
+        """
+        Write the run report to a JSON file.
+        :param report_file: The path of the file to write
+        :param run_info: Extra information about the run to include in the report
+        :return: the report that was written.
+        """
+        report = self.report(run_info)
+        with open(report_file, 'w') as open_report_file:
+            json.dump(report, open_report_file, indent=2)
+        return report
+
+    def write_prometheus_textfile(self, textfile: str, run_info: dict = None):
+        """
+        Write the run report in the Prometheus text format, for use with the node exporter textfile collector.  The
+        file is replaced in one step so the collector never reads a partial file.
+        :param textfile: The path of the .prom file to write
+        :param run_info: Extra information about the run to include in the report
+        :return: None
+        """
+        report = self.report(run_info)
+        lines = ['# TYPE csv_importer_run_seconds gauge',
+                 'csv_importer_run_seconds {}'.format(report['elapsed_seconds']),
+                 '# TYPE csv_importer_rows_per_second gauge',
+                 'csv_importer_rows_per_second {}'.format(report['rows_per_second'] or 0),
+                 '# TYPE csv_importer_rows gauge']
+        for key in ('rows_read', 'posted', 'failed', 'skipped_existing', 'skipped_journaled', 'skipped_unchanged',
+                    'duplicates', 'removed', 'unresolved', 'retried', 'dead_lettered'):
+            if key in report:
+                lines.append('csv_importer_rows{{result="{}"}} {}'.format(key, report[key]))
+        lines.append('# TYPE csv_importer_phase_seconds gauge')
+        for phase_name, seconds in report['phase_seconds'].items():
+            lines.append('csv_importer_phase_seconds{{phase="{}"}} {}'.format(phase_name, seconds))
+        lines.append('# TYPE csv_importer_api_calls gauge')
+        for endpoint, endpoint_report in report['api_calls'].items():
+            lines.append('csv_importer_api_calls{{endpoint="{}"}} {}'.format(endpoint, endpoint_report['calls']))
+            lines.append('csv_importer_api_errors{{endpoint="{}"}} {}'.format(endpoint, endpoint_report['errors']))
+        lines.append('# TYPE csv_importer_api_latency_seconds summary')
+        for endpoint, endpoint_report in report['api_calls'].items():
+            for percentile in LATENCY_PERCENTILES:
+                lines.append('csv_importer_api_latency_seconds{{endpoint="{}",quantile="{}"}} {}'.format(
+                    endpoint, percentile / 100, endpoint_report['p{}_seconds'.format(percentile)]))
+        lines.append('# TYPE csv_importer_lookups gauge')
+        for table_name, lookup_report in report['lookups'].items():
+            lines.append('csv_importer_lookups{{table="{}",result="hit"}} {}'.format(table_name,
+                                                                                    lookup_report['hits']))
+            lines.append('csv_importer_lookups{{table="{}",result="miss"}} {}'.format(table_name,
+                                                                                     lookup_report['misses']))
+
+        temporary_file = textfile + '.tmp'
+        with open(temporary_file, 'w') as open_textfile:
+            open_textfile.write('\n'.join(lines) + '\n')
+        os.replace(temporary_file, textfile)
+
+    @staticmethod
+    def _percentile(sorted_values, percentile):
+        """
+        :return: the nearest rank percentile of a sorted list of values.
+        """
+        rank = max(0, int(round(percentile / 100 * len(sorted_values))) - 1)
+        return sorted_values[min(rank, len(sorted_values) - 1)]
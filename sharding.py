@@ -0,0 +1,149 @@
+"""
+This file contains the helpers used to split an import across several worker processes (or machines sharing a file
+system), and to merge the results of the workers back together.
+"""
+
+import csv
+import json
+import logging
+import os
+import sys
+import zlib
+
+sharding_logger = logging.getLogger('sharding')
+
+
+def shard_of(source_value, shard_count: int):
+    """
+    Pick the shard a row belongs to from its source value.  The hash is stable between runs, processes and machines,
+    so every worker agrees on which rows are its own.
+    :param source_value: The source value of the row, as read from the CSV file
+    :param shard_count: The number of shards
+    :return: The index of the shard, from 0 to shard_count - 1.
+    """
+    return zlib.crc32((source_value or '').encode('utf-8')) % shard_count
+
+
+def shard_path(path: str, shard_index: int, shard_count: int):
+    """
+    Build the path of a file that belongs to one shard, so shards never write to the same file.
+    :param path: The path used when the import is not sharded
+    :param shard_index: The index of the shard
+    :param shard_count: The number of shards
+    :return: The path with _shard_<index>_of_<count> added before the file extension, or added as a sub directory if
+    the path is a directory.
+    """
+    shard_name = 'shard_{}_of_{}'.format(shard_index, shard_count)
+    if path.endswith(('/', os.sep)) or os.path.isdir(path):
+        return os.path.join(path, shard_name)
+    root, extension = os.path.splitext(path)
+    return '{}_{}{}'.format(root, shard_name, extension)
+
+
+def run_shards(script: str, shard_count: int, worker_args: list):
+    """
+    Run one worker process per shard on this machine and wait for all of them to finish.
+    :param script: The path of the importer script
+    :param shard_count: The number of shards
+    :param worker_args: Extra command line arguments to pass to every worker
+    :return: A list with the exit code of each worker.
+    """
+    # subprocess is only imported by the coordinator, workers and unsharded runs never need it.
+    import subprocess
+    workers = []
+    for shard_index in range(shard_count):
+        command = [sys.executable, script, '--shard-count', str(shard_count), '--shard-index', str(shard_index)]
+        workers.append(subprocess.Popen(command + worker_args))
+    sharding_logger.info('Started {} shard workers.'.format(shard_count))
+
+    exit_codes = []
+    for shard_index, worker in enumerate(workers):
+        exit_codes.append(worker.wait())
+        if exit_codes[-1] != 0:
+            sharding_logger.error('Shard {} of {} exited with code {}'.format(shard_index, shard_count,
+                                                                             exit_codes[-1]))
+    return exit_codes
+
+
+def merge_shard_reports(report_files: list):
+    """
+    Merge the run reports written by each shard into one report.  Counts are added up, the run takes as long as the
+    slowest shard, and the summaries of each CSV file are merged across shards.  Latency percentiles can not be merged,
+    so the report of each shard is kept under 'shards'.
+    :param report_files: The paths of the shard run reports
+    :return: A dictionary that can be written as JSON.
+    """
+    merged = {'shards': [], 'files': {}, 'api_calls': {}}
+    for report_file in report_files:
+        if not os.path.exists(report_file):
+            sharding_logger.error('Missing shard report {}, its rows are not in the merged report.'.format(report_file))
+            merged['missing_shard_reports'] = merged.get('missing_shard_reports', 0) + 1
+            continue
+        with open(report_file) as open_report_file:
+            report = json.load(open_report_file)
+        merged['shards'].append(report)
+
+        # Add up the totals.
+        for key, value in report.items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                merged[key] = merged.get(key, 0) + value
+        merged['elapsed_seconds'] = max(merged.get('elapsed_seconds', 0), report.get('elapsed_seconds', 0))
+
+        # Add up the summary of each file.
+        for file_summary in report.get('files', []):
+            merged_summary = merged['files'].setdefault(file_summary['csv_file'], {'csv_file': file_summary['csv_file']})
+            for key, value in file_summary.items():
+                if isinstance(value, int) and not isinstance(value, bool):
+                    merged_summary[key] = merged_summary.get(key, 0) + value
+                elif key == 'error':
+                    # Keep the key of an unmerged summary, so a file that failed in any shard is counted as failed.
+                    merged_summary[key] = '{}; {}'.format(merged_summary[key], value) if key in merged_summary \
+                        else value
+
+        # Add up the API calls.
+        for endpoint, endpoint_report in report.get('api_calls', {}).items():
+            merged_endpoint = merged['api_calls'].setdefault(endpoint, {'calls': 0, 'errors': 0, 'total_seconds': 0.0})
+            merged_endpoint['calls'] += endpoint_report['calls']
+            merged_endpoint['errors'] += endpoint_report['errors']
+            merged_endpoint['total_seconds'] += endpoint_report['mean_seconds'] * endpoint_report['calls']
+
+    for merged_endpoint in merged['api_calls'].values():
+        total_seconds = merged_endpoint.pop('total_seconds')
+        merged_endpoint['mean_seconds'] = round(total_seconds / merged_endpoint['calls'], 6) \
+            if merged_endpoint['calls'] else None
+    merged['files'] = list(merged['files'].values())
+    rows_read = merged.get('rows_read')
+    elapsed = merged.get('elapsed_seconds')
+    merged['rows_per_second'] = round(rows_read / elapsed, 1) if rows_read and elapsed else None
+    return merged
+
+
+def merge_shard_journals(journal_files: list, merged_journal_file: str):
+    """
+    Merge the import journals written by each shard into one journal, which can then be used to --resume the import
+    without sharding.
+    :param journal_files: The paths of the shard journals
+    :param merged_journal_file: The path of the merged journal to write
+    :return: The number of journal rows merged.
+    """
+    row_count = 0
+    with open(merged_journal_file, 'w', newline='', encoding='utf-8') as merged_journal:
+        journal_writer = csv.writer(merged_journal)
+        header_written = False
+        for journal_file in journal_files:
+            if not os.path.exists(journal_file):
+                continue
+            with open(journal_file, newline='', encoding='utf-8') as shard_journal:
+                journal_reader = csv.reader(shard_journal)
+                header = next(journal_reader, None)
+                if header is not None and not header_written:
+                    journal_writer.writerow(header)
+                    header_written = True
+                for journal_row in journal_reader:
+                    # Rows left partly written by a crash have no relationship id.
+                    if len(journal_row) in (3, 4) and journal_row[2]:
+                        journal_writer.writerow(journal_row)
+                        row_count += 1
+    sharding_logger.info('Merged {} journal rows from {} shards into {}'.format(row_count, len(journal_files),
+                                                                                merged_journal_file))
+    return row_count
@@ -0,0 +1,9 @@
+"""
+Shared setup for the tests: the importer modules live at the top of the repository.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,111 @@
+"""
+This file contains a stub of the JamaClient calls made by the importer, so the importer can be tested without a server,
+and a helper to write the CSV files the tests import.
+"""
+
+import re
+import threading
+
+RELATIONSHIP_TYPES = [
+    {'id': 4, 'name': 'Related to', 'isDefault': True},
+    {'id': 5, 'name': 'Derived from', 'isDefault': False},
+]
+
+# Matches each value in a lucene query built by the importer: "field: "value""
+LUCENE_VALUE_PATTERN = re.compile(r'"([^":]+): "(.*?)""')
+
+
+def write_csv(path, rows, headers=None):
+    """
+    Write a CSV file for the importer to read.
+    :param path: The path of the file to write
+    :param rows: The rows to write, each a tuple of column values
+    :param headers: The header row, defaults to Source and Target, and Type when the rows have a third column
+    :return: the path of the file as a string.
+    """
+    if headers is None:
+        headers = ['Source', 'Target', 'Type'][:len(rows[0]) if rows else 2]
+    with open(path, 'w') as csv_file:
+        csv_file.write(','.join(headers) + '\n')
+        for row in rows:
+            csv_file.write(','.join(row) + '\n')
+    return str(path)
+
+
+def make_item(item_id, field_values, project=1):
+    """
+    :return: an item object as returned by the API, with the given custom field values.
+    """
+    return {'id': item_id, 'project': project, 'itemType': 89,
+            'fields': {'{}$89'.format(field_name): value for field_name, value in field_values.items()}}
+
+
+class StubJamaClient:
+    """
+    Answers the calls the importer makes from a list of items, and records every relationship posted.  Searches match
+    values ignoring case, like a Jama phrase search does.
+    """
+
+    def __init__(self, items=None, existing_relationships=None):
+        """
+        :param items: The items on the stub server, see make_item
+        :param existing_relationships: Relationship objects returned by get_relationships
+        """
+        self.items = items or []
+        self.existing_relationships = existing_relationships or []
+        self.posts = []
+        self.calls = {}
+        self.lookup_error = None  # Raised by get_abstract_items when set, or a function called with the query
+        self.post_error = None  # Raised by post_relationship when set, or a function called with the post
+        self._lock = threading.Lock()
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def get_available_endpoints(self):
+        self._count('get_available_endpoints')
+        return ['abstractitems', 'relationships', 'relationshiptypes']
+
+    def get_relationship_types(self):
+        self._count('get_relationship_types')
+        return list(RELATIONSHIP_TYPES)
+
+    def get_relationships(self, project_id):
+        self._count('get_relationships')
+        return list(self.existing_relationships)
+
+    def get_items_downstream_relationships(self, item_id):
+        self._count('get_items_downstream_relationships')
+        with self._lock:
+            posted = [{'id': relationship_id, 'fromItem': from_item, 'toItem': to_item,
+                       'relationshipType': relationship_type}
+                      for relationship_id, (from_item, to_item, relationship_type) in enumerate(self.posts, 1)]
+        return [relationship for relationship in self.existing_relationships + posted
+                if str(relationship['fromItem']) == str(item_id)]
+
+    def get_abstract_items(self, project=None, contains=None, **kwargs):
+        self._count('get_abstract_items')
+        if callable(self.lookup_error):
+            self.lookup_error(contains)
+        elif self.lookup_error is not None:
+            raise self.lookup_error
+        if contains is None:
+            return list(self.items)
+        matches = []
+        for field_name, value in LUCENE_VALUE_PATTERN.findall(contains):
+            for item in self.items:
+                item_value = item['fields'].get('{}$89'.format(field_name))
+                if item_value is not None and item_value.casefold() == value.casefold() and item not in matches:
+                    matches.append(item)
+        return matches
+
+    def post_relationship(self, from_item, to_item, relationship_type=None):
+        self._count('post_relationship')
+        if callable(self.post_error):
+            self.post_error(from_item, to_item, relationship_type)
+        elif self.post_error is not None:
+            raise self.post_error
+        with self._lock:
+            self.posts.append((from_item, to_item, relationship_type))
+            return len(self.posts)
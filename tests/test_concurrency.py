@@ -0,0 +1,122 @@
+"""
+Tests for the parts of the importer that run on several threads: shared lookups, the post pool, the retry queue and
+the rate controller.
+"""
+
+import threading
+import time
+
+from py_jama_rest_client.client import APIException
+
+from csv_relationship_importer import CSVRelationshipImporter
+from rate_control import AdaptiveRateController
+from retry_queue import RetryQueue
+from stub_client import StubJamaClient, make_item, write_csv
+
+
+class SlowStubJamaClient(StubJamaClient):
+    """
+    A stub whose calls take a moment, and which records the largest number of posts in flight at once.
+    """
+
+    def __init__(self, items=None, delay_seconds=0.01):
+        super().__init__(items)
+        self.delay_seconds = delay_seconds
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get_abstract_items(self, project=None, contains=None, **kwargs):
+        time.sleep(self.delay_seconds)
+        return super().get_abstract_items(project, contains, **kwargs)
+
+    def post_relationship(self, from_item, to_item, relationship_type=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay_seconds)
+        try:
+            return super().post_relationship(from_item, to_item, relationship_type)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_values_shared_by_many_rows_are_searched_for_once(tmp_path):
+    client = SlowStubJamaClient([make_item(item_id, {'legacy_id': 'REQ-{}'.format(item_id)})
+                                 for item_id in range(1, 5)])
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-{}'.format(row % 2 + 1), 'REQ-{}'.format(row % 2 + 3))
+                                                 for row in range(40)])
+    importer = CSVRelationshipImporter(client)
+
+    importer.load_csv_data(csv_file, True, [], 'Source', 'Target', None)
+    importer.process_relationships(True, [1], [1], 'legacy_id', 'legacy_id', 4, lookup_workers=8)
+
+    assert len(importer.prepped_relationship_data) == 40
+    assert client.calls['get_abstract_items'] == 4
+
+
+def test_posts_never_exceed_max_in_flight(tmp_path):
+    client = SlowStubJamaClient()
+    csv_file = write_csv(tmp_path / 'rows.csv', [(str(row), str(row + 1000)) for row in range(1, 41)])
+    importer = CSVRelationshipImporter(client)
+
+    importer.load_csv_data(csv_file, True, [], 'Source', 'Target', None)
+    importer.process_relationships(False, [], [], None, None, 4)
+    importer.post_relationships(max_in_flight=4)
+
+    assert len(client.posts) == 40
+    assert 1 < client.max_in_flight <= 4
+
+
+def test_retry_queue_hands_out_items_when_due_with_growing_backoff():
+    retry_queue = RetryQueue(backoff_seconds=0.02, max_backoff_seconds=0.04)
+
+    first_delay = retry_queue.push('first', 1)
+    third_delay = retry_queue.push('third', 3)
+
+    assert 0.01 <= first_delay <= 0.02
+    assert 0.02 <= third_delay <= 0.04
+    assert retry_queue.pop_due() is None
+    time.sleep(first_delay)
+    assert retry_queue.pop_due() == ('first', 1)
+    time.sleep(retry_queue.seconds_until_due())
+    assert retry_queue.pop_due() == ('third', 3)
+    assert retry_queue.seconds_until_due() is None
+
+
+def test_rate_controller_retries_throttled_calls_and_backs_off():
+    rate_controller = AdaptiveRateController(initial_concurrency=8, backoff_seconds=0, max_retries=2)
+    attempts = []
+
+    def throttled_twice():
+        attempts.append(len(attempts))
+        if len(attempts) <= 2:
+            raise APIException('too many requests', status_code=429)
+        return 'done'
+
+    assert rate_controller.call(throttled_twice) == 'done'
+    assert len(attempts) == 3
+    assert rate_controller.concurrency_limit == 2
+    assert rate_controller.throttled_call_count == 2
+
+
+def test_rate_controller_never_exceeds_its_limit():
+    rate_controller = AdaptiveRateController(initial_concurrency=3, max_concurrency=3)
+    lock = threading.Lock()
+    counts = {'in_flight': 0, 'max_in_flight': 0}
+
+    def call():
+        with lock:
+            counts['in_flight'] += 1
+            counts['max_in_flight'] = max(counts['max_in_flight'], counts['in_flight'])
+        time.sleep(0.01)
+        with lock:
+            counts['in_flight'] -= 1
+
+    threads = [threading.Thread(target=rate_controller.call, args=(call,)) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counts['max_in_flight'] == 3
@@ -0,0 +1,38 @@
+"""
+Tests for reading the rows of a CSV file.
+"""
+
+import pytest
+
+from csv_relationship_importer import CSVRelationshipImporter
+from stub_client import StubJamaClient, write_csv
+
+
+def test_columns_are_read_by_name_in_any_order(tmp_path):
+    csv_file = write_csv(tmp_path / 'rows.csv', [('a note', '2', '1', 'Derived from')],
+                         headers=['Note', 'Target', 'Source', 'Type'])
+    importer = CSVRelationshipImporter(StubJamaClient())
+
+    importer.load_csv_data(csv_file, True, [], 'Source', 'Target', 'Type')
+
+    row, = importer.raw_relationship_data
+    assert (row.row_number, row.source_data, row.target_data, row.rel_type_data) == (0, '1', '2', 'Derived from')
+    # Rows are slotted, they carry no per row dictionary.
+    assert not hasattr(row, '__dict__')
+
+
+def test_repeated_values_share_one_string(tmp_path):
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'REQ-2'), ('REQ-1', 'REQ-3')])
+    importer = CSVRelationshipImporter(StubJamaClient())
+
+    importer.load_csv_data(csv_file, True, [], 'Source', 'Target', None)
+
+    first_row, second_row = importer.raw_relationship_data
+    assert first_row.source_data is second_row.source_data
+
+
+def test_missing_column_is_reported(tmp_path):
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'REQ-2')], headers=['From', 'Target'])
+
+    with pytest.raises(ValueError):
+        CSVRelationshipImporter(StubJamaClient()).load_csv_data(csv_file, True, [], 'Source', 'Target', None)
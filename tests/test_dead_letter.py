@@ -0,0 +1,75 @@
+"""
+Tests for the dead-letter files that collect the rows an import could not create.
+"""
+
+import csv
+
+import pytest
+
+from csv_relationship_importer import CSVRelationshipImporter
+from dead_letter import DeadLetterWriter
+from stub_client import StubJamaClient, make_item
+
+
+def read_rows(path):
+    with open(path, newline='') as csv_file:
+        return list(csv.reader(csv_file))
+
+
+def import_file(importer, csv_file, has_headers=True, headers=None):
+    importer.load_csv_data(csv_file, has_headers, headers, 'Source', 'Target', None)
+    importer.process_relationships(True, [1], [1], 'legacy_id', 'legacy_id', 4)
+    importer.post_relationships()
+
+
+def test_dead_letter_file_has_the_header_of_the_source_file(tmp_path):
+    csv_file = tmp_path / 'rows.csv'
+    csv_file.write_text('Source,Target\nREQ-1,REQ-2\nREQ-1,REQ-3\n')
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'}), make_item(2, {'legacy_id': 'REQ-2'})])
+    importer = CSVRelationshipImporter(client, dead_letter_directory=str(tmp_path / 'dead'))
+
+    import_file(importer, str(csv_file))
+
+    dead_letter_file, = (tmp_path / 'dead').glob('rows_*_dead_letter.csv')
+    assert read_rows(dead_letter_file) == [['Source', 'Target', 'reason'], ['REQ-1', 'REQ-3', 'target item not found']]
+
+
+def test_dead_letter_file_of_a_file_without_headers_can_be_imported_again(tmp_path):
+    headers = ['Name', 'Source', 'Target']
+    csv_file = tmp_path / 'rows.csv'
+    csv_file.write_text('a,REQ-1,REQ-2\nb,REQ-1,REQ-3\n')
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'}), make_item(2, {'legacy_id': 'REQ-2'})])
+    import_file(CSVRelationshipImporter(client, dead_letter_directory=str(tmp_path / 'dead')), str(csv_file),
+                False, headers)
+    dead_letter_file, = (tmp_path / 'dead').glob('rows_*_dead_letter.csv')
+    assert read_rows(dead_letter_file) == [['', 'REQ-1', 'REQ-3', 'target item not found']]
+
+    client.items.append(make_item(3, {'legacy_id': 'REQ-3'}))
+    import_file(CSVRelationshipImporter(client), str(dead_letter_file), False, headers)
+
+    assert client.posts == [(1, 2, 4), (1, 3, 4)]
+
+
+def test_dead_letter_file_is_closed_when_posting_stops(tmp_path):
+    csv_file = tmp_path / 'rows.csv'
+    csv_file.write_text('Source,Target\nREQ-1,REQ-2\nREQ-1,REQ-3\n')
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'}), make_item(2, {'legacy_id': 'REQ-2'})])
+    client.post_error = RuntimeError('unexpected')
+    importer = CSVRelationshipImporter(client, dead_letter_directory=str(tmp_path / 'dead'))
+
+    with pytest.raises(RuntimeError):
+        import_file(importer, str(csv_file))
+
+    dead_letter_file, = (tmp_path / 'dead').glob('rows_*_dead_letter.csv')
+    assert read_rows(dead_letter_file)[1:] == [['REQ-1', 'REQ-3', 'target item not found']]
+
+
+def test_rows_written_after_close_are_added_to_the_file(tmp_path):
+    dead_letter_file = tmp_path / 'dead_letter.csv'
+    with DeadLetterWriter(str(dead_letter_file), ['Source', 'Target']) as dead_letter:
+        dead_letter.write(['1', '2'], 'post failed')
+    dead_letter.write(['3', '4'], 'lookup failed')
+    dead_letter.close()
+
+    assert read_rows(dead_letter_file) == [['Source', 'Target', 'reason'], ['1', '2', 'post failed'],
+                                           ['3', '4', 'lookup failed']]
@@ -0,0 +1,35 @@
+"""
+Tests for the watcher that finds csv files dropped into csv_location.
+"""
+
+import os
+import time
+
+from directory_watcher import DirectoryWatcher
+
+
+def test_files_are_handed_out_once_they_stop_changing(tmp_path):
+    (tmp_path / 'old.csv').write_text('Source,Target\n')
+    watcher = DirectoryWatcher(str(tmp_path), stable_seconds=0.05)
+    new_file = tmp_path / 'new.csv'
+    new_file.write_text('Source,Target\n')
+
+    assert watcher.poll() == []
+    time.sleep(0.06)
+    new_file.write_text('Source,Target\n1,2\n')
+    assert watcher.poll() == []
+    time.sleep(0.06)
+    assert watcher.poll() == [str(new_file)]
+    assert watcher.poll() == []
+
+
+def test_deleted_files_are_handed_out_again_when_they_come_back(tmp_path):
+    csv_file = tmp_path / 'rows.csv'
+    csv_file.write_text('Source,Target\n')
+    watcher = DirectoryWatcher(str(tmp_path), stable_seconds=0, include_existing=True)
+
+    assert watcher.poll() == [str(csv_file)]
+    os.remove(csv_file)
+    assert watcher.poll() == []
+    csv_file.write_text('Source,Target\n')
+    assert watcher.poll() == [str(csv_file)]
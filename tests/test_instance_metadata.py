@@ -0,0 +1,47 @@
+"""
+Tests for the cache of credentials checks and relationship types shared by runs started one after the other.
+"""
+
+import config
+import jama_api
+import project_utils
+from instance_metadata import InstanceMetadataCache
+from stub_client import StubJamaClient
+
+
+def test_entries_are_kept_per_set_of_credentials(tmp_path):
+    cache_file = str(tmp_path / 'metadata.json')
+    cache = InstanceMetadataCache(cache_file, 60)
+    cache.use_instance('https://jama.example.com', 'user', 'old password')
+    cache.record_credentials_validated()
+
+    same_credentials = InstanceMetadataCache(cache_file, 60)
+    same_credentials.use_instance('https://jama.example.com', 'user', 'old password')
+    new_password = InstanceMetadataCache(cache_file, 60)
+    new_password.use_instance('https://jama.example.com', 'user', 'new password')
+
+    assert same_credentials.credentials_recently_validated()
+    assert not new_password.credentials_recently_validated()
+    with open(cache_file) as open_cache_file:
+        assert 'password' not in open_cache_file.read()
+
+
+def test_changed_password_is_checked_by_init_jama_client(tmp_path, monkeypatch):
+    clients = []
+
+    def new_client(instance_url, credentials, oauth):
+        clients.append(StubJamaClient())
+        return clients[-1]
+
+    monkeypatch.setattr(jama_api, 'JamaClient', new_client, raising=False)
+    monkeypatch.setattr(config, 'use_pooled_transport', False)
+    monkeypatch.setattr(config, 'oauth', False)
+    monkeypatch.setattr(config, 'base_url', 'https://jama.example.com')
+    monkeypatch.setattr(config, 'username', 'user')
+    cache = InstanceMetadataCache(str(tmp_path / 'metadata.json'), 60)
+
+    for password in ('old password', 'old password', 'new password'):
+        monkeypatch.setattr(config, 'password', password)
+        project_utils.init_jama_client(cache)
+
+    assert [client.calls.get('get_available_endpoints', 0) for client in clients] == [1, 0, 1]
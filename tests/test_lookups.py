@@ -0,0 +1,160 @@
+"""
+Tests for looking up the items of each row by a custom field value.
+"""
+
+from py_jama_rest_client.client import APIException
+
+from csv_relationship_importer import CSVRelationshipImporter
+from lookup_cache import LookupCache
+from match_keys import MatchKey
+from stub_client import StubJamaClient, make_item, write_csv
+
+
+def prepare(importer, csv_file, lookup_batch_size=1, lookup_workers=1, prefetch_index=False):
+    importer.load_csv_data(csv_file, True, [], 'Source', 'Target', None)
+    importer.process_relationships(True, [1], [1], 'legacy_id', 'legacy_id', 4, prefetch_index=prefetch_index,
+                                   lookup_batch_size=lookup_batch_size, lookup_workers=lookup_workers)
+    return {(relationship.from_item, relationship.to_item) for relationship in importer.prepped_relationship_data}
+
+
+def test_batched_lookup_falls_back_when_hits_differ_in_case(tmp_path):
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'}), make_item(2, {'legacy_id': 'REQ-2'})])
+    csv_file = write_csv(tmp_path / 'rows.csv', [('req-1', 'REQ-2')])
+
+    assert prepare(CSVRelationshipImporter(client), csv_file, lookup_batch_size=50) == {(1, 2)}
+
+
+def test_batched_lookup_reports_misses_and_ambiguous_values(tmp_path):
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'}), make_item(2, {'legacy_id': 'REQ-2'}),
+                                   make_item(3, {'legacy_id': 'REQ-2'})])
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'REQ-2'), ('REQ-1', 'REQ-3')])
+    importer = CSVRelationshipImporter(client)
+
+    assert prepare(importer, csv_file, lookup_batch_size=50) == set()
+    assert importer.unresolved_count == 2
+    # One search for the source values and one for the target values.
+    assert client.calls['get_abstract_items'] == 2
+
+
+def numbered_items(item_count):
+    return [make_item(item_id, {'legacy_id': 'REQ-{}'.format(item_id)}) for item_id in range(1, item_count + 1)]
+
+
+def test_prefetched_index_resolves_every_value_from_one_read(tmp_path):
+    client = StubJamaClient(items=numbered_items(4))
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'REQ-2'), ('REQ-3', 'REQ-4'), ('REQ-1', 'REQ-5')])
+    importer = CSVRelationshipImporter(client)
+
+    assert prepare(importer, csv_file, prefetch_index=True) == {(1, 2), (3, 4)}
+    assert importer.unresolved_count == 1
+    # Source and target share the projects and field, so one table is read once.
+    assert client.calls['get_abstract_items'] == 1
+
+
+def test_lookup_cache_is_used_by_the_next_run(tmp_path):
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'REQ-2'), ('REQ-1', 'REQ-3')])
+    calls = []
+    for _ in range(2):
+        client = StubJamaClient(items=numbered_items(2))
+        lookup_cache = LookupCache(str(tmp_path / 'cache.sqlite'), 'https://jama.example.com', 3600)
+        assert prepare(CSVRelationshipImporter(client, lookup_cache=lookup_cache), csv_file) == {(1, 2)}
+        lookup_cache.close()
+        calls.append((client.calls.get('get_abstract_items', 0), client.calls.get('get_relationship_types', 0)))
+
+    # The miss on REQ-3 is cached as well, so the second run makes no calls at all.
+    assert calls == [(3, 1), (0, 0)]
+
+
+def test_lookups_on_several_workers_prepare_the_same_relationships(tmp_path):
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-{}'.format(row % 5 + 1), 'REQ-{}'.format(row % 7 + 1))
+                                                 for row in range(30)])
+    single_threaded = CSVRelationshipImporter(StubJamaClient(items=numbered_items(6)))
+    expected = prepare(single_threaded, csv_file)
+
+    for lookup_batch_size in (1, 3):
+        importer = CSVRelationshipImporter(StubJamaClient(items=numbered_items(6)))
+        assert prepare(importer, csv_file, lookup_batch_size=lookup_batch_size, lookup_workers=4) == expected
+        assert len(importer.prepped_relationship_data) == len(single_threaded.prepped_relationship_data)
+        # REQ-7 is not on the server, rows targeting it are unresolved whichever thread looks it up.
+        assert importer.unresolved_count == single_threaded.unresolved_count > 0
+
+
+def test_rows_are_matched_on_every_field_of_a_composite_key(tmp_path):
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1', 'system': 'A'}),
+                                   make_item(2, {'legacy_id': 'REQ-1', 'system': 'B'}),
+                                   make_item(3, {'legacy_id': 'REQ-2', 'system': 'A'})])
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'B', 'REQ-2', 'A'), ('REQ-1', 'C', 'REQ-2', 'A')],
+                         headers=['Source', 'Source system', 'Target', 'Target system'])
+    importer = CSVRelationshipImporter(client,
+                                       source_match_key=MatchKey([('Source', 'legacy_id'),
+                                                                  ('Source system', 'system')]),
+                                       target_match_key=MatchKey([('Target', 'legacy_id'),
+                                                                  ('Target system', 'system')]))
+
+    assert prepare(importer, csv_file) == {(2, 3)}
+    assert importer.unresolved_count == 1
+
+
+def test_normalized_keys_ignore_case_and_spacing(tmp_path):
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'}), make_item(2, {'legacy_id': 'Req  2'})])
+    csv_file = write_csv(tmp_path / 'rows.csv', [(' req-1', 'REQ 2 ')])
+    importer = CSVRelationshipImporter(client,
+                                       source_match_key=MatchKey([('Source', 'legacy_id')], normalize=True),
+                                       target_match_key=MatchKey([('Target', 'legacy_id')], normalize=True))
+
+    assert prepare(importer, csv_file) == {(1, 2)}
+
+
+def fail_first_lookups(client, count, status_code=500):
+    """
+    Make the first searches fail with a server error.
+    """
+    failures = []
+
+    def lookup_error(contains):
+        if len(failures) < count:
+            failures.append(contains)
+            raise APIException('server error', status_code=status_code)
+
+    client.lookup_error = lookup_error
+    return failures
+
+
+def new_importer(client, dead_letter_directory=None):
+    return CSVRelationshipImporter(client, post_max_retries=2, post_retry_backoff_seconds=0,
+                                   dead_letter_directory=dead_letter_directory)
+
+
+def test_lookups_that_fail_with_a_server_error_are_retried(tmp_path):
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'}), make_item(2, {'legacy_id': 'REQ-2'})])
+    failures = fail_first_lookups(client, 2)
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'REQ-2')])
+
+    assert prepare(new_importer(client), csv_file) == {(1, 2)}
+    assert len(failures) == 2
+
+
+def test_rows_whose_lookup_keeps_failing_are_dead_lettered(tmp_path):
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'}), make_item(2, {'legacy_id': 'REQ-2'})])
+    fail_first_lookups(client, 3)
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'REQ-2'), ('REQ-2', 'REQ-1')])
+    importer = new_importer(client, str(tmp_path))
+
+    prepared = prepare(importer, csv_file)
+    importer.post_relationships()
+
+    assert prepared == {(2, 1)}
+    assert importer.unresolved_count == 1
+    dead_letter_file, = tmp_path.glob('*_dead_letter.csv')
+    assert 'lookup failed' in dead_letter_file.read_text()
+
+
+def test_lookups_failing_with_a_client_error_are_not_retried(tmp_path):
+    client = StubJamaClient(items=[make_item(1, {'legacy_id': 'REQ-1'})])
+    failures = fail_first_lookups(client, 1, status_code=400)
+    csv_file = write_csv(tmp_path / 'rows.csv', [('REQ-1', 'REQ-1')])
+    importer = new_importer(client)
+
+    assert prepare(importer, csv_file) == set()
+    assert len(failures) == 1
+    assert importer.unresolved_count == 1
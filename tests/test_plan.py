@@ -0,0 +1,79 @@
+"""
+Tests for the runtime estimate made by --plan.
+"""
+
+import time
+
+import config
+from csv_relationship_importer import CSVRelationshipImporter, estimate_run
+from lookup_cache import LookupCache
+from stub_client import StubJamaClient, make_item, write_csv
+
+
+class SlowSearchStubJamaClient(StubJamaClient):
+    """
+    A stub server whose item searches take much longer than its other calls, like paged searches on a real server.
+    """
+
+    def get_abstract_items(self, project=None, contains=None, **kwargs):
+        time.sleep(0.02)
+        return super().get_abstract_items(project=project, contains=contains, **kwargs)
+
+
+def plan(importer, tmp_path, rows, prefetch_index=False):
+    importer.load_csv_data(write_csv(tmp_path / 'rows.csv', rows), True, [], 'Source', 'Target', None)
+    importer.process_relationships(True, [1], [1], 'legacy_id', 'legacy_id', 4, prefetch_index=prefetch_index)
+    return estimate_run([importer.get_plan()], importer)
+
+
+def new_client():
+    return SlowSearchStubJamaClient([make_item(item_id, {'legacy_id': 'REQ-{}'.format(item_id)})
+                                     for item_id in range(1, 5)])
+
+
+def test_posts_are_estimated_from_the_configured_post_latency(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'plan_post_latency_seconds', 0.5)
+    monkeypatch.setattr(config, 'max_concurrent_posts', 2)
+    client = new_client()
+
+    estimate = plan(CSVRelationshipImporter(client), tmp_path, [('REQ-1', 'REQ-2'), ('REQ-3', 'REQ-4')])
+
+    assert estimate['projected_posts'] == 2
+    assert estimate['post_latency_source'] == 'plan_post_latency_seconds'
+    assert estimate['estimated_post_seconds'] == 0.5
+    assert client.posts == []
+
+
+def test_post_latency_is_not_taken_from_item_searches(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'plan_post_latency_seconds', None)
+
+    estimate = plan(CSVRelationshipImporter(new_client()), tmp_path, [('REQ-1', 'REQ-2'), ('REQ-3', 'REQ-4')])
+
+    assert estimate['post_latency_source'] == 'get_relationship_types'
+    assert estimate['post_latency_seconds'] < 0.02
+
+
+def test_lookups_are_discounted_for_searches_kept_in_the_lookup_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'plan_post_latency_seconds', 0.1)
+    monkeypatch.setattr(config, 'lookup_workers', 1)
+    lookup_cache = LookupCache(str(tmp_path / 'cache.sqlite'), 'https://jama.example.com', 3600)
+    importer = CSVRelationshipImporter(new_client(), lookup_cache=lookup_cache)
+
+    estimate = plan(importer, tmp_path, [('REQ-1', 'REQ-2'), ('REQ-3', 'REQ-4')])
+    lookup_cache.close()
+
+    assert (estimate['searched_values'], estimate['cached_search_results']) == (4, 4)
+    assert estimate['estimated_lookup_seconds'] < importer.metrics.report()['phase_seconds']['lookup']
+
+
+def test_lookups_are_not_discounted_when_the_index_is_prefetched(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'plan_post_latency_seconds', 0.1)
+    lookup_cache = LookupCache(str(tmp_path / 'cache.sqlite'), 'https://jama.example.com', 3600)
+    importer = CSVRelationshipImporter(new_client(), lookup_cache=lookup_cache)
+
+    estimate = plan(importer, tmp_path, [('REQ-1', 'REQ-2'), ('REQ-3', 'REQ-4')], prefetch_index=True)
+    lookup_cache.close()
+
+    assert estimate['cached_search_results'] == 0
+    assert estimate['estimated_lookup_seconds'] == round(importer.metrics.report()['phase_seconds']['lookup'], 2)
+    assert estimate['estimated_lookup_seconds'] > 0
@@ -0,0 +1,100 @@
+"""
+Tests for posting relationships: retries, and making sure no relationship is created twice.
+"""
+
+import requests
+from py_jama_rest_client.client import APIException
+
+from csv_relationship_importer import CSVRelationshipImporter
+from rate_control import AdaptiveRateController
+from stub_client import StubJamaClient, write_csv
+
+
+def numbered_rows(row_count):
+    return [(str(row + 1), str(row + 1001)) for row in range(row_count)]
+
+
+def new_importer(client, rate_controlled=True):
+    rate_controller = AdaptiveRateController(backoff_seconds=0) if rate_controlled else None
+    return CSVRelationshipImporter(client, rate_controller=rate_controller, post_max_retries=3,
+                                   post_retry_backoff_seconds=0, post_retry_max_backoff_seconds=0)
+
+
+def import_file(importer, csv_file, max_in_flight=1):
+    importer.load_csv_data(csv_file, True, [], 'Source', 'Target', None)
+    importer.process_relationships(False, [], [], None, None, 4)
+    importer.post_relationships(max_in_flight)
+    return importer.get_summary()
+
+
+def fail_first_posts(client, error, count=1, created=False):
+    """
+    Make the first posts fail with an error, after the stub server created the relationship when created is True.
+    """
+    failures = []
+
+    def post_error(from_item, to_item, relationship_type):
+        if len(failures) < count:
+            failures.append(from_item)
+            if created:
+                client.posts.append((from_item, to_item, relationship_type))
+            raise error
+
+    client.post_error = post_error
+    return failures
+
+
+def test_read_timeout_after_the_post_was_created_is_not_posted_again(tmp_path):
+    client = StubJamaClient()
+    fail_first_posts(client, requests.exceptions.ReadTimeout('read timed out'), created=True)
+
+    summary = import_file(new_importer(client), write_csv(tmp_path / 'rows.csv', numbered_rows(3)))
+
+    assert sorted(client.posts) == [('1', '1001', 4), ('2', '1002', 4), ('3', '1003', 4)]
+    assert (summary['posted'], summary['failed'], summary['retried']) == (3, 0, 1)
+    assert client.calls['get_items_downstream_relationships'] == 1
+
+
+def test_read_timeout_before_the_post_was_created_is_posted_again(tmp_path):
+    client = StubJamaClient()
+    fail_first_posts(client, requests.exceptions.ReadTimeout('read timed out'))
+
+    summary = import_file(new_importer(client), write_csv(tmp_path / 'rows.csv', numbered_rows(3)))
+
+    assert len(client.posts) == 3
+    assert (summary['posted'], summary['failed']) == (3, 0)
+
+
+def test_connect_timeout_and_throttling_are_retried_without_checking(tmp_path):
+    client = StubJamaClient()
+    fail_first_posts(client, requests.exceptions.ConnectTimeout('connect timed out'))
+    importer = new_importer(client)
+    assert import_file(importer, write_csv(tmp_path / 'a.csv', numbered_rows(2)))['posted'] == 2
+
+    fail_first_posts(client, APIException('busy', status_code=503))
+    assert import_file(importer.spawn(), write_csv(tmp_path / 'b.csv', numbered_rows(2)))['posted'] == 2
+
+    assert len(client.posts) == 4
+    assert 'get_items_downstream_relationships' not in client.calls
+
+
+def test_client_errors_are_not_retried(tmp_path):
+    client = StubJamaClient()
+    failures = fail_first_posts(client, APIException('bad request', status_code=400))
+
+    summary = import_file(new_importer(client), write_csv(tmp_path / 'rows.csv', numbered_rows(2)))
+
+    assert failures == ['1']
+    assert (summary['posted'], summary['failed'], summary['retried']) == (1, 1, 0)
+
+
+def test_timeout_without_rate_control_fails_the_row(tmp_path):
+    client = StubJamaClient()
+    fail_first_posts(client, requests.exceptions.ReadTimeout('read timed out'), count=2)
+    importer = new_importer(client, rate_controlled=False)
+    importer.post_max_retries = 0
+
+    summary = import_file(importer, write_csv(tmp_path / 'rows.csv', numbered_rows(3)), max_in_flight=2)
+
+    assert len(client.posts) == 1
+    assert (summary['posted'], summary['failed']) == (1, 2)
@@ -0,0 +1,58 @@
+"""
+Tests for the run metrics collected during an import.
+"""
+
+from csv_relationship_importer import CSVRelationshipImporter
+from run_metrics import RunMetrics
+from stub_client import StubJamaClient, make_item
+
+
+def test_lookups_are_counted_per_role_when_source_and_target_share_a_table(tmp_path):
+    csv_file = tmp_path / 'rows.csv'
+    csv_file.write_text('Source,Target\nREQ-1,REQ-2\nREQ-1,REQ-3\nREQ-2,REQ-3\n')
+    client = StubJamaClient(items=[make_item(item_id, {'legacy_id': 'REQ-{}'.format(item_id)})
+                                   for item_id in range(1, 4)])
+    metrics = RunMetrics()
+    importer = CSVRelationshipImporter(client, metrics=metrics)
+
+    importer.prepare_lookups(True, [1], [1], 'legacy_id', 'legacy_id')
+    importer.load_csv_data(str(csv_file), True, [], 'Source', 'Target', None)
+    importer.process_relationships(True, [1], [1], 'legacy_id', 'legacy_id', 4)
+
+    assert importer.source_item_map is importer.target_item_map
+    # REQ-2 is found in the shared table when it is first used as a source value.
+    assert metrics.report()['lookups'] == {
+        'source_item_map': {'hits': 2, 'misses': 1, 'hit_ratio': 0.6667},
+        'target_item_map': {'hits': 1, 'misses': 2, 'hit_ratio': 0.3333},
+    }
+
+
+def test_report_has_latency_percentiles_by_endpoint():
+    metrics = RunMetrics()
+    timed_call = metrics.timed_api_call(StubJamaClient().get_relationship_types)
+    for _ in range(3):
+        timed_call()
+
+    endpoint_report = metrics.report({'rows_read': 3})['api_calls']['get_relationship_types']
+
+    assert endpoint_report['calls'] == 3
+    assert endpoint_report['errors'] == 0
+    assert endpoint_report['p50_seconds'] <= endpoint_report['p99_seconds']
+
+
+def test_prometheus_textfile_has_row_counts_phases_and_lookups(tmp_path):
+    metrics = RunMetrics()
+    metrics.record_lookup('source_item_map', True, 3)
+    metrics.record_lookup('source_item_map', False)
+    with metrics.phase('post'):
+        pass
+    textfile = tmp_path / 'importer.prom'
+
+    metrics.write_prometheus_textfile(str(textfile), {'rows_read': 4, 'posted': 3})
+
+    lines = textfile.read_text().splitlines()
+    assert 'csv_importer_rows{result="posted"} 3' in lines
+    assert 'csv_importer_lookups{table="source_item_map",result="hit"} 3' in lines
+    assert 'csv_importer_lookups{table="source_item_map",result="miss"} 1' in lines
+    assert any(line.startswith('csv_importer_phase_seconds{phase="post"} ') for line in lines)
+    assert not (tmp_path / 'importer.prom.tmp').exists()
@@ -0,0 +1,31 @@
+"""
+Tests for merging the reports of a sharded import.
+"""
+
+import json
+
+import sharding
+from csv_relationship_importer import aggregate_summaries
+
+
+def write_report(path, files):
+    with open(path, 'w') as report_file:
+        json.dump({'rows_read': sum(file.get('rows_read', 0) for file in files), 'elapsed_seconds': 1.0,
+                   'files': files, 'api_calls': {}}, report_file)
+    return str(path)
+
+
+def test_files_that_failed_in_a_shard_are_counted_as_failed(tmp_path):
+    report_files = [
+        write_report(tmp_path / 'shard_0.json', [{'csv_file': 'a.csv', 'rows_read': 2, 'posted': 2},
+                                                 {'csv_file': 'b.csv', 'error': 'lookup failed'}]),
+        write_report(tmp_path / 'shard_1.json', [{'csv_file': 'a.csv', 'rows_read': 3, 'posted': 3},
+                                                 {'csv_file': 'b.csv', 'error': 'timed out'}]),
+    ]
+
+    merged = sharding.merge_shard_reports(report_files)
+    totals = aggregate_summaries(merged['files'])
+
+    assert {file['csv_file']: file.get('error') for file in merged['files']} == \
+        {'a.csv': None, 'b.csv': 'lookup failed; timed out'}
+    assert (totals['posted'], totals['failed_files']) == (5, 1)
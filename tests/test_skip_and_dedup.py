@@ -0,0 +1,123 @@
+"""
+Tests for the rows the importer skips: duplicates, unchanged rows in the manifest, relationships already in Jama and
+journaled rows.
+"""
+
+from py_jama_rest_client.client import APIException
+
+from csv_relationship_importer import CSVRelationshipImporter
+from duplicate_filter import DuplicateFilter
+from import_journal import ImportJournal
+from import_manifest import ImportManifest
+from stub_client import StubJamaClient, write_csv
+
+
+def import_file(shared_importer, csv_file):
+    importer = shared_importer.spawn()
+    importer.load_csv_data(csv_file, True, [], 'Source', 'Target', 'Type')
+    importer.process_relationships(False, [], [], None, None, 4)
+    importer.post_relationships()
+    importer.save_manifest()
+    return importer.get_summary()
+
+
+def test_duplicates_are_dropped_within_and_across_files(tmp_path):
+    client = StubJamaClient()
+    shared_importer = CSVRelationshipImporter(client, duplicate_filter=DuplicateFilter())
+    file_a = write_csv(tmp_path / 'a.csv', [('1', '2', 'Related to'), ('1', '2', 'Related to'), ('3', '4', 'Related to')])
+    file_b = write_csv(tmp_path / 'b.csv', [('1', '2', 'Related to'), ('5', '6', 'Related to')])
+
+    assert import_file(shared_importer, file_a)['duplicates'] == 1
+    assert import_file(shared_importer, file_b)['duplicates'] == 1
+    assert sorted(client.posts) == [('1', '2', 'Related to'), ('3', '4', 'Related to'), ('5', '6', 'Related to')]
+
+
+def test_cross_file_duplicate_is_not_posted_again_on_the_next_run(tmp_path):
+    client = StubJamaClient()
+    manifest = ImportManifest(str(tmp_path / 'manifests'))
+    file_a = write_csv(tmp_path / 'a.csv', [('1', '2', 'Related to')])
+    file_b = write_csv(tmp_path / 'b.csv', [('1', '2', 'Related to')])
+
+    for _ in range(2):
+        shared_importer = CSVRelationshipImporter(client, manifest=manifest, duplicate_filter=DuplicateFilter())
+        import_file(shared_importer, file_a)
+        import_file(shared_importer, file_b)
+
+    assert client.posts == [('1', '2', 'Related to')]
+
+
+def test_manifest_skips_unchanged_rows_and_retries_failed_ones(tmp_path):
+    client = StubJamaClient()
+    manifest = ImportManifest(str(tmp_path / 'manifests'))
+    csv_file = write_csv(tmp_path / 'a.csv', [('1', '2', 'Related to'), ('3', '4', 'Related to')])
+
+    def fail_row_3(from_item, to_item, relationship_type):
+        if from_item == '3':
+            raise APIException('bad request', status_code=400)
+
+    client.post_error = fail_row_3
+    first_run = import_file(CSVRelationshipImporter(client, manifest=manifest), csv_file)
+    client.post_error = None
+    second_run = import_file(CSVRelationshipImporter(client, manifest=manifest), csv_file)
+
+    assert (first_run['posted'], first_run['failed']) == (1, 1)
+    assert (second_run['posted'], second_run['skipped_unchanged']) == (1, 1)
+    assert sorted(client.posts) == [('1', '2', 'Related to'), ('3', '4', 'Related to')]
+
+
+def test_manifest_counts_rows_removed_from_the_file(tmp_path):
+    client = StubJamaClient()
+    manifest = ImportManifest(str(tmp_path / 'manifests'))
+    csv_file = write_csv(tmp_path / 'a.csv', [('1', '2', 'Related to'), ('3', '4', 'Related to')])
+    import_file(CSVRelationshipImporter(client, manifest=manifest), csv_file)
+
+    write_csv(tmp_path / 'a.csv', [('1', '2', 'Related to')])
+    second_run = import_file(CSVRelationshipImporter(client, manifest=manifest), csv_file)
+
+    assert (second_run['posted'], second_run['skipped_unchanged'], second_run['removed']) == (0, 1, 1)
+
+
+def test_relationships_already_in_jama_are_skipped(tmp_path):
+    client = StubJamaClient(existing_relationships=[{'id': 7, 'fromItem': 1, 'toItem': 2, 'relationshipType': 4}])
+    importer = CSVRelationshipImporter(client)
+    importer.load_csv_data(write_csv(tmp_path / 'a.csv', [('1', '2'), ('3', '4')]), True, [], 'Source', 'Target',
+                           None)
+    importer.process_relationships(False, [1], [1], None, None, 4, skip_existing=True)
+    importer.post_relationships()
+
+    assert importer.get_summary()['skipped_existing'] == 1
+    assert client.posts == [('3', '4', 4)]
+    assert client.calls['get_relationships'] == 1
+
+
+def test_resume_skips_journaled_rows(tmp_path):
+    client = StubJamaClient()
+    journal_file = str(tmp_path / 'journal.csv')
+    csv_file = write_csv(tmp_path / 'a.csv', [('1', '2', 'Related to'), ('3', '4', 'Related to')])
+
+    journal = ImportJournal(journal_file)
+    journal.record(csv_file, 0, 99)
+    journal.close()
+    journal = ImportJournal(journal_file, resume=True)
+    summary = import_file(CSVRelationshipImporter(client, journal=journal, resume=True), csv_file)
+    journal.close()
+
+    assert summary['skipped_journaled'] == 1
+    assert client.posts == [('3', '4', 'Related to')]
+
+
+def test_resume_posts_rows_of_a_rewritten_file(tmp_path):
+    client = StubJamaClient()
+    journal_file = str(tmp_path / 'journal.csv')
+    csv_file = write_csv(tmp_path / 'a.csv', [('1', '2', 'Related to'), ('3', '4', 'Related to')])
+
+    journal = ImportJournal(journal_file)
+    import_file(CSVRelationshipImporter(client, journal=journal), csv_file)
+    journal.close()
+    write_csv(tmp_path / 'a.csv', [('1', '2', 'Related to'), ('5', '6', 'Related to')])
+    journal = ImportJournal(journal_file, resume=True)
+    summary = import_file(CSVRelationshipImporter(client, journal=journal, resume=True), csv_file)
+    journal.close()
+
+    assert summary['skipped_journaled'] == 1
+    assert client.posts == [('1', '2', 'Related to'), ('3', '4', 'Related to'), ('5', '6', 'Related to')]
@@ -0,0 +1,78 @@
+"""
+Tests for the streaming pipeline of the importer.
+"""
+
+import threading
+
+from csv_relationship_importer import CSVRelationshipImporter
+from stub_client import StubJamaClient, write_csv
+
+
+def legacy_rows(row_count):
+    return [('LEG-{}'.format(row), 'LEG-{}'.format(row + 1), 'Related to') for row in range(row_count)]
+
+
+def stream(importer, csv_file, using_custom_field=True, max_in_flight=1, queue_size=10):
+    importer.stream_relationships(csv_file, True, [], 'Source', 'Target', 'Type', using_custom_field, [1], [1],
+                                  'legacy_id', 'legacy_id', 4, False, False, 0, 1, max_in_flight, queue_size)
+
+
+def run_with_timeout(function, timeout=10):
+    """
+    Run a function on a thread.
+    :return: the exception it raised, or None.  Fails the test if it is still running after the timeout.
+    """
+    errors = []
+
+    def target():
+        try:
+            function()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'the stream hung'
+    return errors[0] if errors else None
+
+
+def test_stream_stops_when_resolving_fails(tmp_path):
+    # No item matches, and the unresolved rows can not be written because the dead-letter directory is a file.
+    (tmp_path / 'dead_letter').write_text('')
+    client = StubJamaClient()
+    importer = CSVRelationshipImporter(client, dead_letter_directory=str(tmp_path / 'dead_letter'))
+    csv_file = write_csv(tmp_path / 'rows.csv', legacy_rows(5000))
+
+    error = run_with_timeout(lambda: stream(importer, csv_file))
+
+    assert isinstance(error, OSError)
+    assert client.posts == []
+
+
+def test_stream_stops_when_posting_fails(tmp_path):
+    class FailingJournal:
+        def record(self, csv_file, row_number, relationship_id, row_fingerprint=None):
+            raise OSError('disk full')
+
+        def posted_rows(self, csv_file):
+            return {}
+
+    client = StubJamaClient()
+    importer = CSVRelationshipImporter(client, journal=FailingJournal())
+    csv_file = write_csv(tmp_path / 'rows.csv', legacy_rows(5000))
+
+    error = run_with_timeout(lambda: stream(importer, csv_file, using_custom_field=False, max_in_flight=4))
+
+    assert isinstance(error, OSError)
+    assert len(client.posts) < 5000
+
+
+def test_stream_posts_every_row(tmp_path):
+    client = StubJamaClient()
+    importer = CSVRelationshipImporter(client)
+    csv_file = write_csv(tmp_path / 'rows.csv', legacy_rows(500))
+
+    assert run_with_timeout(lambda: stream(importer, csv_file, using_custom_field=False, max_in_flight=4)) is None
+    assert len(client.posts) == 500
+    assert importer.get_summary()['posted'] == 500